@@ -0,0 +1,126 @@
+# Usage: python benchmarks/bench_check_id.py --help
+# Description: Compare the row-by-row and the vectorized way of correct_graph_data.py check_id on a synthetic relation file.
+#
+# Example:
+#    python benchmarks/bench_check_id.py --num-rows 10000000
+
+import os
+import re
+import sys
+import time
+import click
+import numpy as np
+import pandas as pd
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(root_dir, "graph_data", "scripts"))
+
+from correct_graph_data import find_id_issues  # noqa: E402
+
+entity_types = ["Gene", "Disease", "Compound", "Pathway", "Symptom"]
+
+
+def make_relations(num_rows: int, error_rate: float = 0.001, seed: int = 42):
+    """Make a synthetic relation table with a small fraction of invalid ids, relation types and entity types."""
+    rng = np.random.default_rng(seed)
+    types = np.array(entity_types)
+    source_types = types[rng.integers(0, len(types), size=num_rows)]
+    target_types = types[rng.integers(0, len(types), size=num_rows)]
+
+    df = pd.DataFrame(
+        {
+            "source_id": "ENTREZ:" + pd.Series(rng.integers(0, 10**6, size=num_rows)).astype(str),
+            "source_type": source_types,
+            "target_id": "MESH:D" + pd.Series(rng.integers(0, 10**6, size=num_rows)).astype(str),
+            "target_type": target_types,
+            "relation_type": "BENCH::REL::" + pd.Series(source_types) + ":" + pd.Series(target_types),
+        }
+    )
+
+    num_errors = int(num_rows * error_rate)
+    for col, value in [
+        ("source_id", "ENTREZ 1"),
+        ("relation_type", "BENCH:REL"),
+        ("source_type", "Unknown"),
+    ]:
+        df.loc[rng.choice(num_rows, size=num_errors, replace=False), col] = value
+
+    return df
+
+
+def check_entity_id(id: str):
+    # SYMP:0000149 --> <DB_NAME>:<ID>
+    if re.match(r"[a-zA-Z\-]+:[a-zA-Z0-9\-_]+", id):
+        return True
+    return False
+
+
+def _check_relation_type(id: str):
+    # STRING::BINDING::Gene:Gene --> <DB_NAME>::<RELATION_TYPE>::<ENTITY_TYPE>:<ENTITY_TYPE>
+    if re.match(r"[a-zA-Z]+::[a-zA-Z0-9 \-_\+\>]+::[a-zA-Z]+:[a-zA-Z]+", id):
+        return True
+    return False
+
+
+def find_id_issues_by_row(df: pd.DataFrame) -> int:
+    """The row-by-row way of the original check_id with its check functions above, it only counts the issues instead of printing them."""
+    num_issues = 0
+    for idx, row in df.iterrows():
+        if not check_entity_id(row["source_id"]):
+            num_issues += 1
+        if not check_entity_id(row["target_id"]):
+            num_issues += 1
+        if not _check_relation_type(row["relation_type"]):
+            num_issues += 1
+        else:
+            source_type, target_type = row["relation_type"].split("::")[2].split(":")
+            if (
+                source_type != row["source_type"] or target_type != row["target_type"]
+            ) and source_type != target_type:
+                num_issues += 1
+    return num_issues
+
+
+@click.command(help="Benchmark the row-by-row and the vectorized way of check_id")
+@click.option("--num-rows", "-n", type=int, default=10000000, help="Number of relations")
+@click.option(
+    "--row-by-row-rows",
+    "-r",
+    type=int,
+    default=100000,
+    help="Number of relations for the row-by-row way, its time is extrapolated to all relations. Set it to 0 to skip the row-by-row way.",
+)
+def cli(num_rows, row_by_row_rows):
+    start = time.perf_counter()
+    df = make_relations(num_rows)
+    print("Generated %s relations in %.2fs" % (num_rows, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    issues = find_id_issues(df, "relation")
+    elapsed = time.perf_counter() - start
+    print("%-10s: %.2fs, %s issues" % ("vectorized", elapsed, len(issues)))
+    print(issues.groupby(["column", "rule"]).size().to_string())
+
+    if row_by_row_rows > 0:
+        sample = df.head(row_by_row_rows)
+        start = time.perf_counter()
+        num_issues = find_id_issues_by_row(sample)
+        elapsed = time.perf_counter() - start
+        print(
+            "%-10s: %.2fs on %s relations (~%.0fs on all relations), %s issues"
+            % (
+                "row-by-row",
+                elapsed,
+                len(sample),
+                elapsed * num_rows / len(sample),
+                num_issues,
+            )
+        )
+        print(
+            "Same number of issues on the sample: %s"
+            % (num_issues == len(find_id_issues(sample, "relation")))
+        )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,130 @@
+# Usage: python benchmarks/bench_create_graph.py --help
+# Description: Compare the row-by-row and the bulk way of lib/graph.create_graph on a synthetic graph.
+#
+# Example:
+#    python benchmarks/bench_create_graph.py --num-edges 2000000 --num-nodes 200000
+
+import os
+import sys
+import time
+import click
+import tempfile
+import numpy as np
+import pandas as pd
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(root_dir, "lib"))
+
+from graph import create_graph, allowed_types  # noqa: E402
+
+
+def make_relations(num_nodes: int, num_edges: int, seed: int = 42) -> pd.DataFrame:
+    """Make a synthetic relation table with the same columns as the relations.tsv.
+
+    Args:
+        num_nodes (int): number of nodes.
+        num_edges (int): number of edges.
+        seed (int, optional): random seed. Defaults to 42.
+
+    Returns:
+        pd.DataFrame: relations.
+    """
+    rng = np.random.default_rng(seed)
+    # Use a few unknown types to exercise the allowed_types filter
+    node_types = np.array(allowed_types + ["Unknown", "Other"])
+    type_of_node = rng.integers(0, len(node_types), size=num_nodes)
+
+    sources = rng.integers(0, num_nodes, size=num_edges)
+    targets = rng.integers(0, num_nodes, size=num_edges)
+    source_types = node_types[type_of_node[sources]]
+    target_types = node_types[type_of_node[targets]]
+    relation_types = (
+        "BENCH::REL"
+        + pd.Series(rng.integers(0, 8, size=num_edges)).astype(str)
+        + "::"
+        + pd.Series(source_types)
+        + ":"
+        + pd.Series(target_types)
+    )
+
+    return pd.DataFrame(
+        {
+            "source_id": pd.Series(sources).map("ENTREZ:{}".format),
+            "source_type": source_types,
+            "target_id": pd.Series(targets).map("ENTREZ:{}".format),
+            "target_type": target_types,
+            "relation_type": relation_types,
+            "resource": "BENCH",
+        }
+    )
+
+
+def is_same_graph(G1, G2) -> bool:
+    """Check whether two graphs have the same nodes, edges, attributes and insertion order."""
+    if type(G1) != type(G2):
+        return False
+
+    if list(G1.nodes(data=True)) != list(G2.nodes(data=True)):
+        return False
+
+    if G1.is_multigraph():
+        return list(G1.edges(keys=True, data=True)) == list(
+            G2.edges(keys=True, data=True)
+        )
+    return list(G1.edges(data=True)) == list(G2.edges(data=True))
+
+
+@click.command(help="Benchmark the row-by-row and the bulk way of create_graph")
+@click.option("--num-nodes", "-n", type=int, default=200000, help="Number of nodes")
+@click.option(
+    "--num-edges", "-e", type=int, default=2000000, help="Number of edges"
+)
+@click.option(
+    "--directed/--undirected", default=True, help="Build a directed graph or not"
+)
+@click.option(
+    "--allow-multiple-edges/--no-multiple-edges",
+    default=True,
+    help="Allow multiple edges between the same nodes",
+)
+@click.option(
+    "--skip-row-by-row",
+    is_flag=True,
+    help="Only run the bulk way, the row-by-row way takes tens of minutes on millions of edges",
+)
+def cli(num_nodes, num_edges, directed, allow_multiple_edges, skip_row_by_row):
+    relations = make_relations(num_nodes, num_edges)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        relation_file = os.path.join(tmp_dir, "relations.tsv")
+        relations.to_csv(relation_file, sep="\t", index=False)
+        print("Generated %s edges between %s nodes" % (num_edges, num_nodes))
+
+        graphs = {}
+        for bulk in ([True] if skip_row_by_row else [True, False]):
+            name = "bulk" if bulk else "row-by-row"
+            start = time.perf_counter()
+            graphs[name] = create_graph(
+                relation_file,
+                allowed_types=allowed_types,
+                directed=directed,
+                allow_multiple_edges=allow_multiple_edges,
+                bulk=bulk,
+            )
+            elapsed = time.perf_counter() - start
+            print(
+                "%-10s: %.2fs, %s nodes, %s edges"
+                % (
+                    name,
+                    elapsed,
+                    graphs[name].number_of_nodes(),
+                    graphs[name].number_of_edges(),
+                )
+            )
+
+    if len(graphs) == 2:
+        print("Same graph: %s" % is_same_graph(graphs["bulk"], graphs["row-by-row"]))
+
+
+if __name__ == "__main__":
+    cli()
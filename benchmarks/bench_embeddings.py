@@ -0,0 +1,163 @@
+# Usage: python benchmarks/bench_embeddings.py --help
+# Description: Compare the one-by-one and the batched way of gen_embeddings.py on synthetic texts, it also checks that both ways generate the same embeddings.
+#
+# Example:
+#    python benchmarks/bench_embeddings.py --num-texts 2000
+#    python benchmarks/bench_embeddings.py --model-name dmis-lab/biobert-base-cased-v1.1 --num-texts 500
+
+import os
+import sys
+import time
+import click
+import torch
+import tempfile
+import numpy as np
+from transformers import AutoTokenizer, BertConfig, BertModel, BertTokenizerFast
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(root_dir, "embeddings", "scripts"))
+
+from gen_embeddings import load_model, embed_texts, pooling_methods  # noqa: E402
+
+words = [
+    "gene", "disease", "protein", "cell", "cancer", "kinase", "binding", "receptor",
+    "human", "mouse", "pathway", "tumor", "signaling", "expression", "syndrome",
+    "the", "of", "a", "in", "is", "and", "to", "with", "by",
+]
+
+
+def make_tiny_model(model_dir: str, seed: int = 42):
+    """Save a randomly initialized BERT model and its tokenizer, so the benchmark doesn't download a model."""
+    torch.manual_seed(seed)
+    vocab_file = os.path.join(model_dir, "vocab.txt")
+    with open(vocab_file, "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words) + "\n")
+    config = BertConfig(
+        vocab_size=len(words) + 5,
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        intermediate_size=128,
+    )
+    BertModel(config).save_pretrained(model_dir)
+    BertTokenizerFast(vocab_file=vocab_file).save_pretrained(model_dir)
+
+
+def make_texts(num_texts: int, max_words: int = 100, seed: int = 42):
+    """Make texts of random words whose lengths are skewed like the entity descriptions, most are short and a few are long."""
+    rng = np.random.default_rng(seed)
+    lengths = np.minimum(rng.geometric(1 / 15, size=num_texts), max_words)
+    return [" ".join(rng.choice(words, size=length)) for length in lengths]
+
+
+def embed_one_by_one(tokenizer, model, texts, max_len):
+    """The original generate_embedding for the texts within max_len: one unpadded text per forward pass and the mean of all tokens."""
+    embeddings = []
+    with torch.no_grad():
+        for text in texts:
+            inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=max_len)
+            outputs = model(**inputs)
+            embeddings.append(torch.mean(outputs.last_hidden_state, dim=1)[0].numpy())
+    return np.stack(embeddings)
+
+
+def check_pad(tokenizer, texts, max_len) -> bool:
+    """embed_texts tokenizes all texts once and pads each batch with tokenizer.pad, it must be the same as tokenizing the batch with padding."""
+    encodings = tokenizer(texts, truncation=True, max_length=max_len)
+    padded = tokenizer.pad(
+        {key: [encodings[key][i] for i in range(len(texts))] for key in encodings.keys()},
+        padding=True,
+        return_tensors="pt",
+    )
+    expected = tokenizer(
+        texts, truncation=True, max_length=max_len, padding=True, return_tensors="pt"
+    )
+    return padded.keys() == expected.keys() and all(
+        torch.equal(padded[key], expected[key]) for key in expected.keys()
+    )
+
+
+def compare_batch_sizes(tokenizer, model, texts, max_len, batch_size, pooling) -> float:
+    """Embed the texts with batch size 1 and with the batch size, a text must get the same embedding in any batch."""
+    one = embed_texts(tokenizer, model, texts, max_len, batch_size=1, pooling=pooling)
+    many = embed_texts(
+        tokenizer, model, texts, max_len, batch_size=batch_size, pooling=pooling
+    )
+    return np.abs(one - many).max()
+
+
+def timeit(label: str, func):
+    start = time.perf_counter()
+    result = func()
+    print("%-40s: %.2fs" % (label, time.perf_counter() - start))
+    return result
+
+
+@click.command(help="Benchmark the one-by-one and the batched way of gen_embeddings.py")
+@click.option(
+    "--model-name",
+    "-m",
+    help="Model name/path. By default, a small randomly initialized BERT model is used.",
+    default=None,
+)
+@click.option("--num-texts", "-n", type=int, default=2000, help="Number of texts")
+@click.option("--batch-size", "-b", type=int, default=32, help="Number of texts per batch")
+@click.option("--num-threads", "-t", type=int, default=None, help="Number of threads of torch")
+@click.option(
+    "--num-pooling-texts",
+    type=int,
+    default=200,
+    help="Number of texts which are embedded with batch size 1 and with the batch size for each pooling method",
+)
+def cli(model_name, num_texts, batch_size, num_threads, num_pooling_texts):
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if model_name is None:
+            make_tiny_model(tmp_dir)
+            model_name = tmp_dir
+
+        tokenizer, model = load_model(model_name)
+        model.eval()
+        max_len = min(512, model.config.max_position_embeddings)
+        texts = make_texts(num_texts)
+
+        for use_fast in [True, False]:
+            other = AutoTokenizer.from_pretrained(model_name, use_fast=use_fast)
+            other.padding_side = tokenizer.padding_side
+            print(
+                "Same inputs after tokenizer.pad (%s): %s"
+                % (type(other).__name__, check_pad(other, texts[:100], max_len))
+            )
+
+        one_by_one = timeit(
+            "One by one", lambda: embed_one_by_one(tokenizer, model, texts, max_len)
+        )
+        batched = timeit(
+            "Batched (batch size %s)" % batch_size,
+            lambda: embed_texts(tokenizer, model, texts, max_len, batch_size=batch_size),
+        )
+        print(
+            "Same embeddings: %s (max abs diff %.2e)"
+            % (
+                np.allclose(one_by_one, batched, atol=1e-5, rtol=1e-4),
+                np.abs(one_by_one - batched).max(),
+            )
+        )
+
+        # load_model pads on the right, so the positions of the real tokens don't depend on the padding
+        for padding_side in ["right", "left"]:
+            tokenizer.padding_side = padding_side
+            for pooling in pooling_methods:
+                diff = compare_batch_sizes(
+                    tokenizer, model, texts[:num_pooling_texts], max_len, batch_size, pooling
+                )
+                print(
+                    "Same embeddings with batch size 1 and %s (%s pooling, %s padding): %s (max abs diff %.2e)"
+                    % (batch_size, pooling, padding_side, diff < 1e-4, diff)
+                )
+
+
+if __name__ == "__main__":
+    cli()
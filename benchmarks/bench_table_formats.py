@@ -0,0 +1,119 @@
+# Usage: python benchmarks/bench_table_formats.py --help
+# Description: Compare the size and the load time of a synthetic knowledge graph saved as a tsv file and as a parquet file.
+#
+# Example:
+#    python benchmarks/bench_table_formats.py --num-rows 10000000
+
+import os
+import sys
+import time
+import click
+import tempfile
+import numpy as np
+import pandas as pd
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(root_dir, "lib"))
+
+from kg_loader import read_relation_table, write_table  # noqa: E402
+
+entity_types = ["Gene", "Disease", "Compound", "Pathway", "Symptom"]
+resources = ["STRING", "DRUGBANK", "HSDN", "CTD", "PrimeKG"]
+
+
+def make_knowledge_graph(num_rows: int, seed: int = 42) -> pd.DataFrame:
+    """Make a synthetic knowledge graph with the columns of knowledge_graph.tsv."""
+    rng = np.random.default_rng(seed)
+    types = np.array(entity_types)
+    source_types = pd.Series(types[rng.integers(0, len(types), size=num_rows)])
+    target_types = pd.Series(types[rng.integers(0, len(types), size=num_rows)])
+    source_ids = pd.Series(rng.integers(0, 10**6, size=num_rows)).astype(str)
+    target_ids = pd.Series(rng.integers(0, 10**6, size=num_rows)).astype(str)
+    pmids = pd.Series(rng.integers(10**7, 4 * 10**7, size=num_rows)).astype(str)
+
+    return pd.DataFrame(
+        {
+            "relation_type": "BENCH::REL::" + source_types + ":" + target_types,
+            "resource": np.array(resources)[rng.integers(0, len(resources), num_rows)],
+            "pmids": pmids.where(rng.random(num_rows) < 0.3, ""),
+            "key_sentence": "",
+            "source_id": "ENTREZ:" + source_ids,
+            "source_type": source_types,
+            "target_id": "MESH:D" + target_ids,
+            "target_type": target_types,
+            "source_name": "gene " + source_ids,
+            "target_name": "disease " + target_ids,
+        }
+    )
+
+
+def timeit(label: str, func):
+    start = time.perf_counter()
+    result = func()
+    print("%-40s: %.2fs" % (label, time.perf_counter() - start))
+    return result
+
+
+@click.command(help="Benchmark the tsv and the parquet format of the knowledge graph")
+@click.option("--num-rows", "-n", type=int, default=10000000, help="Number of relations")
+@click.option(
+    "--output-dir",
+    "-o",
+    type=click.Path(file_okay=False, dir_okay=True),
+    default=None,
+    help="Directory of the generated files. Defaults to a temporary directory which is removed at the end.",
+)
+def cli(num_rows, output_dir):
+    df = timeit("Generate %s relations" % num_rows, lambda: make_knowledge_graph(num_rows))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_dir = output_dir or tmp_dir
+        os.makedirs(output_dir, exist_ok=True)
+        tsv_file = os.path.join(output_dir, "knowledge_graph.tsv")
+        parquet_file = os.path.join(output_dir, "knowledge_graph.parquet")
+
+        timeit("Write tsv", lambda: write_table(df, tsv_file, "tsv"))
+        timeit("Write parquet", lambda: write_table(df, parquet_file, "parquet"))
+        for filepath in [tsv_file, parquet_file]:
+            print(
+                "%-40s: %.1f MB"
+                % ("Size of " + os.path.basename(filepath), os.path.getsize(filepath) / 1024**2)
+            )
+
+        timeit("Load tsv (pd.read_csv)", lambda: pd.read_csv(tsv_file, sep="\t"))
+        from_tsv = timeit("Load tsv (read_relation_table)", lambda: read_relation_table(tsv_file))
+        from_parquet = timeit(
+            "Load parquet (read_relation_table)", lambda: read_relation_table(parquet_file)
+        )
+        print(
+            "Same relations: %s"
+            % from_tsv.astype(object).fillna("").equals(from_parquet.astype(object).fillna(""))
+        )
+
+        # What CompactKG.from_relation_file loads with allowed_types
+        usecols = ["source_id", "source_type", "target_id", "target_type", "relation_type"]
+        filters = [
+            ("source_type", "in", ["Gene", "Compound"]),
+            ("target_type", "in", ["Gene", "Disease"]),
+        ]
+        subset_tsv = timeit(
+            "Load 5 columns with filters from tsv",
+            lambda: read_relation_table(tsv_file, usecols=usecols, filters=filters),
+        )
+        subset_parquet = timeit(
+            "Load 5 columns with filters from parquet",
+            lambda: read_relation_table(parquet_file, usecols=usecols, filters=filters),
+        )
+        print(
+            "Same relations: %s (%s relations)"
+            % (
+                subset_tsv.astype(object).reset_index(drop=True).equals(
+                    subset_parquet.astype(object).reset_index(drop=True)
+                ),
+                len(subset_parquet),
+            )
+        )
+
+
+if __name__ == "__main__":
+    cli()
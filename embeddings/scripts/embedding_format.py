@@ -0,0 +1,70 @@
+import os
+import numpy as np
+import pandas as pd
+from typing import List, Tuple
+
+# The embedding files are read and written without torch, so they can be loaded in the notebooks (see utils.py).
+
+
+def get_embedding_files(path: str) -> Tuple[str, str]:
+    """Get the files of the binary format, such as entities_embeddings.npy -> (entities_embeddings.npy, entities_embeddings.ids.tsv)."""
+    root = os.path.splitext(path)[0]
+    return root + ".npy", root + ".ids.tsv"
+
+
+def format_embeddings(embeddings: np.ndarray) -> List[str]:
+    return ["|".join([str(value) for value in embedding]) for embedding in embeddings]
+
+
+def parse_embeddings(values: pd.Series, dtype=np.float32) -> np.ndarray:
+    """Parse the embeddings which are strings of numbers separated by pipes to a matrix in one call."""
+    if len(values) == 0:
+        return np.empty((0, 0), dtype=dtype)
+    numbers = np.array("|".join(values.astype(str)).split("|"), dtype=dtype)
+    return numbers.reshape(len(values), -1)
+
+
+def write_embeddings(metadata: pd.DataFrame, embeddings: np.ndarray, output: str):
+    """Write the embeddings and their metadata (such as embedding_id, entity_id, ...).
+
+    If the output file ends with .npy, the embeddings are saved as a float32 matrix to the npy file and the metadata to the <name>.ids.tsv file, the i-th row of the matrix is the embedding of the i-th row of the metadata. Otherwise, the embeddings are saved to the embedding column of a tsv file as strings of numbers separated by pipes.
+    """
+    if output.endswith(".npy"):
+        matrix_file, ids_file = get_embedding_files(output)
+        np.save(matrix_file, np.asarray(embeddings, dtype=np.float32))
+        metadata.drop(columns=["embedding"], errors="ignore").to_csv(
+            ids_file, sep="\t", index=False
+        )
+    else:
+        metadata = metadata.drop(columns=["embedding"], errors="ignore")
+        metadata["embedding"] = format_embeddings(embeddings)
+        metadata.to_csv(output, sep="\t", index=False)
+
+
+def read_embeddings(
+    path: str, mmap=True, dtype=np.float32
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Read the embeddings which are written by write_embeddings.
+
+    Args:
+        path (str): the npy file or the tsv file.
+        mmap (bool, optional): memory-map the npy file instead of reading it into memory. Defaults to True.
+        dtype (optional): the dtype of the embeddings which are parsed from a tsv file. Defaults to np.float32.
+
+    Returns:
+        Tuple[pd.DataFrame, np.ndarray]: the metadata without the embedding column and the embeddings.
+    """
+    if path.endswith(".npy"):
+        matrix_file, ids_file = get_embedding_files(path)
+        metadata = pd.read_csv(ids_file, sep="\t")
+        embeddings = np.load(matrix_file, mmap_mode="r" if mmap else None)
+    else:
+        metadata = pd.read_csv(path, sep="\t")
+        embeddings = parse_embeddings(metadata.pop("embedding"), dtype=dtype)
+
+    if len(metadata) != len(embeddings):
+        raise ValueError(
+            "%s has %s rows of metadata but %s embeddings"
+            % (path, len(metadata), len(embeddings))
+        )
+    return metadata, embeddings
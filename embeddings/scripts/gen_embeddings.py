@@ -1,11 +1,18 @@
+import os
+import json
+import time
 import click
+import shutil
+import sqlite3
+import hashlib
 import torch
 import numpy as np
 import pandas as pd
 from sklearn.manifold import TSNE
 from sklearn.decomposition import PCA
 from umap.umap_ import UMAP
-from typing import Tuple
+from typing import List, Tuple
+from embedding_format import write_embeddings, read_embeddings
 from transformers import (
     AutoConfig,
     AutoModel,
@@ -57,6 +64,8 @@ def load_model(
     model_name: str,
 ) -> Tuple[PreTrainedTokenizer | PreTrainedTokenizerFast, PreTrainedModel]:
     tokenizer = AutoTokenizer.from_pretrained(model_name)
+    # The real tokens of a padded batch keep the same positions as an unpadded text
+    tokenizer.padding_side = "right"
     model = AutoModel.from_pretrained(model_name)
 
     return tokenizer, model
@@ -71,39 +80,362 @@ def get_max_len(model_name: str) -> int:
     return max_length
 
 
-def generate_embedding(
+pooling_methods = ["mean", "cls", "max"]
+
+
+def pool_embeddings(
+    last_hidden_state: torch.Tensor,
+    attention_mask: torch.Tensor,
+    pooling: str = "mean",
+) -> torch.Tensor:
+    """Pool the token embeddings of a batch to one embedding per text, the padding tokens are always excluded, so a text gets the same embedding in any batch.
+
+    Args:
+        last_hidden_state (torch.Tensor): the token embeddings, (batch, tokens, hidden).
+        attention_mask (torch.Tensor): 1 for the real tokens and 0 for the padding tokens, (batch, tokens).
+        pooling (str, optional): mean (the mean of the real tokens), cls (the first real token, i.e. [CLS] or <s>) or max (the maximum of the real tokens in each dimension). Defaults to "mean".
+
+    Returns:
+        torch.Tensor: the pooled embeddings, (batch, hidden).
+    """
+    mask = attention_mask.unsqueeze(-1).bool()
+    if pooling == "mean":
+        mask = mask.to(last_hidden_state.dtype)
+        summed = (last_hidden_state * mask).sum(dim=1)
+        return summed / mask.sum(dim=1).clamp(min=1)
+    elif pooling == "cls":
+        first = attention_mask.argmax(dim=1)
+        return last_hidden_state[torch.arange(len(first)), first]
+    elif pooling == "max":
+        lowest = torch.finfo(last_hidden_state.dtype).min
+        return last_hidden_state.masked_fill(~mask, lowest).max(dim=1).values
+    else:
+        raise ValueError("Unknown pooling method: %s" % pooling)
+
+
+def embed_texts(
     tokenizer: PreTrainedTokenizer | PreTrainedTokenizerFast,
     model: PreTrainedModel,
-    text: str,
+    texts: List[str],
     max_len: int,
+    batch_size: int = 32,
+    pooling: str = "mean",
 ) -> np.ndarray:
-    # Tokenize and encode the sentence
-    inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True)
-
-    num_tokens = len(inputs.tokens())
-    print("Generating embedding for: %s, %s, %s" % (text, max_len, num_tokens))
-
-    # Make sure that the input ids are not longer than the maximum length
-    if num_tokens > max_len:
-        inputs = tokenizer(
-            text,
-            return_tensors="pt",
-            padding="max_length",
-            truncation=True,
-            max_length=max_len,
+    """Generate the embeddings of the texts batch by batch.
+
+    The texts are tokenized once and sorted by their number of tokens, so the texts of a batch have similar lengths and the padding is small.
+
+    Args:
+        tokenizer (PreTrainedTokenizer | PreTrainedTokenizerFast): the tokenizer.
+        model (PreTrainedModel): the model.
+        texts (List[str]): the texts.
+        max_len (int): the maximum number of tokens, the longer texts are truncated.
+        batch_size (int, optional): the number of texts per batch. Defaults to 32.
+        pooling (str, optional): the pooling method, see pool_embeddings. Defaults to "mean".
+
+    Returns:
+        np.ndarray: the float32 embeddings in the order of the texts, one row per text.
+    """
+    encodings = tokenizer(list(texts), truncation=True, max_length=max_len)
+    lengths = [len(input_ids) for input_ids in encodings["input_ids"]]
+    order = np.argsort(lengths, kind="stable")
+
+    embeddings = np.empty((len(texts), model.config.hidden_size), dtype=np.float32)
+    with torch.inference_mode():
+        for start in range(0, len(texts), batch_size):
+            indices = order[start : start + batch_size]
+            inputs = tokenizer.pad(
+                {key: [encodings[key][i] for i in indices] for key in encodings.keys()},
+                padding=True,
+                return_tensors="pt",
+            )
+            outputs = model(**inputs)
+
+            # The embeddings are usually in the 'last_hidden_state' key of the model outputs
+            pooled = pool_embeddings(
+                outputs.last_hidden_state, inputs["attention_mask"], pooling
+            )
+            embeddings[indices] = pooled.float().numpy()
+
+    return embeddings
+
+
+class EmbeddingCache:
+    """A persistent cache of the embeddings in a SQLite database.
+
+    An embedding is keyed by the model name, the pooling method, the maximum number of tokens and the sha256 of the text, so an unchanged text is never embedded twice by the same model, even across the releases of the knowledge graph.
+    """
+
+    def __init__(self, path: str, model_name: str, pooling: str, max_len: int):
+        self.key = (model_name, pooling, max_len)
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                pooling TEXT NOT NULL,
+                max_len INTEGER NOT NULL,
+                text_sha256 TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                PRIMARY KEY (model, pooling, max_len, text_sha256)
+            ) WITHOUT ROWID
+            """
         )
 
-    # Pass the input to the model
-    with torch.no_grad():
-        outputs = model(**inputs)
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, hashes: List[str]) -> dict:
+        """Get the cached embeddings of the text hashes, the missing hashes aren't in the result."""
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        # SQLite limits the number of variables of a query
+        for start in range(0, len(unique_hashes), 500):
+            part = unique_hashes[start : start + 500]
+            rows = self._conn.execute(
+                "SELECT text_sha256, embedding FROM embeddings WHERE model = ? AND pooling = ? AND max_len = ? AND text_sha256 IN (%s)"
+                % ",".join("?" * len(part)),
+                (*self.key, *part),
+            )
+            for text_hash, blob in rows:
+                found[text_hash] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, hashes: List[str], embeddings: np.ndarray):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)",
+            [
+                (*self.key, text_hash, np.asarray(embedding, dtype=np.float32).tobytes())
+                for text_hash, embedding in zip(hashes, embeddings)
+            ],
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
 
-    # The embeddings are usually in the 'last_hidden_state' key of the model outputs
-    embeddings = outputs.last_hidden_state
+    def report(self):
+        total = self.hits + self.misses
+        print(
+            "Embedding cache: %s hits, %s misses (%.1f%% hits)"
+            % (self.hits, self.misses, 100 * self.hits / total if total else 0)
+        )
 
-    # Calculate the mean of token embeddings along the token dimension (dimension 1)
-    sentence_embedding = torch.mean(embeddings, dim=1)
 
-    return sentence_embedding[0].numpy()
+def embed_texts_with_cache(
+    tokenizer: PreTrainedTokenizer | PreTrainedTokenizerFast,
+    model: PreTrainedModel,
+    texts: List[str],
+    max_len: int,
+    batch_size: int = 32,
+    pooling: str = "mean",
+    cache: EmbeddingCache = None,
+) -> np.ndarray:
+    """The same as embed_texts, but only the texts which aren't in the cache are embedded by the model, and their embeddings are added to the cache. The same text is embedded once."""
+    if cache is None:
+        return embed_texts(tokenizer, model, texts, max_len, batch_size, pooling)
+
+    hashes = [cache.hash_text(text) for text in texts]
+    found = cache.get_many(hashes)
+
+    missing = {}
+    num_missing = 0
+    for text_hash, text in zip(hashes, texts):
+        if text_hash not in found:
+            missing.setdefault(text_hash, text)
+            num_missing += 1
+    cache.hits += len(texts) - num_missing
+    cache.misses += num_missing
+
+    if missing:
+        embeddings = embed_texts(
+            tokenizer, model, list(missing.values()), max_len, batch_size, pooling
+        )
+        cache.put_many(list(missing.keys()), embeddings)
+        found.update(zip(missing.keys(), embeddings))
+
+    result = np.empty((len(texts), model.config.hidden_size), dtype=np.float32)
+    for i, text_hash in enumerate(hashes):
+        result[i] = found[text_hash]
+    return result
+
+
+def iter_embeddings(
+    tokenizer: PreTrainedTokenizer | PreTrainedTokenizerFast,
+    model: PreTrainedModel,
+    texts: List[str],
+    max_len: int,
+    batch_size: int = 32,
+    pooling: str = "mean",
+    window_size: int = None,
+    cache: EmbeddingCache = None,
+):
+    """Generate the embeddings of many texts window by window and report the progress and the throughput.
+
+    The tokens of all texts are never kept in memory at once.
+
+    Args:
+        window_size (int, optional): the number of texts per window. Defaults to None, i.e. 64 batches.
+        cache (EmbeddingCache, optional): the cache of the embeddings. Defaults to None.
+
+    Yields:
+        Tuple[int, np.ndarray]: the position of the first text of the window and the embeddings of the window.
+    """
+    window_size = window_size or batch_size * 64
+    start_time = time.perf_counter()
+    for start in range(0, len(texts), window_size):
+        window = texts[start : start + window_size]
+        yield start, embed_texts_with_cache(
+            tokenizer, model, window, max_len, batch_size, pooling, cache
+        )
+
+        num_done = start + len(window)
+        elapsed = time.perf_counter() - start_time
+        print(
+            "Generated embeddings for %s/%s texts, %.1f texts/s"
+            % (num_done, len(texts), num_done / elapsed)
+        )
+
+
+def generate_embeddings(
+    tokenizer: PreTrainedTokenizer | PreTrainedTokenizerFast,
+    model: PreTrainedModel,
+    texts: List[str],
+    max_len: int,
+    batch_size: int = 32,
+    pooling: str = "mean",
+    cache: EmbeddingCache = None,
+) -> np.ndarray:
+    """Generate the embeddings of many texts, see iter_embeddings."""
+    embeddings = [
+        window
+        for _, window in iter_embeddings(
+            tokenizer, model, texts, max_len, batch_size, pooling, cache=cache
+        )
+    ]
+
+    if not embeddings:
+        return np.empty((0, model.config.hidden_size), dtype=np.float32)
+    return np.concatenate(embeddings)
+
+
+def get_entity_keys(ids: pd.Series, labels: pd.Series) -> pd.Index:
+    return pd.Index(labels.astype(str) + "::" + ids.astype(str))
+
+
+def write_shard(shard_dir: str, shard_num: int, entities: pd.DataFrame, embeddings: np.ndarray):
+    """Write the embeddings of a part of the entities to shard-<num>.npy and the ids and labels to shard-<num>.ids.tsv.
+
+    The files are renamed after they are written and the npy file is the last one, so a shard is complete if its npy file exists.
+    """
+    prefix = os.path.join(shard_dir, "shard-%05d" % shard_num)
+    entities[["id", "label"]].to_csv(prefix + ".ids.tsv.tmp", sep="\t", index=False)
+    with open(prefix + ".npy.tmp", "wb") as f:
+        np.save(f, embeddings.astype(np.float32, copy=False))
+
+    os.replace(prefix + ".ids.tsv.tmp", prefix + ".ids.tsv")
+    os.replace(prefix + ".npy.tmp", prefix + ".npy")
+
+
+def get_shard_files(shard_dir: str) -> List[str]:
+    return sorted(
+        x for x in os.listdir(shard_dir) if x.startswith("shard-") and x.endswith(".npy")
+    )
+
+
+def get_next_shard_num(shard_dir: str) -> int:
+    shard_files = get_shard_files(shard_dir)
+    return int(shard_files[-1][len("shard-") : -len(".npy")]) + 1 if shard_files else 0
+
+
+def iter_shards(shard_dir: str):
+    """Iterate the complete shards of a directory in order. The embeddings are memory-mapped, so only the header of a npy file is read until the embeddings are used.
+
+    Yields:
+        Tuple[pd.Index, np.ndarray]: the label::id keys and the embeddings of a shard.
+    """
+    for shard_file in get_shard_files(shard_dir):
+        prefix = os.path.join(shard_dir, shard_file[: -len(".npy")])
+        ids = pd.read_csv(prefix + ".ids.tsv", sep="\t", dtype=str, keep_default_na=False)
+        shard = np.load(prefix + ".npy", mmap_mode="r")
+        if len(ids) != len(shard):
+            print("Skip the incomplete shard %s" % prefix)
+            continue
+
+        yield get_entity_keys(ids["id"], ids["label"]), shard
+
+
+def load_shard_keys(shard_dir: str) -> pd.Index:
+    """Load the label::id keys of the entities which have embeddings in the shards of a directory."""
+    keys = [shard_keys for shard_keys, _ in iter_shards(shard_dir)]
+    return keys[0].append(keys[1:]) if keys else pd.Index([])
+
+
+def merge_shards(shard_dir: str, keys: pd.Index) -> np.ndarray:
+    """Gather the embeddings of the keys from the shards of a directory, the first embedding of a duplicated key is used.
+
+    Only the merged embeddings are in memory, the shards are memory-mapped and copied one by one.
+    """
+    shards = list(iter_shards(shard_dir))
+    if not shards:
+        shard_keys = pd.Index([])
+    else:
+        shard_keys = shards[0][0].append([shard_keys for shard_keys, _ in shards[1:]])
+
+    is_first = ~shard_keys.duplicated()
+    positions = shard_keys[is_first].get_indexer(keys)
+    if (positions < 0).any():
+        raise ValueError(
+            "%s entities have no embeddings in %s" % ((positions < 0).sum(), shard_dir)
+        )
+    # The rows in the concatenation of all shards
+    rows = np.flatnonzero(is_first)[positions]
+
+    dim = shards[0][1].shape[1] if shards else 0
+    embeddings = np.empty((len(keys), dim), dtype=np.float32)
+    offset = 0
+    for _, shard in shards:
+        in_shard = (rows >= offset) & (rows < offset + len(shard))
+        embeddings[in_shard] = shard[rows[in_shard] - offset]
+        offset += len(shard)
+    return embeddings
+
+
+def check_shard_manifest(shard_dir: str, manifest: dict):
+    """Write the settings of a run (such as the model name and the pooling method) to the manifest.json of a new shard directory, or check that the shards of an interrupted run have the same settings, so the embeddings of different models are never merged."""
+    manifest_file = os.path.join(shard_dir, "manifest.json")
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            shard_manifest = json.load(f)
+        if shard_manifest != manifest:
+            raise ValueError(
+                "The shards in %s are generated with %s, but this run uses %s. Run the command with the same options to resume it, or remove the directory to start again."
+                % (shard_dir, shard_manifest, manifest)
+            )
+    elif get_shard_files(shard_dir):
+        raise ValueError(
+            "The shards in %s have no manifest.json, so it's unknown which model generated them. Remove the directory to start again."
+            % shard_dir
+        )
+    else:
+        with open(manifest_file + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def generate_embedding(
+    tokenizer: PreTrainedTokenizer | PreTrainedTokenizerFast,
+    model: PreTrainedModel,
+    text: str,
+    max_len: int,
+    pooling: str = "mean",
+) -> np.ndarray:
+    return embed_texts(
+        tokenizer, model, [text], max_len, batch_size=1, pooling=pooling
+    )[0]
 
 
 cli = click.Group()
@@ -119,22 +451,124 @@ cli = click.Group()
     help="Model name/path",
     required=True,
 )
-@click.option("--output", "-o", type=str, help="Output file", required=True)
-def entities(entity_file: str, model_name: str, output: str) -> None:
+@click.option(
+    "--output",
+    "-o",
+    type=str,
+    help="Output file. If it ends with .npy, the embeddings are saved as a float32 matrix and the ids are saved to <name>.ids.tsv, otherwise to a tsv file.",
+    required=True,
+)
+@click.option(
+    "--batch-size",
+    "-b",
+    type=click.IntRange(min=1),
+    help="Number of texts per batch, the texts are sorted by their lengths to reduce the padding",
+    default=32,
+)
+@click.option(
+    "--num-threads",
+    "-t",
+    type=click.IntRange(min=1),
+    help="Number of threads of torch on CPU. By default, torch decides it.",
+    default=None,
+)
+@click.option(
+    "--pooling",
+    "-p",
+    type=click.Choice(pooling_methods),
+    help="How the token embeddings are pooled to one embedding: the mean of the tokens, the first token ([CLS]) or the maximum of the tokens. The padding tokens are excluded, so the embeddings don't depend on the batch size.",
+    default="mean",
+)
+@click.option(
+    "--cache-file",
+    "-c",
+    type=str,
+    help="A SQLite database which caches the embeddings by the model name, the pooling method, the maximum length and the sha256 of the text, such as embeddings_cache.sqlite. Only the new or changed texts are embedded by the model. It's created if it doesn't exist.",
+    default=None,
+)
+@click.option(
+    "--shard-size",
+    "-s",
+    type=click.IntRange(min=1),
+    help="Number of entities per shard. The embeddings are written to the <output>.shards directory shard by shard, if the run is interrupted, run the same command again to skip the entities which have embeddings. The shards are merged into the output file and removed at the end.",
+    default=10000,
+)
+def entities(
+    entity_file: str,
+    model_name: str,
+    output: str,
+    batch_size: int,
+    num_threads: int,
+    pooling: str,
+    shard_size: int,
+    cache_file: str,
+) -> None:
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
     tokenizer, model = load_model(model_name)
+    model.eval()
     entities = read_entities(entity_file)
+    keys = get_entity_keys(entities["id"], entities["label"])
 
     # max_len = get_max_len(model_name)
     max_len = 512
 
-    embeddings = [
-        generate_embedding(tokenizer, model, text, max_len)
-        for text in entities["description"]
-    ]
+    # The shards of an interrupted run
+    shard_dir = output + ".shards"
+    os.makedirs(shard_dir, exist_ok=True)
+    check_shard_manifest(
+        shard_dir,
+        {
+            "model_name": model_name,
+            "pooling": pooling,
+            "max_len": max_len,
+            "hidden_size": model.config.hidden_size,
+        },
+    )
+    done_keys = load_shard_keys(shard_dir)
+    shard_num = get_next_shard_num(shard_dir)
+    todo = ~keys.isin(done_keys)
+    print(
+        "Found %s entities with embeddings in %s, %s entities left"
+        % (len(entities) - todo.sum(), shard_dir, todo.sum())
+    )
+
+    cache = None
+    if cache_file:
+        cache = EmbeddingCache(cache_file, model_name, pooling, max_len)
+
+    todo_entities = entities[todo]
+    start_time = time.perf_counter()
+    for start, embeddings in iter_embeddings(
+        tokenizer,
+        model,
+        todo_entities["description"].astype(str).tolist(),
+        max_len,
+        batch_size=batch_size,
+        pooling=pooling,
+        window_size=shard_size,
+        cache=cache,
+    ):
+        write_shard(
+            shard_dir,
+            shard_num,
+            todo_entities.iloc[start : start + len(embeddings)],
+            embeddings,
+        )
+        shard_num += 1
+    elapsed = time.perf_counter() - start_time
+    print(
+        "Generated embeddings for %s entities in %.1fs, %.1f entities/s"
+        % (len(todo_entities), elapsed, len(todo_entities) / max(elapsed, 1e-9))
+    )
+    if cache is not None:
+        cache.report()
+        cache.close()
+
+    # Merge the shards in the order of the entities
+    embeddings = merge_shards(shard_dir, keys)
 
-    entities["embedding"] = [
-        "|".join([str(value) for value in embedding]) for embedding in embeddings
-    ]
     entities["embedding_id"] = [i + 1 for i in range(len(embeddings))]
 
     # rename columns
@@ -143,12 +577,11 @@ def entities(entity_file: str, model_name: str, output: str) -> None:
     )
 
     # Select only the columns we need
-    entities = entities[
-        ["embedding_id", "entity_id", "entity_name", "entity_type", "embedding"]
-    ]
+    entities = entities[["embedding_id", "entity_id", "entity_name", "entity_type"]]
 
     # save to file
-    entities.to_csv(output, sep="\t", index=False)
+    write_embeddings(entities, embeddings, output)
+    shutil.rmtree(shard_dir)
 
 
 @cli.command(help="Generate embeddings for relation types")
@@ -160,33 +593,98 @@ def entities(entity_file: str, model_name: str, output: str) -> None:
     required=True,
 )
 @click.option("--model-name", "-m", help="Model name/path", required=True)
-@click.option("--output", "-o", type=str, help="Output file", required=True)
-def relation_types(relation_type_file: str, model_name: str, output: str) -> None:
+@click.option(
+    "--output",
+    "-o",
+    type=str,
+    help="Output file. If it ends with .npy, the embeddings are saved as a float32 matrix and the ids are saved to <name>.ids.tsv, otherwise to a tsv file.",
+    required=True,
+)
+@click.option(
+    "--batch-size",
+    "-b",
+    type=click.IntRange(min=1),
+    help="Number of texts per batch, the texts are sorted by their lengths to reduce the padding",
+    default=32,
+)
+@click.option(
+    "--num-threads",
+    "-t",
+    type=click.IntRange(min=1),
+    help="Number of threads of torch on CPU. By default, torch decides it.",
+    default=None,
+)
+@click.option(
+    "--pooling",
+    "-p",
+    type=click.Choice(pooling_methods),
+    help="How the token embeddings are pooled to one embedding: the mean of the tokens, the first token ([CLS]) or the maximum of the tokens. The padding tokens are excluded, so the embeddings don't depend on the batch size.",
+    default="mean",
+)
+@click.option(
+    "--cache-file",
+    "-c",
+    type=str,
+    help="A SQLite database which caches the embeddings by the model name, the pooling method, the maximum length and the sha256 of the text, such as embeddings_cache.sqlite. Only the new or changed texts are embedded by the model. It's created if it doesn't exist.",
+    default=None,
+)
+def relation_types(
+    relation_type_file: str,
+    model_name: str,
+    output: str,
+    batch_size: int,
+    num_threads: int,
+    pooling: str,
+    cache_file: str,
+) -> None:
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
     tokenizer, model = load_model(model_name)
+    model.eval()
     relation_types = read_relation_types(relation_type_file)
 
     max_len = 512
 
-    embeddings = [
-        generate_embedding(tokenizer, model, text, max_len)
-        for text in relation_types["description"]
-    ]
+    cache = None
+    if cache_file:
+        cache = EmbeddingCache(cache_file, model_name, pooling, max_len)
+
+    embeddings = generate_embeddings(
+        tokenizer,
+        model,
+        relation_types["description"].astype(str).tolist(),
+        max_len,
+        batch_size=batch_size,
+        pooling=pooling,
+        cache=cache,
+    )
+    if cache is not None:
+        cache.report()
+        cache.close()
 
-    relation_types["embedding"] = [
-        "|".join([str(value) for value in embedding]) for embedding in embeddings
-    ]
     relation_types["embedding_id"] = [i + 1 for i in range(len(embeddings))]
 
     # Select only the columns we need
-    relation_types = relation_types[["embedding_id", "relation_type", "embedding"]]
+    relation_types = relation_types[["embedding_id", "relation_type"]]
 
     # save to file
-    relation_types.to_csv(output, sep="\t", index=False)
+    write_embeddings(relation_types, embeddings, output)
 
 
 @cli.command(help="Reduce the dimensionality of the embeddings")
-@click.option("--embedding-file", "-e", type=str, help="Path to embedding file")
-@click.option("--output", "-o", type=str, help="Output file")
+@click.option(
+    "--embedding-file",
+    "-e",
+    type=str,
+    help="Path to embedding file, a tsv file or a npy file with its <name>.ids.tsv file",
+)
+@click.option(
+    "--output",
+    "-o",
+    type=str,
+    help="Output file, a npy file (with <name>.ids.tsv) or a tsv file",
+)
 @click.option("--dimensions", "-d", type=int, help="Number of dimensions", default=2)
 @click.option(
     "--method", "-m", type=str, help="Method (pca, tsne, umap)", default="tsne"
@@ -217,16 +715,13 @@ def reduce_dimensions(
     learning_rate: int,
     n_iter: int,
 ) -> None:
-    embedding_data = pd.read_csv(embedding_file, sep="\t")
-
-    # Convert the embedding column to a list of floats, instead of a string separated by |
-    embeddings = embedding_data["embedding"].apply(
-        lambda x: np.array([float(value) for value in x.split("|")])
+    # The embeddings of a tsv file are parsed as float64, the same as float(value)
+    embedding_data, embeddings = read_embeddings(
+        embedding_file, mmap=False, dtype=np.float64
     )
+    embeddings = embeddings.astype(np.float64, copy=False)
 
-    print("Dimentions of each embedding: %s" % str(len(embeddings[0])))
-
-    embeddings = np.stack(embeddings)
+    print("Dimentions of each embedding: %s" % str(embeddings.shape[1]))
 
     if len(embeddings) < dimensions:
         # Extend the number of embedding by duplicating the existing ones
@@ -256,13 +751,8 @@ def reduce_dimensions(
     else:
         raise ValueError("Unknown method: %s" % method)
 
-    # Add the reduced embeddings to the dataframe
-    embedding_data["embedding"] = [
-        "|".join(["%s" % item for item in embedding]) for embedding in embeddings
-    ][: len(embedding_data)]
-
-    # Save the embeddings to file
-    embedding_data.to_csv(output, sep="\t", index=False)
+    # Save the reduced embeddings to file, the duplicated ones are dropped
+    write_embeddings(embedding_data, embeddings[: len(embedding_data)], output)
 
 
 if __name__ == "__main__":
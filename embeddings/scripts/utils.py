@@ -11,15 +11,21 @@ package_dir = os.path.dirname(os.path.dirname(os.getcwd()))
 sys.path.append(os.path.join(package_dir, "lib"))
 # Add the graph module to the system path
 from graph import get_color
+from embedding_format import read_embeddings
 
 # Load a data file which is a tsv file and the last column is an embedding vector. The embedding vector is a string of numbers separated by pipes.
+# It can also be a npy file of a float32 matrix whose ids are in the <name>.ids.tsv file, see embedding_format.py:write_embeddings.
 def load_data(file_name):
-    df = pd.read_csv(file_name, sep="\t")
-    df = df.reset_index(drop=True)
-    df["embedding"] = df["embedding"].apply(lambda x: x.split("|"))
+    df, embeddings = load_embeddings(file_name)
+    df["embedding"] = list(embeddings)
     return df
 
 
+# Load the embeddings as a matrix and the other columns as a dataframe, the npy file is memory-mapped.
+def load_embeddings(file_name, mmap=True):
+    return read_embeddings(file_name, mmap=mmap)
+
+
 # Visualize the data using t-SNE and show node names on the plot when hovering over the nodes.
 def get_tsne(df):
     X = np.array(df["embedding"].tolist())
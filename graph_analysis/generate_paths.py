@@ -29,189 +29,993 @@ The notebook requires the following input files:
 - graph_data/formatted_relations/all_relations.tsv: Contains the actual graph edges
 """
 
-import networkx as nx
-import pandas as pd
-from multiprocessing import Pool, cpu_count
-from multiprocessing.dummy import Pool as ThreadPool
-from functools import partial
 import os
+import re
+import sys
+import click
+import logging
+import json
+import time
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
 import networkx as nx
+from collections import deque
+from multiprocessing import Pool
+from multiprocessing.dummy import Pool as ThreadPool
+from functools import partial
 from pathlib import Path
-import logging
+from types import SimpleNamespace
+from typing import Tuple
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(root_dir, "lib"))
+
+from compact_graph import CompactKG, expand_ranges  # noqa: E402
+from check import audit_missing_entities  # noqa: E402
+from kg_loader import (  # noqa: E402
+    read_relation_table,
+    read_entity_table,
+    find_table_file,
+)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+handler = logging.StreamHandler()
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+logger.setLevel(logging.INFO)
+
+path_columns = [
+    "source_id",
+    "source_type",
+    "first_edge_type",
+    "intermediate_id",
+    "intermediate_type",
+    "second_edge_type",
+    "target_id",
+    "target_type",
+]
+
+
+def load_graph_data(dataset_dir):
+    """Load the knowledge graph data from TSV files."""
+    data_dir = Path(dataset_dir)
+
+    # Load entities, the parquet files are preferred if they exist
+    entities_df = read_entity_table(
+        find_table_file(data_dir, "knowledge_graph_entities")
+    )
 
+    # Load knowledge graph
+    kg_df = read_relation_table(find_table_file(data_dir, "knowledge_graph"))
 
-if __name__ == "__main__":
-    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    dataset_dir = os.path.join(root_dir, "datasets", "biomedgps-v20241115-134f92")
-
-    # Set up logging
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    return entities_df, kg_df
+
+
+def check_missing_entities(entities_df, kg_df):
+    # 检查哪些实体只出现在kg_df中，但不在entities_df中
+    audit = audit_missing_entities(entities_df, kg_df, sample_size=10)
+
+    logger.info(f"\n实体总数（entities_df）: {audit['num_entities']}")
+    logger.info(f"边中涉及的实体总数: {audit['num_relation_entities']}")
+    logger.info(f"⚠️ 边中存在但不在entities_df中的实体数量: {audit['num_missing']}")
+
+    # 若需要查看前几个缺失的实体：
+    logger.info("\nMissing entities (sample):")
+    logger.info(audit["sample"])
+
+
+def create_graph(entities_df, kg_df):
+    """Create a NetworkX directed graph from the triples data."""
+    G = nx.MultiDiGraph()
+
+    # Add nodes with their types
+    for _, row in entities_df.iterrows():
+        G.add_node(f"{row['label']}::{row['id']}", entity_type=row["label"])
+
+    # Add edges with their types
+    for _, row in kg_df.iterrows():
+        G.add_edge(
+            f"{row['source_type']}::{row['source_id']}",
+            f"{row['target_type']}::{row['target_id']}",
+            relation=row["relation_type"],
+        )
+
+    return G
+
+
+def create_compact_graph(entities_df, kg_df) -> CompactKG:
+    """Create a CompactKG from the triples data.
+
+    The NetworkX graph skips every path which passes a node without an entity type, i.e. a node which is not in the entities_df. So we drop the edges which touch such nodes before building the graph, the paths are the same.
+    """
+    entity_keys = pd.Index(
+        entities_df["label"].astype(str) + "::" + entities_df["id"].astype(str)
     )
-    handler = logging.StreamHandler()
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
+    source_keys = kg_df["source_type"].astype(str) + "::" + kg_df["source_id"].astype(str)
+    target_keys = kg_df["target_type"].astype(str) + "::" + kg_df["target_id"].astype(str)
+    kg_df = kg_df[source_keys.isin(entity_keys) & target_keys.isin(entity_keys)]
+
+    return CompactKG.from_dataframe(kg_df, entities=entities_df, directed=True)
+
+
+def _process_sources_chunk(
+    G,
+    entity_types,
+    sources,
+    intermediate_types=None,
+    target_types=None,
+    relation_types=None,
+):
+    """Walk the NetworkX graph from the sources and yield the 2-hop paths one by one.
+
+    The type and relation filters are checked before walking the next level, so the pruned branches cost nothing.
+    """
+    for source in sources:
+        if not G.succ[source]:
+            continue
+
+        source_type = entity_types.get(source, None)
+        if source_type is None:
+            continue
+
+        for intermediate in G.successors(source):
+            intermediate_type = entity_types.get(intermediate, None)
+            if intermediate_type is None:
+                continue
 
+            if intermediate_types and intermediate_type not in intermediate_types:
+                continue
 
-    def load_graph_data(dataset_dir):
-        """Load the knowledge graph data from TSV files."""
-        data_dir = Path(dataset_dir)
+            first_hop_edges = G[source][intermediate]
+            for k1, edge_data_1 in first_hop_edges.items():
+                first_edge_type = edge_data_1.get("relation", None)
+                if first_edge_type is None:
+                    continue
 
-        # Load entities
-        entities_df = pd.read_csv(data_dir / "knowledge_graph_entities.tsv", sep="\t")
+                if relation_types and first_edge_type not in relation_types:
+                    continue
 
-        # Load knowledge graph
-        kg_df = pd.read_csv(data_dir / "knowledge_graph.tsv", sep="\t")
+                for target in G.successors(intermediate):
+                    target_type = entity_types.get(target, None)
+                    if target_type is None:
+                        continue
 
-        return entities_df, kg_df
+                    if target_types and target_type not in target_types:
+                        continue
 
-    # Load the data
-    logger.info("Loading graph data...")
-    entities_df, kg_df = load_graph_data(dataset_dir=dataset_dir)
+                    second_hop_edges = G[intermediate][target]
+                    for k2, edge_data_2 in second_hop_edges.items():
+                        second_edge_type = edge_data_2.get("relation", None)
+                        if second_edge_type is None:
+                            continue
 
-    # Display sample data
-    logger.info("\n Entities:")
-    logger.info(entities_df.head())
+                        if relation_types and second_edge_type not in relation_types:
+                            continue
+
+                        yield {
+                            "source_id": source,
+                            "source_type": source_type,
+                            "first_edge_type": first_edge_type,
+                            "intermediate_id": intermediate,
+                            "intermediate_type": intermediate_type,
+                            "second_edge_type": second_edge_type,
+                            "target_id": target,
+                            "target_type": target_type,
+                        }
+
+
+def get_node_keys(kg: CompactKG) -> np.ndarray:
+    """Get the node names (such as Gene::ENTREZ:1234) which are used in the output file."""
+    type_names = np.asarray(kg.type_names, dtype=object)
+    return (
+        pd.Series(type_names[kg.node_types], dtype=object)
+        + "::"
+        + pd.Series(kg.node_ids, dtype=object).astype(str)
+    ).to_numpy(dtype=object)
+
+
+def filter_two_hop_graph(
+    kg: CompactKG,
+    sources=None,
+    source_types=None,
+    intermediate_types=None,
+    target_types=None,
+    relation_types=None,
+) -> Tuple[CompactKG, CompactKG]:
+    """Keep only the edges which can be a part of a matched 2-hop path, so the enumeration scales with the query instead of the whole graph.
+
+    Args:
+        kg (CompactKG): the graph.
+        sources (list, optional): the source nodes, such as ["Disease::MONDO:0005148"]. Defaults to None, i.e. all nodes.
+        source_types (list, optional): the entity types of the source nodes. Defaults to None, i.e. all types.
+        intermediate_types (list, optional): the entity types of the intermediate nodes. Defaults to None, i.e. all types.
+        target_types (list, optional): the entity types of the target nodes. Defaults to None, i.e. all types.
+        relation_types (list, optional): the relation types which are allowed on both hops. Defaults to None, i.e. all relation types.
+
+    Returns:
+        Tuple[CompactKG, CompactKG]: the graphs of the first hop and the second hop. They're the same object as kg if there is no filter.
+    """
+    if not any([sources, source_types, intermediate_types, target_types, relation_types]):
+        return kg, kg
+
+    type_names = pd.Index(kg.type_names)
+
+    def type_mask(types):
+        if not types:
+            return np.ones(kg.number_of_nodes(), dtype=bool)
+        return type_names.isin(types)[kg.node_types]
+
+    source_mask = type_mask(source_types)
+    if sources:
+        is_source = pd.Index(get_node_keys(kg)).isin(sources)
+        num_missing = len(set(sources)) - is_source.sum()
+        if num_missing:
+            logger.warning("%s of the sources are not in the graph" % num_missing)
+        source_mask &= is_source
+    intermediate_mask = type_mask(intermediate_types)
+    target_mask = type_mask(target_types)
+
+    if relation_types:
+        relation_mask = pd.Index(kg.relation_names).isin(relation_types)[kg.relations]
+    else:
+        relation_mask = np.ones(kg.number_of_edges(), dtype=bool)
+
+    first_mask = source_mask[kg.sources] & intermediate_mask[kg.targets] & relation_mask
+    second_mask = (
+        intermediate_mask[kg.sources] & target_mask[kg.targets] & relation_mask
+    )
+    # Only the second-hop edges which follow a first-hop edge are needed
+    second_mask &= np.isin(kg.sources, kg.targets[first_mask])
+    logger.info(
+        "Kept %s first-hop edges and %s second-hop edges of %s edges"
+        % (first_mask.sum(), second_mask.sum(), kg.number_of_edges())
+    )
+
+    return kg.filter_edges(first_mask), kg.filter_edges(second_mask)
+
+
+def get_path_offsets(first: CompactKG, second: CompactKG) -> np.ndarray:
+    """Get the number of 2-hop paths before each first-hop edge (in the CSR order) and the total number of paths at the end.
+
+    All paths are numbered by (first-hop edge, second-hop edge), so any range of paths can be enumerated without walking the paths before it.
+    """
+    second_counts = np.diff(second.out_indptr)[first.out_indices]
+    offsets = np.zeros(len(second_counts) + 1, dtype=np.int64)
+    np.cumsum(second_counts, out=offsets[1:])
+    return offsets
 
-    logger.info("\nKnowledge graph:")
-    logger.info(kg_df.head())
 
-    # 构造 entities_df 中所有实体的 ID+类型 标准格式
-    entity_set = set(
-        f"{row['label']}::{row['id']}" for _, row in entities_df.iterrows()
+def _process_compact_path_range(first, second, node_keys, offsets, path_range):
+    """Enumerate the 2-hop paths [start, end) with the CSR arrays, no python loop over the edges.
+
+    The first and second hops can be CompactKGs or the hops of a SharedCSR, only out_indptr, out_indices, out_relations, node_types, type_names and relation_names are used.
+    """
+    start, end = path_range
+
+    # The first-hop edges (in the CSR order) which have paths in the range
+    first_edges = np.arange(
+        np.searchsorted(offsets, start, side="right") - 1,
+        np.searchsorted(offsets, end, side="left"),
+    )
+    # The part of the second-hop edges of each first-hop edge which is in the range
+    lower = np.maximum(start - offsets[first_edges], 0)
+    upper = np.minimum(end, offsets[first_edges + 1]) - offsets[first_edges]
+    second_counts = upper - lower
+
+    first_sources = np.searchsorted(first.out_indptr, first_edges, side="right") - 1
+    intermediates = first.out_indices[first_edges]
+    second_edges = expand_ranges(
+        second.out_indptr[intermediates] + lower, second_counts
     )
 
-    # 构造 kg_df 中边涉及的所有实体（source 和 target）
-    kg_entities_set = set()
-    for _, row in kg_df.iterrows():
-        source = f"{row['source_type']}::{row['source_id']}"
-        target = f"{row['target_type']}::{row['target_id']}"
-        kg_entities_set.add(source)
-        kg_entities_set.add(target)
+    path_sources = np.repeat(first_sources, second_counts)
+    path_intermediates = np.repeat(intermediates, second_counts)
+    path_targets = second.out_indices[second_edges]
+
+    return pd.DataFrame(
+        {
+            "source_id": node_keys[path_sources],
+            "source_type": pd.Categorical.from_codes(
+                first.node_types[path_sources], categories=first.type_names
+            ),
+            "first_edge_type": pd.Categorical.from_codes(
+                np.repeat(first.out_relations[first_edges], second_counts),
+                categories=first.relation_names,
+            ),
+            "intermediate_id": node_keys[path_intermediates],
+            "intermediate_type": pd.Categorical.from_codes(
+                first.node_types[path_intermediates], categories=first.type_names
+            ),
+            "second_edge_type": pd.Categorical.from_codes(
+                second.out_relations[second_edges], categories=first.relation_names
+            ),
+            "target_id": node_keys[path_targets],
+            "target_type": pd.Categorical.from_codes(
+                first.node_types[path_targets], categories=first.type_names
+            ),
+        },
+        columns=path_columns,
+    )
 
-    # 检查哪些实体只出现在kg_df中，但不在entities_df中
-    missing_entities = kg_entities_set - entity_set
 
-    logger.info(f"\n实体总数（entities_df）: {len(entity_set)}")
-    logger.info(f"边中涉及的实体总数: {len(kg_entities_set)}")
-    logger.info(f"⚠️ 边中存在但不在entities_df中的实体数量: {len(missing_entities)}")
+def _imap_bounded(pool, func, iterable, window):
+    """Like pool.imap, but only keeps `window` tasks in flight, so the results never pile up in memory."""
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
+
+
+def generate_two_hop_paths_parallel(G, num_workers=4, chunk_size=1000000, **filters):
+    """Generate all 2-hop paths of the graph chunk by chunk.
+
+    Args:
+        G (CompactKG | nx.MultiDiGraph): the graph.
+        num_workers (int, optional): number of threads which enumerate the chunks of a CompactKG. The NetworkX graph is always walked in one thread, the GIL makes more threads useless. Defaults to 4.
+        chunk_size (int, optional): maximum number of paths in a chunk. Defaults to 1000000.
+        **filters: sources, source_types, intermediate_types, target_types and relation_types, see filter_two_hop_graph.
+
+    Yields:
+        pd.DataFrame: a chunk of paths with the path_columns, it never has more than chunk_size rows.
+    """
+    if isinstance(G, CompactKG):
+        first, second = filter_two_hop_graph(G, **filters)
+        node_keys = get_node_keys(G)
+        offsets = get_path_offsets(first, second)
+        total = int(offsets[-1])
+        logger.info(f"Number of 2-hop paths to generate: {total}")
+        path_ranges = (
+            (start, min(start + chunk_size, total))
+            for start in range(0, total, chunk_size)
+        )
+        func = partial(_process_compact_path_range, first, second, node_keys, offsets)
 
-    # 若需要查看前几个缺失的实体：
-    logger.info("\nMissing entities (sample):")
-    logger.info(list(missing_entities)[:10])
-
-    def create_graph(entities_df, kg_df):
-        """Create a NetworkX directed graph from the triples data."""
-        G = nx.MultiDiGraph()
-
-        # Add nodes with their types
-        for _, row in entities_df.iterrows():
-            G.add_node(f"{row['label']}::{row['id']}", entity_type=row["label"])
-
-        # Add edges with their types
-        for _, row in kg_df.iterrows():
-            G.add_edge(
-                f"{row['source_type']}::{row['source_id']}",
-                f"{row['target_type']}::{row['target_id']}",
-                relation=row["relation_type"],
+        with ThreadPool(num_workers) as pool:
+            yield from _imap_bounded(pool, func, path_ranges, window=num_workers)
+        return
+
+    entity_types = nx.get_node_attributes(G, "entity_type")
+    sources = G.nodes()
+    if filters.get("sources"):
+        sources = [source for source in dict.fromkeys(filters["sources"]) if source in G]
+        num_missing = len(set(filters["sources"])) - len(sources)
+        if num_missing:
+            logger.warning("%s of the sources are not in the graph" % num_missing)
+    if filters.get("source_types"):
+        sources = [
+            source
+            for source in sources
+            if entity_types.get(source, None) in filters["source_types"]
+        ]
+
+    paths = []
+    for path in _process_sources_chunk(
+        G,
+        entity_types,
+        sources,
+        intermediate_types=filters.get("intermediate_types"),
+        target_types=filters.get("target_types"),
+        relation_types=filters.get("relation_types"),
+    ):
+        paths.append(path)
+        if len(paths) >= chunk_size:
+            yield pd.DataFrame(paths, columns=path_columns)
+            paths = []
+
+    if paths:
+        yield pd.DataFrame(paths, columns=path_columns)
+
+
+class SharedCSR:
+    """The read-only arrays of a CompactKG which are needed to enumerate the paths.
+
+    The arrays are saved to a directory once and every worker process memory-maps them, so the adjacency is shared through the page cache instead of being copied into each worker. Only the node names (one string per node) are loaded by each worker.
+    """
+
+    hop_array_names = ["out_indptr", "out_indices", "out_relations"]
+
+    def __init__(self, directory):
+        def load(name):
+            return np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+
+        with open(os.path.join(directory, "names.json")) as f:
+            names = json.load(f)
+
+        self.node_keys = np.load(
+            os.path.join(directory, "node_keys.npy"), allow_pickle=True
+        )
+        self.offsets = load("offsets")
+        self.hops = []
+        for hop in names["hops"]:
+            self.hops.append(
+                SimpleNamespace(
+                    node_types=load("node_types"),
+                    type_names=names["type_names"],
+                    relation_names=names["relation_names"],
+                    **{name: load(hop + "_" + name) for name in self.hop_array_names},
+                )
             )
 
-        return G
+    @classmethod
+    def dump(cls, first: CompactKG, second: CompactKG, node_keys, offsets, directory):
+        # The second hop is the same as the first hop if there is no filter, save it once
+        hops = ["first"] if second is first else ["first", "second"]
+        for hop, kg in zip(hops, [first, second]):
+            for name in cls.hop_array_names:
+                np.save(os.path.join(directory, hop + "_" + name + ".npy"), getattr(kg, name))
+
+        np.save(os.path.join(directory, "node_types.npy"), first.node_types)
+        np.save(os.path.join(directory, "offsets.npy"), offsets)
+        np.save(os.path.join(directory, "node_keys.npy"), node_keys, allow_pickle=True)
+        with open(os.path.join(directory, "names.json"), "w") as f:
+            json.dump(
+                {
+                    "type_names": first.type_names,
+                    "relation_names": first.relation_names,
+                    "hops": hops if len(hops) == 2 else hops * 2,
+                },
+                f,
+            )
 
-    # Create the graph
-    logger.info("Creating graph...")
-    G = create_graph(entities_df, kg_df)
 
-    # logger.info graph statistics
-    logger.info(f"Number of nodes: {G.number_of_nodes()}")
-    logger.info(f"Number of edges: {G.number_of_edges()}")
+# The SharedCSR of the current worker process, see _init_worker
+_shared_csr = None
 
-    kg_df[
-        ["source_id", "source_type", "relation_type", "target_id", "target_type"]
-    ].drop_duplicates().shape
 
-    def _process_sources_chunk(G, entity_types, sources):
-        paths = []
-        for source in sources:
-            if not G.succ[source]:
-                continue
+def _init_worker(directory):
+    global _shared_csr
+    _shared_csr = SharedCSR(directory)
 
-            source_type = entity_types.get(source, None)
-            if source_type is None:
-                continue
 
-            for intermediate in G.successors(source):
-                intermediate_type = entity_types.get(intermediate, None)
-                if intermediate_type is None:
-                    continue
+def _write_compact_path_range(task):
+    """Enumerate a range of paths in a worker process and write them to a shard file.
 
-                first_hop_edges = G[source][intermediate]
-                for k1, edge_data_1 in first_hop_edges.items():
-                    first_edge_type = edge_data_1.get("relation", None)
-                    if first_edge_type is None:
-                        continue
+    Returns:
+        dict: the shard file, the number of paths and the elapsed time.
+    """
+    path_range, shard_file, output_format = task
+    start = time.perf_counter()
 
-                    for target in G.successors(intermediate):
-                        target_type = entity_types.get(target, None)
-                        if target_type is None:
-                            continue
+    first, second = _shared_csr.hops
+    chunk = _process_compact_path_range(
+        first, second, _shared_csr.node_keys, _shared_csr.offsets, path_range
+    )
+    if output_format == "parquet":
+        chunk.astype(object).to_parquet(shard_file, index=False)
+    else:
+        chunk.to_csv(
+            shard_file,
+            sep="\t",
+            index=False,
+            compression="gzip" if output_format == "tsv.gz" else None,
+        )
+
+    return {
+        "shard_file": shard_file,
+        "num_paths": len(chunk),
+        "elapsed": time.perf_counter() - start,
+    }
+
+
+def generate_two_hop_paths_multiprocess(
+    kg: CompactKG,
+    output_file,
+    output_format="tsv",
+    num_workers=4,
+    chunk_size=1000000,
+    **filters,
+):
+    """Generate all 2-hop paths of a CompactKG with a process pool and write them to the output.
+
+    All paths are numbered by (first-hop edge, second-hop edge), so we split them into tasks of chunk_size paths. Each task costs the same, no matter how the degrees of the sources are distributed, and the tasks are handed out one by one, so all workers stay busy until the end. Each worker writes its own shard, only small statistics come back to the main process.
+
+    Args:
+        kg (CompactKG): the graph.
+        output_file (str): output file path.
+        output_format (str, optional): tsv, tsv.gz or parquet, the same as PathWriter. Defaults to "tsv".
+        num_workers (int, optional): number of worker processes. Defaults to 4.
+        chunk_size (int, optional): maximum number of paths per task. Defaults to 1000000.
+        **filters: sources, source_types, intermediate_types, target_types and relation_types, see filter_two_hop_graph.
+
+    Returns:
+        dict: statistics of the paths.
+    """
+    first, second = filter_two_hop_graph(kg, **filters)
+    node_keys = get_node_keys(kg)
+    offsets = get_path_offsets(first, second)
+    total = int(offsets[-1])
+    logger.info(f"Number of 2-hop paths to generate: {total}")
+
+    writer = PathWriter(output_file, output_format)
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    tmp_dir = tempfile.mkdtemp(prefix=".2hops_paths_", dir=output_dir)
+    try:
+        SharedCSR.dump(first, second, node_keys, offsets, tmp_dir)
+
+        tasks = []
+        for index, start in enumerate(range(0, total, chunk_size)):
+            if output_format == "tsv.gz":
+                shard_file = writer.shard_file(index)
+            else:
+                suffix = "parquet" if output_format == "parquet" else "tsv"
+                shard_file = os.path.join(tmp_dir, "part-%05d.%s" % (index, suffix))
+            tasks.append(
+                ((start, min(start + chunk_size, total)), shard_file, output_format)
+            )
 
-                        second_hop_edges = G[intermediate][target]
-                        for k2, edge_data_2 in second_hop_edges.items():
-                            second_edge_type = edge_data_2.get("relation", None)
-                            if second_edge_type is None:
-                                continue
-
-                            paths.append(
-                                {
-                                    "source_id": source,
-                                    "source_type": source_type,
-                                    "first_edge_type": first_edge_type,
-                                    "intermediate_id": intermediate,
-                                    "intermediate_type": intermediate_type,
-                                    "second_edge_type": second_edge_type,
-                                    "target_id": target,
-                                    "target_type": target_type,
-                                }
-                            )
-        return paths
-
-    def generate_two_hop_paths_parallel(G, num_workers=4):
-        entity_types = nx.get_node_attributes(G, "entity_type")
-        all_sources = list(G.nodes())
-        chunk_size = len(all_sources) // num_workers + 1
-        chunks = [
-            all_sources[i : i + chunk_size]
-            for i in range(0, len(all_sources), chunk_size)
-        ]
+        num_paths = 0
+        started_at = time.perf_counter()
+        with Pool(num_workers, initializer=_init_worker, initargs=(tmp_dir,)) as pool:
+            for result in pool.imap(_write_compact_path_range, tasks):
+                # Merge the shards in order, the shards of tsv.gz are already the output
+                if output_format != "tsv.gz":
+                    writer.append_shard(result["shard_file"])
+                    os.remove(result["shard_file"])
+                else:
+                    writer.num_chunks += 1
+
+                num_paths += result["num_paths"]
+                elapsed = time.perf_counter() - started_at
+                logger.info(
+                    "Chunk %s/%s: %s paths in %.2fs (%.0f paths/s per worker), %s paths in total (%.0f paths/s)"
+                    % (
+                        writer.num_chunks,
+                        len(tasks),
+                        result["num_paths"],
+                        result["elapsed"],
+                        result["num_paths"] / max(result["elapsed"], 1e-9),
+                        num_paths,
+                        num_paths / max(elapsed, 1e-9),
+                    )
+                )
+    finally:
+        writer.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    stats = get_compact_path_stats(first, second)
+    stats.update({"num_paths": num_paths, "num_chunks": writer.num_chunks})
+    return stats
+
+
+def get_compact_path_stats(first: CompactKG, second: CompactKG):
+    """Count the unique source, intermediate and target nodes of all 2-hop paths without enumerating the paths."""
+    out_degrees = np.diff(second.out_indptr)
+    # The first-hop edges (in the CSR order) which are followed by at least one second-hop edge
+    first_edges = np.nonzero(out_degrees[first.out_indices])[0]
+    sources = np.searchsorted(first.out_indptr, first_edges, side="right") - 1
+    intermediates = np.unique(first.out_indices[first_edges])
+    targets = second.out_indices[
+        expand_ranges(second.out_indptr[intermediates], out_degrees[intermediates])
+    ]
+
+    return {
+        "num_sources": np.unique(sources).size,
+        "num_intermediates": intermediates.size,
+        "num_targets": np.unique(targets).size,
+    }
+
+
+metapath_columns = [
+    "source_type",
+    "first_edge_type",
+    "intermediate_type",
+    "second_edge_type",
+    "target_type",
+]
+
+
+def aggregate_metapaths(kg: CompactKG, **filters) -> pd.DataFrame:
+    """Count the 2-hop paths by metapath (source_type, first_edge_type, intermediate_type, second_edge_type, target_type) without enumerating the paths.
+
+    For each node v, A_in[v, (r1, source_type)] is the number of incoming edges of v with the relation type r1 from a node of source_type, and A_out[v, (r2, target_type)] is the number of outgoing edges. The number of paths of a metapath which passes the nodes of an intermediate type t is the sum of A_in[v] x A_out[v] over those nodes, i.e. one sparse matrix product A_in[t].T @ A_out[t] per intermediate type.
+
+    Args:
+        kg (CompactKG): the graph.
+        **filters: sources, source_types, intermediate_types, target_types and relation_types, see filter_two_hop_graph.
+
+    Returns:
+        pd.DataFrame: the metapath_columns and a count column, one row per metapath with at least one path.
+    """
+    from scipy.sparse import csr_matrix
+
+    first, second = filter_two_hop_graph(kg, **filters)
+    num_nodes = kg.number_of_nodes()
+    num_types = len(kg.type_names)
+
+    # (relation, entity type) pairs of the first hop (seen from the intermediate) and the second hop
+    in_codes, in_pairs = pd.factorize(
+        first.relations.astype(np.int64) * num_types + kg.node_types[first.sources]
+    )
+    out_codes, out_pairs = pd.factorize(
+        second.relations.astype(np.int64) * num_types + kg.node_types[second.targets]
+    )
 
-        with ThreadPool(num_workers) as pool:
-            results = pool.map(partial(_process_sources_chunk, G, entity_types), chunks)
+    a_in = csr_matrix(
+        (np.ones(first.number_of_edges(), dtype=np.int64), (first.targets, in_codes)),
+        shape=(num_nodes, len(in_pairs)),
+    )
+    a_out = csr_matrix(
+        (
+            np.ones(second.number_of_edges(), dtype=np.int64),
+            (second.sources, out_codes),
+        ),
+        shape=(num_nodes, len(out_pairs)),
+    )
+
+    results = []
+    for type_code, intermediate_type in enumerate(kg.type_names):
+        nodes = np.nonzero(kg.node_types == type_code)[0]
+        counts = (a_in[nodes].T @ a_out[nodes]).tocoo()
+        if counts.nnz == 0:
+            continue
+
+        first_pairs = np.asarray(in_pairs)[counts.row]
+        second_pairs = np.asarray(out_pairs)[counts.col]
+        results.append(
+            pd.DataFrame(
+                {
+                    "source_type": pd.Categorical.from_codes(
+                        first_pairs % num_types, categories=kg.type_names
+                    ),
+                    "first_edge_type": pd.Categorical.from_codes(
+                        first_pairs // num_types, categories=kg.relation_names
+                    ),
+                    "intermediate_type": intermediate_type,
+                    "second_edge_type": pd.Categorical.from_codes(
+                        second_pairs // num_types, categories=kg.relation_names
+                    ),
+                    "target_type": pd.Categorical.from_codes(
+                        second_pairs % num_types, categories=kg.type_names
+                    ),
+                    "count": counts.data,
+                }
+            )
+        )
+
+    if not results:
+        return pd.DataFrame(columns=metapath_columns + ["count"])
+
+    metapaths = pd.concat(results, ignore_index=True).astype(
+        {column: str for column in metapath_columns}
+    )
+    return metapaths.sort_values(
+        ["count"] + metapath_columns, ascending=[False] + [True] * len(metapath_columns)
+    ).reset_index(drop=True)
+
+
+class PathWriter:
+    """Write the chunks of paths to the output, one chunk at a time.
+
+    Formats:
+        tsv: a single tsv file, the chunks are appended to it.
+        tsv.gz: one gzip-compressed tsv shard per chunk, such as 2hops_paths.part-00000.tsv.gz.
+        parquet: a single parquet file, each chunk is a row group.
+    """
+
+    def __init__(self, output_file, output_format="tsv"):
+        self.output_file = output_file
+        self.output_format = output_format
+        self.num_chunks = 0
+        self._parquet_writer = None
+
+    def shard_file(self, index):
+        prefix = re.sub(r"(\.tsv|\.tsv\.gz)$", "", self.output_file)
+        return "%s.part-%05d.tsv.gz" % (prefix, index)
+
+    def write(self, chunk: pd.DataFrame):
+        if self.output_format == "tsv":
+            chunk.to_csv(
+                self.output_file,
+                sep="\t",
+                index=False,
+                mode="w" if self.num_chunks == 0 else "a",
+                header=self.num_chunks == 0,
+            )
+        elif self.output_format == "tsv.gz":
+            chunk.to_csv(
+                self.shard_file(self.num_chunks),
+                sep="\t",
+                index=False,
+                compression="gzip",
+            )
+        elif self.output_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            # Keep the same schema for all row groups, the categorical columns become string columns.
+            table = pa.Table.from_pandas(chunk.astype(object), preserve_index=False)
+            if self._parquet_writer is None:
+                schema = pa.schema([(name, pa.string()) for name in chunk.columns])
+                self._parquet_writer = pq.ParquetWriter(self.output_file, schema)
+            self._parquet_writer.write_table(
+                table.cast(self._parquet_writer.schema)
+            )
+        else:
+            raise ValueError("Unknown output format: %s" % self.output_format)
+
+        self.num_chunks += 1
+
+    def append_shard(self, shard_file):
+        """Append a shard which is written by a worker (a tsv file without compression or a parquet file) to the output."""
+        if self.output_format == "tsv":
+            with open(shard_file, "rb") as src:
+                if self.num_chunks > 0:
+                    # Skip the header
+                    src.readline()
+                with open(self.output_file, "wb" if self.num_chunks == 0 else "ab") as dst:
+                    shutil.copyfileobj(src, dst)
+            self.num_chunks += 1
+        elif self.output_format == "parquet":
+            self.write(pd.read_parquet(shard_file))
+        else:
+            raise ValueError("Cannot append a shard to the %s output" % self.output_format)
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        elif self.num_chunks == 0 and self.output_format == "tsv":
+            # Keep the header even if there is no path
+            pd.DataFrame(columns=path_columns).to_csv(
+                self.output_file, sep="\t", index=False
+            )
+
+
+def write_paths(chunks, output_file, output_format="tsv"):
+    """Write the chunks of paths to the output and report the throughput of each chunk.
+
+    Args:
+        chunks (Iterable[pd.DataFrame]): chunks of paths, such as the result of generate_two_hop_paths_parallel.
+        output_file (str): output file path.
+        output_format (str, optional): tsv, tsv.gz or parquet, see PathWriter. Defaults to "tsv".
+
+    Returns:
+        dict: statistics of the paths.
+    """
+    writer = PathWriter(output_file, output_format)
+    num_paths = 0
+    unique_nodes = {"source_id": set(), "intermediate_id": set(), "target_id": set()}
+
+    start = time.perf_counter()
+    last = start
+    try:
+        for chunk in chunks:
+            if writer.num_chunks == 0:
+                logger.info("\n2-hop paths (first chunk):")
+                logger.info(chunk.head())
+
+            writer.write(chunk)
+            num_paths += len(chunk)
+            for column, nodes in unique_nodes.items():
+                nodes.update(chunk[column].unique())
+
+            now = time.perf_counter()
+            logger.info(
+                "Chunk %s: %s paths in %.2fs (%.0f paths/s), %s paths in total (%.0f paths/s)"
+                % (
+                    writer.num_chunks,
+                    len(chunk),
+                    now - last,
+                    len(chunk) / max(now - last, 1e-9),
+                    num_paths,
+                    num_paths / max(now - start, 1e-9),
+                )
+            )
+            last = now
+    finally:
+        writer.close()
+
+    return {
+        "num_paths": num_paths,
+        "num_chunks": writer.num_chunks,
+        "num_sources": len(unique_nodes["source_id"]),
+        "num_intermediates": len(unique_nodes["intermediate_id"]),
+        "num_targets": len(unique_nodes["target_id"]),
+    }
+
+
+@click.command(help="Generate all 2-hop paths of the knowledge graph")
+@click.option(
+    "--dataset-dir",
+    "-d",
+    help="The directory which contains knowledge_graph_entities.tsv and knowledge_graph.tsv, the .parquet files are used instead if they exist",
+    default=os.path.join(root_dir, "datasets", "biomedgps-v20241115-134f92"),
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+)
+@click.option(
+    "--output-file",
+    "-o",
+    help="Output file path. If the output format is tsv.gz, it's the prefix of the shards, such as 2hops_paths.tsv -> 2hops_paths.part-00000.tsv.gz",
+    default=os.path.join(root_dir, "graph_analysis", "2hops_paths.tsv"),
+    type=click.Path(exists=False, file_okay=True, dir_okay=False),
+)
+@click.option(
+    "--output-format",
+    "-f",
+    help="The format of the output file. The paths are written chunk by chunk in all formats, so the memory doesn't grow with the number of paths.",
+    default="tsv",
+    type=click.Choice(["tsv", "tsv.gz", "parquet"]),
+)
+@click.option(
+    "--chunk-size",
+    "-c",
+    help="Maximum number of paths in memory per chunk (and per worker)",
+    default=1000000,
+    type=int,
+)
+@click.option(
+    "--workers", "-w", help="Number of workers", default=4, type=int
+)
+@click.option(
+    "--aggregate",
+    "-a",
+    help="Count the paths by metapath (source_type, first_edge_type, intermediate_type, second_edge_type, target_type) with sparse matrix products instead of writing every path. The individual paths are never materialized. It always uses the compact backend.",
+    default=None,
+    type=click.Choice(["metapath"]),
+)
+@click.option(
+    "--pool",
+    "-p",
+    help="How the workers enumerate the paths of the compact backend. The process pool uses all cores, the workers share the CSR arrays through memory-mapped files and write their own shards.",
+    default="process",
+    type=click.Choice(["process", "thread"]),
+)
+@click.option(
+    "--backend",
+    "-b",
+    help="The graph engine. The compact backend keeps the graph in integer-indexed CSR arrays and takes a fraction of the memory of networkx.",
+    default="compact",
+    type=click.Choice(["compact", "networkx"]),
+)
+@click.option(
+    "--source",
+    "-s",
+    "sources",
+    help="Only the paths which start from the source node, such as Disease::MONDO:0005148. It can be used multiple times.",
+    multiple=True,
+)
+@click.option(
+    "--source-file",
+    help="A file with one source node (such as Disease::MONDO:0005148) per line, the same as --source.",
+    default=None,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
+)
+@click.option(
+    "--source-type",
+    "source_types",
+    help="Only the paths which start from a node of the entity type. It can be used multiple times.",
+    multiple=True,
+)
+@click.option(
+    "--intermediate-type",
+    "intermediate_types",
+    help="Only the paths which go through a node of the entity type. It can be used multiple times.",
+    multiple=True,
+)
+@click.option(
+    "--target-type",
+    "target_types",
+    help="Only the paths which end at a node of the entity type. It can be used multiple times.",
+    multiple=True,
+)
+@click.option(
+    "--relation-type",
+    "relation_types",
+    help="Only the paths whose both hops are one of the relation types. It can be used multiple times.",
+    multiple=True,
+)
+def cli(
+    dataset_dir,
+    output_file,
+    output_format,
+    chunk_size,
+    workers,
+    aggregate,
+    pool,
+    backend,
+    sources,
+    source_file,
+    source_types,
+    intermediate_types,
+    target_types,
+    relation_types,
+):
+    # Load the data
+    logger.info("Loading graph data...")
+    entities_df, kg_df = load_graph_data(dataset_dir=dataset_dir)
+
+    # Display sample data
+    logger.info("\n Entities:")
+    logger.info(entities_df.head())
+
+    logger.info("\nKnowledge graph:")
+    logger.info(kg_df.head())
 
-        all_paths = [item for sublist in results for item in sublist]
-        return pd.DataFrame(all_paths)
+    check_missing_entities(entities_df, kg_df)
 
-    logger.info("Generating 2-hop paths with multiprocessing...")
-    paths_df = generate_two_hop_paths_parallel(
-        G, num_workers=4
-    )  # or omit to auto-detect CPU count
+    if aggregate == "metapath":
+        backend = "compact"
+
+    # Create the graph
+    logger.info("Creating graph with the %s backend..." % backend)
+    if backend == "compact":
+        G = create_compact_graph(entities_df, kg_df)
+    else:
+        G = create_graph(entities_df, kg_df)
+
+    # The graph keeps everything we need
+    del entities_df, kg_df
+
+    # logger.info graph statistics
+    logger.info(f"Number of nodes: {G.number_of_nodes()}")
+    logger.info(f"Number of edges: {G.number_of_edges()}")
 
-    logger.info("\n2-hop paths (parallel):")
-    logger.info(paths_df.head())
+    sources = list(sources)
+    if source_file:
+        with open(source_file) as f:
+            sources.extend(line.strip() for line in f if line.strip())
+
+    filters = {
+        "sources": sources,
+        "source_types": list(source_types),
+        "intermediate_types": list(intermediate_types),
+        "target_types": list(target_types),
+        "relation_types": list(relation_types),
+    }
+
+    if aggregate == "metapath":
+        logger.info("Counting 2-hop paths by metapath...")
+        metapaths = aggregate_metapaths(G, **filters)
+        logger.info("\n2-hop metapaths:")
+        logger.info(metapaths.head())
+        logger.info(f"Number of metapaths: {len(metapaths)}")
+        logger.info(f"Total number of 2-hop paths: {metapaths['count'].sum()}")
+
+        if output_format == "parquet":
+            metapaths.to_parquet(output_file, index=False)
+        else:
+            metapaths.to_csv(
+                output_file,
+                sep="\t",
+                index=False,
+                compression="gzip" if output_format == "tsv.gz" else None,
+            )
+        logger.info(f"\nSaved results to {output_file}")
+        return
+
+    if backend == "compact" and pool == "process":
+        logger.info("Generating 2-hop paths with %s processes..." % workers)
+        stats = generate_two_hop_paths_multiprocess(
+            G,
+            output_file,
+            output_format=output_format,
+            num_workers=workers,
+            chunk_size=chunk_size,
+            **filters,
+        )
+    else:
+        logger.info("Generating 2-hop paths chunk by chunk...")
+        chunks = generate_two_hop_paths_parallel(
+            G, num_workers=workers, chunk_size=chunk_size, **filters
+        )
+        stats = write_paths(chunks, output_file, output_format=output_format)
 
     # logger.info statistics
-    logger.info(f"Total number of 2-hop paths: {len(paths_df)}")
-    logger.info(f"Number of unique source nodes: {paths_df['source_id'].nunique()}")
-    logger.info(
-        f"Number of unique intermediate nodes: {paths_df['intermediate_id'].nunique()}"
-    )
-    logger.info(f"Number of unique target nodes: {paths_df['target_id'].nunique()}")
+    logger.info(f"Total number of 2-hop paths: {stats['num_paths']}")
+    logger.info(f"Number of unique source nodes: {stats['num_sources']}")
+    logger.info(f"Number of unique intermediate nodes: {stats['num_intermediates']}")
+    logger.info(f"Number of unique target nodes: {stats['num_targets']}")
+    logger.info(f"\nSaved results to {output_file}")
+
 
-    # Save results to TSV
-    output_path = Path(os.path.join(root_dir, "graph_analysis", "2hops_paths.tsv"))
-    paths_df.to_csv(output_path, sep="\t", index=False)
-    logger.info(f"\nSaved results to {output_path}")
+if __name__ == "__main__":
+    cli()
@@ -1,14 +1,35 @@
 import os
 import re
+import sys
 import click
 import logging
+import numpy as np
 import pandas as pd
+from typing import Tuple
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(root_dir, "lib"))
+
+from check import make_node_keys  # noqa: E402
+from kg_loader import (  # noqa: E402
+    read_relation_table,
+    read_entity_table,
+    iter_table_chunks,
+    table_formats,
+    ChunkWriter,
+)
 
 # #### Annotate relations
 
 # ```bash
 # # Annotate relations, It will generate two files: graph_data/knowledge_graph.tsv and graph_data/annotated_knowledge_graph.tsv
 # python graph_data/scripts/annotate_relations.py -e graph_data/entities.tsv -r graph_data/relations.tsv -o graph_data
+#
+# # The same, but the output files are parquet files which are much faster to load
+# python graph_data/scripts/annotate_relations.py -e graph_data/entities.tsv -r graph_data/relations.tsv -o graph_data -f parquet
+#
+# # Annotate 1 million relations at a time, the memory doesn't grow with the number of relations
+# python graph_data/scripts/annotate_relations.py -e graph_data/entities.tsv -r graph_data/relations.tsv -o graph_data -c 1000000
 # ```
 
 fmt = "%(asctime)s - %(module)s:%(lineno)d - %(levelname)s - %(message)s"
@@ -16,6 +37,122 @@ logger = logging.getLogger("merge_relations.py")
 logging.basicConfig(level=logging.INFO, format=fmt)
 
 
+knowledge_graph_columns = [
+    "relation_type",
+    "resource",
+    "pmids",
+    "key_sentence",
+    "source_id",
+    "source_type",
+    "target_id",
+    "target_type",
+    "source_name",
+    "target_name",
+]
+
+annotated_knowledge_graph_columns = [
+    "relation_type",
+    "resource",
+    "pmids",
+    "key_sentence",
+    "source_id",
+    "source_type",
+    "target_id",
+    "target_type",
+    "source_name",
+    "source_description",
+    "target_name",
+    "target_description",
+]
+
+
+def build_entity_index(entities: pd.DataFrame) -> Tuple[pd.Index, np.ndarray, np.ndarray]:
+    """Build a hashed index of the (id, label) pairs of the entities.
+
+    Args:
+        entities (pd.DataFrame): the entities with the id, label, name and description columns.
+
+    Returns:
+        Tuple[pd.Index, np.ndarray, np.ndarray]: the index of the label::id keys, the names and the descriptions in the order of the index. A NaN is appended to the names and the descriptions, so the position -1 of a missing key picks a NaN.
+    """
+    keys = make_node_keys(entities["label"], entities["id"])
+    is_duplicated = keys.duplicated().to_numpy()
+    if is_duplicated.any():
+        logger.warning(
+            "Found %s duplicated (id, label) pairs in the entity file, the first one is used"
+            % is_duplicated.sum()
+        )
+
+    entities = entities[~is_duplicated]
+    names = np.append(entities["name"].to_numpy(dtype=object), np.nan)
+    descriptions = np.append(entities["description"].to_numpy(dtype=object), np.nan)
+    return pd.Index(keys[~is_duplicated]), names, descriptions
+
+
+unresolved_columns = [
+    "source_id",
+    "source_type",
+    "target_id",
+    "target_type",
+    "relation_type",
+    "resource",
+    "reason",
+]
+
+
+def annotate_chunk(
+    relations: pd.DataFrame, entity_index, strict_mode=False
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Add the names and the descriptions of the source and target nodes to a chunk of relations.
+
+    Args:
+        relations (pd.DataFrame): a chunk of relations.
+        entity_index (tuple): the result of build_entity_index.
+        strict_mode (bool, optional): keep the relations whose nodes are not in the entity file, their names and descriptions are empty. Otherwise, they are skipped. Defaults to False.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: the annotated relations with the columns of annotated_knowledge_graph_columns, and the unresolved relations with the columns of unresolved_columns. The reason of an unresolved relation is "missing source", "missing target" or "missing source and target".
+    """
+    index, names, descriptions = entity_index
+    source_pos = index.get_indexer(
+        make_node_keys(relations["source_type"], relations["source_id"])
+    )
+    target_pos = index.get_indexer(
+        make_node_keys(relations["target_type"], relations["target_id"])
+    )
+
+    # The anti-join of the relations and the entities
+    is_source_missing = source_pos < 0
+    is_target_missing = target_pos < 0
+    is_matched = ~(is_source_missing | is_target_missing)
+    unresolved = relations[~is_matched].reindex(columns=unresolved_columns)
+    unresolved["reason"] = np.select(
+        [
+            is_source_missing[~is_matched] & is_target_missing[~is_matched],
+            is_source_missing[~is_matched],
+        ],
+        ["missing source and target", "missing source"],
+        default="missing target",
+    )
+
+    if not strict_mode:
+        relations = relations[is_matched]
+        source_pos = source_pos[is_matched]
+        target_pos = target_pos[is_matched]
+
+    relations = relations.assign(
+        source_name=names[source_pos],
+        source_description=descriptions[source_pos],
+        target_name=names[target_pos],
+        target_description=descriptions[target_pos],
+    )
+    for col in ["pmids", "key_sentence"]:
+        if col not in relations.columns:
+            relations[col] = ""
+
+    return relations[annotated_knowledge_graph_columns], unresolved
+
+
 @click.command(help="Annotate relations from a entity file")
 @click.option(
     "--entity-file",
@@ -41,77 +178,85 @@ logging.basicConfig(level=logging.INFO, format=fmt)
 @click.option(
     "--strict-mode",
     "-s",
-    help="Whether to use strict mode for entity matching, if an id is not found in the entities file, skip the relation.",
+    help="Whether to use strict mode for entity matching. In strict mode, all relations are kept, if an id is not found in the entities file, the name and description of the node are empty. Otherwise, the relation is skipped. In both modes, the unresolved relations and the reasons are written to unresolved_relations.tsv (or .parquet).",
     is_flag=True,
     default=False
 )
-def cli(entity_file, relation_file, output_dir, strict_mode):
-    entities = pd.read_csv(entity_file, sep="\t", low_memory=False)
-    relations_df = pd.read_csv(relation_file, sep="\t", low_memory=False)
+@click.option(
+    "--output-format",
+    "-f",
+    help="The format of the output files, knowledge_graph.tsv and annotated_knowledge_graph.tsv, or knowledge_graph.parquet and annotated_knowledge_graph.parquet. The input files can be tsv or parquet files.",
+    type=click.Choice(table_formats),
+    default="tsv",
+)
+@click.option(
+    "--chunk-size",
+    "-c",
+    help="Annotate the relations chunk by chunk and write both output files in one pass, so the memory doesn't grow with the number of relations. By default, all relations are annotated at once.",
+    type=click.IntRange(min=1),
+    default=None,
+)
+def cli(entity_file, relation_file, output_dir, strict_mode, output_format, chunk_size):
+    entities = read_entity_table(
+        entity_file, usecols=["id", "label", "name", "description"]
+    )
+    entity_index = build_entity_index(entities)
+    del entities
 
-    print("Found {} relations in the input file".format(len(relations_df)))
+    if chunk_size:
+        chunks = iter_table_chunks(relation_file, chunk_size)
+    else:
+        chunks = [read_relation_table(relation_file)]
 
-    # Annotate relations_df with the entities dataframe
-    entities = entities[["id", "label", "name", "description"]]
-    relations_df = relations_df.merge(
-        entities, left_on=["source_id", "source_type"], right_on=["id", "label"], how="left" if strict_mode else "inner"
-    )
-    relations_df = relations_df.rename(
-        columns={"name": "source_name", "description": "source_description"}
+    knowledge_graph_file = os.path.join(
+        output_dir, "knowledge_graph.%s" % output_format
     )
-    relations_df = relations_df.drop(columns=["id", "label"])
-    relations_df = relations_df.merge(
-        entities, left_on=["target_id", "target_type"], right_on=["id", "label"], how="left" if strict_mode else "inner"
+    annotated_knowledge_graph_file = os.path.join(
+        output_dir, "annotated_knowledge_graph.%s" % output_format
     )
-    relations_df = relations_df.rename(
-        columns={"name": "target_name", "description": "target_description"}
+    unresolved_file = os.path.join(
+        output_dir, "unresolved_relations.%s" % output_format
     )
-    relations_df = relations_df.drop(columns=["id", "label"])
-    if "pmids" not in relations_df.columns:
-        relations_df["pmids"] = ""
 
-    if "key_sentence" not in relations_df.columns:
-        relations_df["key_sentence"] = ""
+    num_relations = 0
+    num_annotated = 0
+    reasons = pd.Series(dtype=np.int64)
+    with ChunkWriter(
+        knowledge_graph_file, knowledge_graph_columns, output_format
+    ) as knowledge_graph_writer, ChunkWriter(
+        annotated_knowledge_graph_file,
+        annotated_knowledge_graph_columns,
+        output_format,
+    ) as annotated_knowledge_graph_writer, ChunkWriter(
+        unresolved_file, unresolved_columns, output_format
+    ) as unresolved_writer:
+        for chunk in chunks:
+            num_relations += len(chunk)
+            annotated, unresolved = annotate_chunk(
+                chunk, entity_index, strict_mode=strict_mode
+            )
+            num_annotated += len(annotated)
+            reasons = reasons.add(unresolved["reason"].value_counts(), fill_value=0)
 
-    knowledge_graph = relations_df[
-        [
-            "relation_type",
-            "resource",
-            "pmids",
-            "key_sentence",
-            "source_id",
-            "source_type",
-            "target_id",
-            "target_type",
-            "source_name",
-            "target_name",
-        ]
-    ]
-    
-    if strict_mode:
-        print("You're in strict mode, so {} relations were skipped.".format(len(relations_df) - len(knowledge_graph)))
+            knowledge_graph_writer.write(annotated[knowledge_graph_columns])
+            annotated_knowledge_graph_writer.write(annotated)
+            unresolved_writer.write(unresolved)
 
-    output_file = os.path.join(output_dir, "knowledge_graph.tsv")
-    knowledge_graph.to_csv(output_file, sep="\t", index=False)
+    print("Found {} relations in the input file".format(num_relations))
 
-    output_file = os.path.join(output_dir, "annotated_knowledge_graph.tsv")
-    annotated_knowledge_graph = relations_df[
-        [
-            "relation_type",
-            "resource",
-            "pmids",
-            "key_sentence",
-            "source_id",
-            "source_type",
-            "target_id",
-            "target_type",
-            "source_name",
-            "source_description",
-            "target_name",
-            "target_description",
-        ]
-    ]
-    annotated_knowledge_graph.to_csv(output_file, sep="\t", index=False)
+    num_unresolved = int(reasons.sum())
+    print(
+        "Found {} relations whose source or target is not in the entity file, they are written to {}".format(
+            num_unresolved, unresolved_file
+        )
+    )
+    for reason, count in reasons.astype(np.int64).items():
+        print("  {}: {}".format(reason, count))
+
+    if strict_mode:
+        print("You're in strict mode, so {} relations were kept with empty names and descriptions.".format(num_unresolved))
+    else:
+        print("{} relations were skipped, use --strict-mode to keep them.".format(num_relations - num_annotated))
 
 
 if __name__ == "__main__":
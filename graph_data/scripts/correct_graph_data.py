@@ -15,30 +15,171 @@
 #    python correct_graph_data.py check_relation_type --help
 #
 
+import os
 import re
+import sys
 import click
 import pandas as pd
 
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(root_dir, "lib"))
 
-def check_node_id(id: str):
-    # Gene::ENTREZ:6747 --> <ENTITY_TYPE>::<DB_NAME>:<ID>
-    if re.match(r"[a-zA-Z]+::[a-zA-Z\-]+:[a-zA-Z0-9\-_]+", id):
-        return True
-    return False
+from check import make_node_keys, find_missing_nodes  # noqa: E402
+from kg_loader import (  # noqa: E402
+    read_relation_table,
+    read_entity_table,
+    read_table_header,
+    relation_columns,
+)
+
+
+# Gene::ENTREZ:6747 --> <ENTITY_TYPE>::<DB_NAME>:<ID>
+node_id_pattern = re.compile(r"[a-zA-Z]+::[a-zA-Z\-]+:[a-zA-Z0-9\-_]+")
+# SYMP:0000149 --> <DB_NAME>:<ID>
+entity_id_pattern = re.compile(r"[a-zA-Z\-]+:[a-zA-Z0-9\-_]+")
+# STRING::BINDING::Gene:Gene --> <DB_NAME>::<RELATION_TYPE>::<ENTITY_TYPE>:<ENTITY_TYPE>
+relation_type_pattern = re.compile(
+    r"[a-zA-Z]+::[a-zA-Z0-9 \-_\+\>]+::(?P<source_type>[a-zA-Z]+):(?P<target_type>[a-zA-Z]+)"
+)
+
+issue_columns = ["row", "column", "value", "rule"]
+
+
+def match_ids(values: pd.Series, pattern: re.Pattern, strict=False) -> pd.Series:
+    """Check all values against a pattern at once, the missing values are invalid.
+
+    Args:
+        values (pd.Series): the ids or relation types.
+        pattern (re.Pattern): one of the precompiled patterns.
+        strict (bool, optional): the whole value must match the pattern. Defaults to False, i.e. only the beginning of the value must match, the same as re.match.
+
+    Returns:
+        pd.Series: a boolean mask of the valid values.
+    """
+    values = values.astype("string")
+    matched = values.str.fullmatch(pattern) if strict else values.str.match(pattern)
+    return matched.fillna(False).astype(bool)
+
+
+def _make_issues(df: pd.DataFrame, invalid: pd.Series, column: str, rule: str):
+    return pd.DataFrame(
+        {
+            "row": df.index[invalid],
+            "column": column,
+            "value": df.loc[invalid, column].to_numpy(),
+            "rule": rule,
+        },
+        columns=issue_columns,
+    )
+
+
+def get_ids_file(input_file: str) -> str:
+    """Get the ids file of an embedding file in the binary format, such as entities_embeddings.npy -> entities_embeddings.ids.tsv. The other files are returned as they are."""
+    root, ext = os.path.splitext(input_file)
+    return root + ".ids.tsv" if ext == ".npy" else input_file
+
+
+def is_ids_file(input_file: str) -> bool:
+    """The ids file of the binary format has all columns of an embedding file except the embedding column."""
+    return input_file.endswith(".ids.tsv")
+
+
+def find_id_issues(
+    df: pd.DataFrame, which_type: str, strict=False, with_embeddings=True
+) -> pd.DataFrame:
+    """Find all invalid ids, relation types and inconsistent entity types in a file of the knowledge graph.
+
+    Args:
+        df (pd.DataFrame): the content of the file, all columns are strings.
+        which_type (str): "relation", "entity", "relation_type_embedding", or "entity_embedding".
+        strict (bool, optional): the whole value must match the pattern. Defaults to False.
+        with_embeddings (bool, optional): the embedding file has the embedding column. Set it to False for the ids file of the binary format (embeddings.ids.tsv). Defaults to True.
+
+    Returns:
+        pd.DataFrame: one issue per row with the row index, the column, the value and the rule (missing_column, entity_id, node_id, relation_type or type_consistency).
+    """
+    required_columns = {
+        "relation": ["source_id", "source_type", "target_id", "target_type", "relation_type"],
+        "entity": ["id", "label", "name"],
+        "relation_type_embedding": ["id", "embedding"],
+        "entity_embedding": [
+            "embedding_id",
+            "entity_id",
+            "entity_type",
+            "embedding",
+            "entity_name",
+        ],
+    }
+    # The rule of each column which must match a pattern
+    patterns = {
+        "relation": [
+            ("source_id", entity_id_pattern, "entity_id"),
+            ("target_id", entity_id_pattern, "entity_id"),
+            ("relation_type", relation_type_pattern, "relation_type"),
+        ],
+        "entity": [("id", entity_id_pattern, "entity_id")],
+        "relation_type_embedding": [("id", relation_type_pattern, "relation_type")],
+        "entity_embedding": [
+            ("entity_id", entity_id_pattern, "entity_id"),
+            ("embedding_id", node_id_pattern, "node_id"),
+        ],
+    }
+
+    issues = [
+        pd.DataFrame(
+            [[None, col, None, "missing_column"]], columns=issue_columns
+        )
+        for col in required_columns[which_type]
+        if col not in df.columns and (with_embeddings or col != "embedding")
+    ]
 
+    valid = {}
+    for col, pattern, rule in patterns[which_type]:
+        if col not in df.columns:
+            continue
+        valid[col] = match_ids(df[col], pattern, strict=strict)
+        issues.append(_make_issues(df, ~valid[col], col, rule))
+
+    if (
+        which_type == "relation"
+        and "relation_type" in valid
+        and "source_type" in df.columns
+        and "target_type" in df.columns
+    ):
+        # The entity types at the end of the relation type, such as Gene:Gene in STRING::BINDING::Gene:Gene
+        # There are only hundreds of relation types, so extract them once per unique value
+        codes, relation_types = pd.factorize(df["relation_type"])
+        types_in_relation = (
+            pd.Series(relation_types, dtype="string")
+            .str.extract(relation_type_pattern)
+            .reindex(codes)
+            .set_index(df.index)
+        )
+        is_inconsistent = (
+            (types_in_relation["source_type"] != df["source_type"])
+            | (types_in_relation["target_type"] != df["target_type"])
+        ) & (types_in_relation["source_type"] != types_in_relation["target_type"])
+        issues.append(
+            _make_issues(
+                df,
+                (valid["relation_type"] & is_inconsistent.fillna(True)).to_numpy(),
+                "relation_type",
+                "type_consistency",
+            )
+        )
 
-def check_entity_id(id: str):
-    # SYMP:0000149 --> <DB_NAME>:<ID>
-    if re.match(r"[a-zA-Z\-]+:[a-zA-Z0-9\-_]+", id):
-        return True
-    return False
+    issues = [issue for issue in issues if len(issue) > 0]
+    if not issues:
+        return pd.DataFrame(columns=issue_columns)
+    return pd.concat(issues, ignore_index=True)
 
 
-def _check_relation_type(id: str):
-    # STRING::BINDING::Gene:Gene --> <DB_NAME>::<RELATION_TYPE>::<ENTITY_TYPE>:<ENTITY_TYPE>
-    if re.match(r"[a-zA-Z]+::[a-zA-Z0-9 \-_\+\>]+::[a-zA-Z]+:[a-zA-Z]+", id):
-        return True
-    return False
+def write_issue_report(issues: pd.DataFrame, report_file: str):
+    """Write the issues to a json file (a list of records) if the file ends with .json, otherwise to a tsv file."""
+    if report_file.endswith(".json"):
+        issues.to_json(report_file, orient="records", indent=2)
+    else:
+        issues.to_csv(report_file, sep="\t", index=False)
 
 
 def show_msg(msg: str):
@@ -50,7 +191,10 @@ cli = click.Group()
 
 @cli.command(help="This tool is used to check or correct the relation or entity file.")
 @click.option(
-    "--input-file", "-i", help="The input file of the knowledge graph.", required=True
+    "--input-file",
+    "-i",
+    help="The input file of the knowledge graph. For an embedding file in the binary format (embeddings.npy or embeddings.ids.tsv), the ids in embeddings.ids.tsv are checked.",
+    required=True,
 )
 @click.option(
     "--which-type",
@@ -61,99 +205,50 @@ cli = click.Group()
     ),
     required=True,
 )
-def check_id(input_file, which_type):
+@click.option(
+    "--strict",
+    is_flag=True,
+    help="The whole id must match the pattern. By default, only the beginning of the id must match.",
+)
+@click.option(
+    "--report-file",
+    help="Write all issues to a tsv file, or a json file if it ends with .json. By default, only the summary and the first issues are printed.",
+    default=None,
+)
+def check_id(input_file, which_type, strict, report_file):
     """Check the input file of the knowledge graph.
 
     Args:
         input_file (str): The input file of the knowledge graph.
         which_type (str): The type of the relation to be corrected. It can be "relation", "entity", "relation_type_embedding", or "entity_embedding".
+        strict (bool): The whole id must match the pattern.
+        report_file (str): The file of the issue report.
     """
+    # Only the ids of an embedding file in the binary format are checked
+    input_file = get_ids_file(input_file)
     print(f"Checking the input file {input_file}...")
-    df = pd.read_csv(input_file, sep="\t", dtype=str)
-
-    issues = []
     if which_type == "relation":
-        for col in [
-            "source_id",
-            "target_id",
-            "target_type",
-            "source_id",
-            "relation_type",
-        ]:
-            if col not in df.columns:
-                show_msg(f"{col} is missing.")
-
-        for idx, row in df.iterrows():
-            if not check_entity_id(row["source_id"]):
-                show_msg(f"{row['source_id']} is not a valid entity id at row {idx}.")
-            if not check_entity_id(row["target_id"]):
-                show_msg(f"{row['target_id']} is not a valid entity id at row {idx}.")
-            if not _check_relation_type(row["relation_type"]):
-                show_msg(
-                    f"{row['relation_type']} is not a valid relation type at row {idx}. {row['source_type']} {row['target_type']}"
-                )
-
-            if _check_relation_type(row["relation_type"]):
-                relation_type = row["relation_type"]
-
-                if relation_type is not None:
-                    source_type_in_relation, target_type_in_relation = (
-                        relation_type.split("::")[2].split(":")
-                    )
-                else:
-                    source_type_in_relation, target_type_in_relation = "", ""
-
-                if (
-                    source_type_in_relation != row["source_type"]
-                    or target_type_in_relation != row["target_type"]
-                ) and source_type_in_relation != target_type_in_relation:
-                    show_msg(
-                        f"The source and target type in the relation type {relation_type} are not consistent with the source and target type in the relation at row {idx}."
-                    )
-
-    if which_type == "entity":
-        for col in ["id", "label", "name"]:
-            if col not in df.columns:
-                show_msg(f"{col} is missing.")
-
-        for idx, row in df.iterrows():
-            if not check_entity_id(row["id"]):
-                show_msg(f"{row['id']} is not a valid entity id at row {idx}.")
-
-    if which_type == "relation_type_embedding":
-        for col in ["id", "embedding"]:
-            if col not in df.columns:
-                show_msg(f"{col} is missing.")
-
-        for idx, row in df.iterrows():
-            if not _check_relation_type(row["id"]):
-                show_msg(f"{row['id']} is not a valid relation type at row {idx}.")
-
-    if which_type == "entity_embedding":
-        for col in [
-            "embedding_id",
-            "entity_id",
-            "entity_type",
-            "embedding",
-            "entity_name",
-        ]:
-            if col not in df.columns:
-                show_msg(f"{col} is missing.")
-
-        for idx, row in df.iterrows():
-            if not check_entity_id(row["entity_id"]):
-                show_msg(f"{row['id']} is not a valid entity id at row {idx}.")
+        df = read_relation_table(input_file)
+    else:
+        df = read_entity_table(input_file)
 
-            if not check_node_id(row["embedding_id"]):
-                show_msg(f"{row['embedding_id']} is not a valid node id at row {idx}.")
+    issues = find_id_issues(
+        df, which_type, strict=strict, with_embeddings=not is_ids_file(input_file)
+    )
+    if len(issues) == 0:
+        show_msg(f"No issues found in the input file {input_file}.")
+        return
 
-    if issues:
-        for issue in issues:
-            print(issue)
+    summary = issues.groupby(["column", "rule"]).size().rename("num_issues")
+    show_msg(f"Found {len(issues)} issues in the input file {input_file}:")
+    show_msg(summary.reset_index().to_string(index=False))
 
-            print(
-                f"Found {len(issues)} issues in the input file {input_file}, please check it manually or remove --dry-run to correct it directly."
-            )
+    if report_file:
+        write_issue_report(issues, report_file)
+        show_msg(f"All issues are written to {report_file}.")
+    else:
+        show_msg("The first issues (use --report-file to get all of them):")
+        show_msg(issues.head(20).to_string(index=False))
 
 
 @cli.command(help="Correct the relation file.")
@@ -241,32 +336,47 @@ def correct_relation(uncorrected_file, relation_type_map, which_type):
         print(
             "The source and target type in the relation type are not consistent with the source and target type in the relation, correcting it..."
         )
-        for idx, row in df.iterrows():
-            relation_type = row["relation_type"]
+        # There are only hundreds of relation types, so split them once per unique value
+        codes, relation_types = pd.factorize(df["relation_type"])
+        # The third part is the entity types, such as Gene:Gene in STRING::BINDING::Gene:Gene
+        # The columns are reindexed, a file without relations or without the entity types has fewer columns
+        types_in_relation = (
+            pd.Series(relation_types, dtype=object)
+            .str.split("::", n=3, expand=True)
+            .reindex(columns=range(3))
+        )
+        types_in_relation = (
+            types_in_relation[2]
+            .astype(object)
+            .str.split(":", expand=True)
+            .reindex(columns=range(3))
+        )
+        is_valid = (types_in_relation.notna().sum(axis=1) == 2) & types_in_relation[
+            2
+        ].isna()
+
+        is_invalid = (codes == -1) | ~is_valid.to_numpy()[codes]
+        if is_invalid.any():
+            idx = df.index[is_invalid.argmax()]
+            relation_type = df.at[idx, "relation_type"]
             if type(relation_type) is not str:
                 raise Exception(
                     f"relation_type is not a string: {relation_type} at row {idx}."
                 )
+            raise Exception(
+                f"relation_type is not in the correct format: {relation_type} at row {idx}. {df.at[idx, 'source_type']} {df.at[idx, 'target_type']}"
+            )
 
-            try:
-                source_type_in_relation, target_type_in_relation = relation_type.split(
-                    "::"
-                )[2].split(":")
-            except Exception as e:
-                raise Exception(
-                    f"relation_type is not in the correct format: {relation_type} at row {idx}. {row['source_type']} {row['target_type']}"
-                )
-
-            if (
-                source_type_in_relation != row["source_type"]
-                or target_type_in_relation != row["target_type"]
-            ):
-                df.at[idx, "source_type"] = source_type_in_relation
-                df.at[idx, "target_type"] = target_type_in_relation
-                source_id = row["source_id"]
-                target_id = row["target_id"]
-                df.at[idx, "source_id"] = target_id
-                df.at[idx, "target_id"] = source_id
+        source_type_in_relation = types_in_relation[0].to_numpy()[codes]
+        target_type_in_relation = types_in_relation[1].to_numpy()[codes]
+        to_swap = (source_type_in_relation != df["source_type"].to_numpy()) | (
+            target_type_in_relation != df["target_type"].to_numpy()
+        )
+        df.loc[to_swap, "source_type"] = source_type_in_relation[to_swap]
+        df.loc[to_swap, "target_type"] = target_type_in_relation[to_swap]
+        df.loc[to_swap, ["source_id", "target_id"]] = df.loc[
+            to_swap, ["target_id", "source_id"]
+        ].to_numpy()
 
     relation_file = uncorrected_file.replace(".tsv", "_corrected.tsv")
     df.to_csv(relation_file, sep="\t", index=False)
@@ -278,66 +388,74 @@ def correct_relation(uncorrected_file, relation_type_map, which_type):
 @click.option(
     "--unchecked-file",
     "-r",
-    help="A file is to be checked. It can be a relation file or an entity embedding file.",
+    help="A file is to be checked. It can be a relation file or an entity embedding file, such as entities_embeddings.tsv, or entities_embeddings.npy whose ids are in entities_embeddings.ids.tsv.",
     required=True,
 )
-@click.option("--entity-file", "-e", help="The entity file.", required=True)
-def check_entity(unchecked_file, entity_file):
+@click.option(
+    "--entity-file",
+    "-e",
+    help="The entity file, such as entities.tsv or entities.parquet.",
+    required=True,
+)
+@click.option(
+    "--output-file",
+    "-o",
+    help="Write the missing node ids to a tsv file, grouped by the entity type and the resource. By default, every missing node id is printed.",
+    default=None,
+)
+@click.option(
+    "--fail-on-missing",
+    is_flag=True,
+    help="Exit with a non-zero code if any node is missing, so it can be used as a gate in a pipeline.",
+)
+def check_entity(unchecked_file, entity_file, output_file, fail_on_missing):
     """Check if all entities in the relation / entity embedding file are in the entity file.
 
     Args:
         unchecked_file (str): A file is to be checked. It can be a relation file or an entity embedding file.
         entity_file (str): The entity file.
+        output_file (str): The file of the missing node ids.
+        fail_on_missing (bool): Exit with a non-zero code if any node is missing.
     """
-    unchecked = pd.read_csv(unchecked_file, sep="\t", dtype=str)
-    entity_df = pd.read_csv(entity_file, sep="\t", dtype=str)
-    node_ids = [
-        f"{entity_type}::{entity_id}"
-        for entity_type, entity_id in zip(entity_df["label"], entity_df["id"])
-    ]
-
-    issues = []
-    # It's a relation file
-    if "source_id" in unchecked.columns and "target_id" in unchecked.columns:
-        source_node_ids = list(
-            set(
-                [
-                    f"{entity_type}::{entity_id}"
-                    for entity_type, entity_id in zip(
-                        unchecked["source_type"], unchecked["source_id"]
-                    )
-                ]
-            )
+    unchecked_file = get_ids_file(unchecked_file)
+    # Only the ids, the types and the resources are read, not the embeddings or the other columns
+    header = read_table_header(unchecked_file)
+    if "source_id" in header and "target_id" in header:
+        unchecked = read_relation_table(
+            unchecked_file, usecols=[col for col in relation_columns if col in header]
         )
-        for node_id in source_node_ids:
-            if node_id not in node_ids:
-                show_msg(f"Source {node_id} is not in the entity file.")
-
-        target_node_ids = list(
-            set(
-                [
-                    f"{entity_type}::{entity_id}"
-                    for entity_type, entity_id in zip(
-                        unchecked["target_type"], unchecked["target_id"]
-                    )
-                ]
-            )
+    else:
+        unchecked = read_entity_table(
+            unchecked_file,
+            usecols=[
+                col for col in ["entity_id", "entity_type", "resource"] if col in header
+            ],
         )
-        for node_id in target_node_ids:
-            if node_id not in node_ids:
-                show_msg(f"Target {node_id} is not in the entity file.")
-
-    # It's a entity embedding file
-    if "entity_id" in unchecked.columns and "entity_type" in unchecked.columns:
-        for entity_type, entity_id in zip(
-            unchecked["entity_type"], unchecked["entity_id"]
+    entity_df = read_entity_table(entity_file, usecols=["id", "label"])
+
+    missing = find_missing_nodes(entity_df, unchecked)
+    if output_file:
+        missing.to_csv(output_file, sep="\t", index=False)
+        show_msg(f"The missing node ids are written to {output_file}.")
+    else:
+        for role, node_id in missing[["role", "node_id"]].drop_duplicates().itertuples(
+            index=False
         ):
-            if f"{entity_type}::{entity_id}" not in node_ids:
-                show_msg(f"{entity_type}::{entity_id} is not in the entity file.")
+            if role == "entity":
+                show_msg(f"{node_id} is not in the entity file.")
+            else:
+                show_msg(f"{role.capitalize()} {node_id} is not in the entity file.")
+
+    num_missing = missing["node_id"].nunique()
+    if num_missing > 0:
+        summary = missing.groupby(["entity_type", "resource", "role"]).agg(
+            num_nodes=("node_id", "size"), num_rows=("num_rows", "sum")
+        )
+        show_msg(f"Found {num_missing} missing nodes in {unchecked_file}:")
+        show_msg(summary.reset_index().to_string(index=False))
 
-    if issues:
-        for issue in issues:
-            print(issue)
+        if fail_on_missing:
+            sys.exit(1)
 
 
 @cli.command(
@@ -347,7 +465,7 @@ def check_entity(unchecked_file, entity_file):
 @click.option(
     "--relation-type-embedding-file",
     "-e",
-    help="The relation type embedding file.",
+    help="The relation type embedding file, such as relation_types_embeddings.tsv or relation_types_embeddings.npy whose ids are in relation_types_embeddings.ids.tsv.",
     required=True,
 )
 def check_relation_type(relation_file, relation_type_embedding_file):
@@ -357,9 +475,9 @@ def check_relation_type(relation_file, relation_type_embedding_file):
         relation_file (str): The relation file.
         relation_type_embedding_file (str): The relation type embedding file.
     """
-    relation_df = pd.read_csv(relation_file, sep="\t", dtype=str)
+    relation_df = read_relation_table(relation_file, usecols=["relation_type"])
     relation_type_embedding_df = pd.read_csv(
-        relation_type_embedding_file, sep="\t", dtype=str
+        get_ids_file(relation_type_embedding_file), sep="\t", dtype=str
     )
     relation_types = relation_type_embedding_df["id"].unique()
 
@@ -1,11 +1,24 @@
 import os
 import re
+import sys
+import json
+import time
+import hashlib
 import logging
 import click
+import numpy as np
 import pandas as pd
 from typing import List
+from functools import partial
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 from ontology_matcher.ontology_formatter import BaseOntologyFileFormat
 
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(root_dir, "lib"))
+
+from kg_loader import write_table, table_formats, get_table_file  # noqa: E402
+
 
 fmt = "%(asctime)s - %(module)s:%(lineno)d - %(levelname)s - %(message)s"
 logger = logging.getLogger("merge_entities.py")
@@ -136,26 +149,114 @@ id_priority = {
 
 
 class UnionFind:
-    def __init__(self):
-        self.parent = {}
+    """Union-find over the integer codes 0..size-1, with path compression and union by rank."""
+
+    def __init__(self, size: int):
+        # Plain lists are faster than numpy arrays for the scalar accesses of find and union
+        self.parent = list(range(size))
+        self.rank = [0] * size
 
-    def find(self, item):
-        if item not in self.parent:
-            self.parent[item] = item
-        if self.parent[item] != item:
-            self.parent[item] = self.find(self.parent[item])
-        return self.parent[item]
+    def find(self, item: int) -> int:
+        parent = self.parent
+        root = item
+        while parent[root] != root:
+            root = parent[root]
 
-    def union(self, item1, item2):
+        # Path compression, point every item on the path to the root
+        while parent[item] != root:
+            parent[item], item = root, parent[item]
+        return root
+
+    def union(self, item1: int, item2: int):
         root1 = self.find(item1)
         root2 = self.find(item2)
-        if root1 != root2:
-            self.parent[root2] = root1
+        if root1 == root2:
+            return
+
+        # Union by rank, attach the shallower tree to the deeper one
+        if self.rank[root1] < self.rank[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        if self.rank[root1] == self.rank[root2]:
+            self.rank[root1] += 1
+
+    def union_pairs(self, items1: np.ndarray, items2: np.ndarray):
+        for item1, item2 in zip(items1.tolist(), items2.tolist()):
+            self.union(item1, item2)
+
+    def roots(self) -> np.ndarray:
+        return np.array(
+            [self.find(item) for item in range(len(self.parent))], dtype=np.int64
+        )
+
+
+# We might get multiple resources for the same entity, we need to choose the main resource based on the priority order.
+def choose_database(databases, label):
+    for prefix in entity_db_order_map.get(label, []):
+        for db in databases:
+            db_lower = db.lower()
+            # It's SymptomOntology in the entity file, but we use Symptom-Ontology in the entity_db_order_map, so we need to replace the hyphen with "".
+            if (
+                db_lower.startswith(prefix.lower())
+                or db_lower.startswith(prefix.replace("-", "").lower())
+                or db_lower.startswith(prefix.replace("_", "").lower())
+            ):
+                return db
+    return list(databases)[0]
+
+
+def _join_by_group(groups: np.ndarray, values: np.ndarray, num_groups: int) -> np.ndarray:
+    """Join the values of each group with |, the rows must be sorted by the group code. It's much faster than groupby.agg("|".join) on millions of groups."""
+    values = values.tolist()
+    starts = np.searchsorted(groups, np.arange(num_groups), side="left").tolist()
+    ends = np.searchsorted(groups, np.arange(num_groups), side="right").tolist()
+    return np.array(
+        ["|".join(values[start:end]) for start, end in zip(starts, ends)],
+        dtype=object,
+    )
+
+
+def join_unique_values(
+    values: pd.Series, groups: np.ndarray, num_groups: int
+) -> np.ndarray:
+    """Join the unique non-empty values (split by |) of each group with | in the sorted order.
+
+    Args:
+        values (pd.Series): the values of all rows, the missing values are ignored.
+        groups (np.ndarray): the group code of each row.
+        num_groups (int): the number of groups.
+
+    Returns:
+        np.ndarray: the joined values of the groups.
+    """
+    pieces = pd.DataFrame(
+        {"group": groups, "value": values.fillna("").to_numpy(dtype=object)}
+    )
+    # Most values have no |, only split the others
+    has_pipe = pieces["value"].str.contains("|", regex=False).to_numpy()
+    pieces = pd.concat(
+        [
+            pieces[~has_pipe],
+            pieces[has_pipe]
+            .assign(value=pieces.loc[has_pipe, "value"].str.split("|"))
+            .explode("value"),
+        ]
+    )
+    pieces = (
+        pieces[pieces["value"] != ""]
+        .drop_duplicates()
+        .sort_values(["group", "value"], kind="stable")
+    )
+    return _join_by_group(
+        pieces["group"].to_numpy(), pieces["value"].to_numpy(dtype=object), num_groups
+    )
 
 
 def deep_deduplicate(entities_df, id_priority):
     """Deep deduplicate the entities with the same id or cross-references.
 
+    The rows of a label in the id_priority which share an id, a prefixed xref or a lowercased name are merged into one entity. The main id of an entity is the id of its first row with the highest priority prefix, or the id of its first row if no id has a prefix in the priority list.
+
     Args:
         entities_df (pd.DataFrame): The entities dataframe to be deduplicated.
         id_priority (dict): The priority dictionary for id selection.
@@ -164,126 +265,256 @@ def deep_deduplicate(entities_df, id_priority):
         pd.DataFrame: The deduplicated entities dataframe.
         list: The logs for the deduplication process.
     """
-    entities = entities_df.copy()
+    # The entities without an id or a label can't be grouped, the same as the groupby below
+    entities = entities_df[entities_df["id"].notna() & entities_df["label"].notna()]
+    # The logs refer to the components by the index of their first rows in the input
+    input_index = entities.index.to_numpy()
+    entities = entities.reset_index(drop=True)
     logs = []
-    entities["xrefs"] = entities["xrefs"].fillna("")
-    entities["xrefs_list"] = entities["xrefs"].str.split("|")
-
-    def is_prefixed_id(id, prefixes):
-        return any(id.startswith(prefix) for prefix in prefixes)
-
-    # We might get multiple ids for the same entity, we need to choose the main id based on the priority order.
-    def choose_id(ids, label):
-        for prefix in id_priority.get(label, []):
-            for id in ids:
-                if id.startswith(prefix):
-                    return id
-        return list(ids)[0]
-
-    # We might get multiple resources for the same entity, we need to choose the main resource based on the priority order.
-    def choose_database(databases, label):
-        for prefix in entity_db_order_map.get(label, []):
-            for db in databases:
-                db_lower = db.lower()
-                # It's SymptomOntology in the entity file, but we use Symptom-Ontology in the entity_db_order_map, so we need to replace the hyphen with "".
-                if (
-                    db_lower.startswith(prefix.lower())
-                    or db_lower.startswith(prefix.replace("-", "").lower())
-                    or db_lower.startswith(prefix.replace("_", "").lower())
-                ):
-                    return db
-        return list(databases)[0]
-
-    merged_rows = []
-    uf = UnionFind()
-
-    for label, group in entities.groupby("label"):
-        if label not in id_priority:
-            merged_rows.extend(group.to_dict(orient="records"))
-            continue
-
-        id_to_index = {}
-        for index, row in group.iterrows():
-            id_to_index.setdefault(row["id"], []).append(index)
-            for xref in row["xrefs_list"]:
-                if xref and is_prefixed_id(xref, id_priority[str(label)]):
-                    id_to_index.setdefault(xref, []).append(index)
-
-            name_lower = row["name"].lower()
-            id_to_index.setdefault(name_lower, []).append(index)
+    num_rows = len(entities)
+    labels = entities["label"].astype(str)
+    is_deep = labels.isin(list(id_priority.keys())).to_numpy()
+
+    # The (row, key) table in one key space: ids, xrefs with a priority prefix and lowercased names
+    keys = []
+    for label in sorted(labels[is_deep].unique()):
+        prefixes = tuple(id_priority[label])
+        rows = entities[(labels == label).to_numpy()]
+        xrefs = rows["xrefs"].fillna("").str.split("|").explode()
+        xrefs = xrefs[(xrefs != "") & xrefs.str.startswith(prefixes)]
+        names = rows["name"].dropna().str.lower()
+
+        keys.append(
+            pd.DataFrame(
+                {
+                    "row": np.concatenate([rows.index, xrefs.index, names.index]),
+                    "label": label,
+                    "key": np.concatenate(
+                        [rows["id"].to_numpy(), xrefs.to_numpy(), names.to_numpy()]
+                    ),
+                }
+            )
+        )
 
+    uf = UnionFind(num_rows)
+    if keys:
+        keys = pd.concat(keys, ignore_index=True).dropna(subset=["key"])
+        key_codes = keys.groupby(["label", "key"], sort=False).ngroup().to_numpy()
+        # Union all rows of a key with the first row of the key
+        first_rows = (
+            pd.Series(keys["row"].to_numpy()).groupby(key_codes).transform("first")
+        ).to_numpy()
+        is_linked = first_rows != keys["row"].to_numpy()
+        uf.union_pairs(first_rows[is_linked], keys["row"].to_numpy()[is_linked])
+
+    # The component of a row is its first row, the rows of other labels are their own components
+    roots = uf.roots()
+    components = (
+        pd.Series(np.arange(num_rows)).groupby(roots).transform("min").to_numpy()
+    )
+
+    # The main row of a component is its first row with the highest priority id
+    id_ranks = np.full(num_rows, np.iinfo(np.int64).max, dtype=np.int64)
+    for label, prefixes in id_priority.items():
+        is_label = (labels == label).to_numpy()
+        ids = entities.loc[is_label, "id"].fillna("")
+        ranks = np.full(is_label.sum(), len(prefixes), dtype=np.int64)
+        for rank, prefix in reversed(list(enumerate(prefixes))):
+            ranks[ids.str.startswith(prefix).to_numpy()] = rank
+        id_ranks[is_label] = ranks
+    order = np.lexsort((np.arange(num_rows), id_ranks, components))
+    main_rows = pd.Series(order).groupby(components[order]).first()
+
+    # The final entities are grouped by (main id, label), the same as the old groupby over the merged rows
+    main_ids = entities["id"].to_numpy(dtype=object)[
+        main_rows.reindex(components).to_numpy()
+    ]
+    groups, group_keys = pd.MultiIndex.from_arrays(
+        [main_ids, entities["label"].to_numpy(dtype=object)]
+    ).factorize()
+    group_keys = pd.DataFrame(
+        {
+            "id": group_keys.get_level_values(0),
+            "label": group_keys.get_level_values(1),
+        }
+    )
+    num_groups = len(group_keys)
+
+    # Log the components which merge several ids
+    merged = pd.DataFrame(
+        {
+            "component": components,
+            "label": labels,
+            "id": entities["id"].to_numpy(dtype=object),
+            "name": entities["name"].to_numpy(dtype=object),
+        }
+    )[is_deep]
+    num_ids = merged.groupby("component")["id"].transform("nunique")
+    merged = merged[(num_ids > 1).to_numpy()].sort_values(
+        ["label", "component"], kind="stable"
+    )
+    main_ids_of_components = entities["id"].to_numpy(dtype=object)[
+        main_rows.reindex(merged["component"]).to_numpy()
+    ]
+    for label in sorted(labels[is_deep].unique()):
         msg = f"Processing {label} entities:"
         logs.append(msg)
-        print(msg)
-
-        logs.append(f"Id to Index: {id_to_index}")
-
-        print("Try to merge the indices with the same id or xrefs")
-        for key, indices in id_to_index.items():
-            for i in range(len(indices) - 1):
-                uf.union(indices[i], indices[i + 1])
-
-        index_groups = {}
-        for index in group.index:
-            root = uf.find(index)
-            if root not in index_groups:
-                index_groups[root] = []
-            index_groups[root].append(index)
-
-        print("Dealing with the merged indices...")
-        logs.append(f"Index Groups: {index_groups}")
-        for key, indices in index_groups.items():
-            related_rows = group.loc[indices]
-            ids = related_rows["id"].tolist()
-            names = related_rows["name"].tolist()
-            id_names = list(zip(ids, names))
-
-            all_ids = set(related_rows["id"].tolist())
-            all_xrefs = set(related_rows["xrefs"].str.cat(sep="|").split("|"))
-            merged_xrefs = all_ids.union(all_xrefs) - {""}
-            main_id = choose_id(all_ids, label)
-
-            if len(set(ids)) > 1:
-                msg = f"These ids might point to the same entity with {label} label [Main ID - {main_id}]: {key} - {id_names}"
-                logs.append(msg)
-                print(msg)
-            logs.append(f"\t{main_id} - {related_rows.to_dict(orient='records')}")
-
-            merged_row = related_rows.iloc[0].copy()
-            for col in related_rows.columns:
-                if col not in ["id", "xrefs", "xrefs_list", "name"]:
-                    values = related_rows[col].dropna().unique()
-                    merged_row[col] = "|".join(sorted(set(values)))
-            merged_row["xrefs"] = "|".join(sorted(merged_xrefs))
-            merged_row["id"] = main_id
-            merged_row["name"] = related_rows.loc[
-                related_rows["id"] == main_id, "name"
-            ].values[0]
-            merged_rows.append(merged_row)
-
-    merged_df = pd.DataFrame(merged_rows)
-    merged_df = merged_df.drop(columns=["xrefs_list"]).fillna("")
-    grouped_cols = ["id", "label"]
-    first_cols = ["name", "description"]
-    join_cols = [
-        col for col in merged_df.columns if col not in first_cols + grouped_cols
+        logger.info(msg)
+
+        is_label = (merged["label"] == label).to_numpy()
+        rows = merged[is_label]
+        component_list = input_index[rows["component"].to_numpy()].tolist()
+        id_names = list(zip(rows["id"].tolist(), rows["name"].tolist()))
+        main_id_list = main_ids_of_components[is_label].tolist()
+        start = 0
+        for end in range(1, len(component_list) + 1):
+            if end < len(component_list) and component_list[end] == component_list[start]:
+                continue
+            logs.append(
+                f"These ids might point to the same entity with {label} label [Main ID - {main_id_list[start]}]: {component_list[start]} - {id_names[start:end]}"
+            )
+            start = end
+
+        logger.info(
+            "Merged %s %s entities into %s entities"
+            % (len(rows), label, rows["component"].nunique())
+        )
+
+    # The deep deduplicated components keep the name of the main row and join all descriptions,
+    # the other rows keep the first name and description of their (id, label) group
+    first_rows = pd.Series(np.arange(num_rows)).groupby(groups).first().to_numpy()
+    name_rows = np.where(
+        is_deep[first_rows],
+        main_rows.reindex(components[first_rows]).to_numpy(),
+        first_rows,
+    )
+    result_df = group_keys.copy()
+    result_df["name"] = entities["name"].fillna("").to_numpy(dtype=object)[name_rows]
+    first_description = entities["description"].fillna("").to_numpy(dtype=object)[
+        first_rows
     ]
-    agg_dict = {col: "first" for col in first_cols}
-    join_cols_dict: dict = {
-        col: lambda x: "|".join(sorted(set("|".join(x).split("|"))))
-        for col in join_cols
-    }
-    agg_dict.update(**join_cols_dict)
+    descriptions = entities.loc[is_deep, "description"].dropna()
+    descriptions = (
+        pd.DataFrame(
+            {
+                "group": groups[descriptions.index],
+                "description": descriptions.to_numpy(dtype=object),
+            }
+        )
+        .drop_duplicates()
+        .sort_values(["group", "description"], kind="stable")
+    )
+    joined_description = _join_by_group(
+        descriptions["group"].to_numpy(),
+        descriptions["description"].to_numpy(dtype=object),
+        num_groups,
+    )
+    result_df["description"] = np.where(
+        is_deep[first_rows], joined_description, first_description
+    )
 
-    result_df = merged_df.groupby(["id", "label"]).agg(agg_dict).reset_index()
-    for col in join_cols + first_cols:
+    join_cols = [
+        col
+        for col in entities.columns
+        if col not in ["id", "label", "name", "description"]
+    ]
+    for col in join_cols:
+        values = entities[col]
+        if col == "xrefs":
+            # The ids of a deep deduplicated entity are its xrefs too
+            values = values.where(~is_deep, values.fillna("") + "|" + entities["id"])
+        result_df[col] = join_unique_values(values, groups, num_groups)
+
+    for col in ["name", "description"]:
         result_df[col] = result_df[col].str.strip("|")
 
+    result_df = result_df.sort_values(["id", "label"], ignore_index=True)
+
     # We don't want the resource column to have several values, such as Mondo|Orphanet, we want to keep only one value based on the priority order.
     # The resource column will be used in statistics of entities. We don't like to have several values in the resource column. And we don't care about all the resources, we only care about the main resource.
-    result_df["resource"] = result_df.apply(
-        lambda row: choose_database(row["resource"].split("|"), row["label"]), axis=1
+    resource_codes, resource_keys = pd.MultiIndex.from_arrays(
+        [result_df["resource"], result_df["label"]]
+    ).factorize()
+    resources = np.array(
+        [
+            choose_database(resource.split("|"), label)
+            for resource, label in resource_keys
+        ],
+        dtype=object,
     )
+    result_df["resource"] = resources[resource_codes]
+    return result_df, logs
+
+
+def get_label_fingerprint(entities_df: pd.DataFrame, label: str, id_priority) -> str:
+    """Get the fingerprint of the entities of a label and the settings which affect their deep deduplication."""
+    sha256 = hashlib.sha256()
+    sha256.update(
+        json.dumps(
+            [
+                label,
+                list(entities_df.columns),
+                id_priority.get(label),
+                entity_db_order_map.get(label),
+            ]
+        ).encode()
+    )
+    sha256.update(
+        pd.util.hash_pandas_object(entities_df, index=False).to_numpy().tobytes()
+    )
+    return sha256.hexdigest()
+
+
+def deep_deduplicate_incremental(entities_df, id_priority, cache_dir):
+    """Deep deduplicate the entities label by label and cache the result of each label.
+
+    The labels are deduplicated independently, so the result is the same as deep_deduplicate. A label is only deduplicated again if its entities or its settings changed.
+
+    Args:
+        entities_df (pd.DataFrame): The entities dataframe to be deduplicated.
+        id_priority (dict): The priority dictionary for id selection.
+        cache_dir (str): The directory of the cached results.
+
+    Returns:
+        pd.DataFrame: The deduplicated entities dataframe.
+        list: The logs for the deduplication process.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    results = []
+    logs = []
+    for label, group in entities_df.groupby("label", sort=True):
+        fingerprint = get_label_fingerprint(group, label, id_priority)
+        cache_file = os.path.join(cache_dir, "%s.%s.tsv" % (label, fingerprint[:16]))
+        log_file = cache_file.replace(".tsv", ".log")
+
+        if os.path.exists(cache_file) and os.path.exists(log_file):
+            logger.info(
+                "The %s entities are unchanged, reuse %s" % (label, cache_file)
+            )
+            result = pd.read_csv(cache_file, sep="\t", dtype=str, na_filter=False)
+            with open(log_file) as f:
+                label_logs = f.read().split("\n") if label in id_priority else []
+        else:
+            result, label_logs = deep_deduplicate(group, id_priority)
+
+            # Remove the stale results of the label
+            for file in os.listdir(cache_dir):
+                if file.startswith("%s." % label):
+                    os.remove(os.path.join(cache_dir, file))
+
+            result.to_csv(cache_file, sep="\t", index=False)
+            with open(log_file, "w") as f:
+                f.write("\n".join(label_logs))
+
+        results.append(result)
+        logs.extend(label_logs)
+
+    if not results:
+        return deep_deduplicate(entities_df, id_priority)
+
+    result_df = pd.concat(results, ignore_index=True)
+    result_df = result_df.sort_values(["id", "label"], ignore_index=True)
     return result_df, logs
 
 
@@ -318,6 +549,117 @@ def check_entities(entities: pd.DataFrame) -> List[str]:
     return errors
 
 
+def get_matched_resources(entity_type: str, resources: List[str]) -> List[str]:
+    """Get the files of an entity type, ordered by the entity_db_order_map."""
+    # Filter the matched resources for the specified entity type
+    matched_resources = list(
+        filter(
+            lambda x: x.endswith(title_case_to_snake_case(entity_type) + ".tsv"),
+            resources,
+        )
+    )
+
+    # Order the matched resources by the entity_db_order_map
+    return sorted(
+        matched_resources,
+        key=lambda x: str(entity_db_order_map[entity_type])
+        .lower()
+        .index(
+            # NOTICE: The name must keep the same format as the value in the entity_db_order_map
+            os.path.basename(os.path.dirname(x))
+        ),
+    )
+
+
+def get_file_sha256(filepath: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_entity_type_fingerprint(
+    entity_type: str, resources: List[str], input_dir: str
+) -> dict:
+    """Get the fingerprint of the inputs of an entity type, it changes if any file of the entity type or the order of the resources changes."""
+    matched_resources = get_matched_resources(entity_type, resources)
+    return {
+        "inputs": {
+            os.path.relpath(x, input_dir): get_file_sha256(x)
+            for x in matched_resources
+        },
+        "resource_order": entity_db_order_map[entity_type],
+    }
+
+
+def merge_entity_type(
+    entity_type: str, resources: List[str], output_dir: str, read_workers: int = 4
+) -> dict:
+    """Merge the entities of an entity type from all resources and write them to a tsv file.
+
+    Args:
+        entity_type (str): The entity type, such as Disease.
+        resources (List[str]): All files in the input directory.
+        output_dir (str): The output directory.
+        read_workers (int, optional): Number of threads which read the files. Defaults to 4.
+
+    Returns:
+        dict: The entity type, the number of files, the number of rows in the files, the number of merged entities and the elapsed time.
+    """
+    start = time.perf_counter()
+
+    matched_resources = get_matched_resources(entity_type, resources)
+    logger.info("Merging %s entities from %s\n" % (entity_type, matched_resources))
+    logger.info(
+        "The order of matched resources: %s\n" % entity_db_order_map[entity_type]
+    )
+    logger.info("Ordered matched resources: %s\n" % matched_resources)
+    # Read the entities from all matched resources, the order of the files is kept
+    with ThreadPoolExecutor(max_workers=read_workers) as executor:
+        entities = list(executor.map(read_csv, matched_resources))
+    # Merge the entities from all matched resources
+    merged_entities = pd.concat(entities, ignore_index=True, axis=0)
+    num_rows = len(merged_entities)
+
+    # Drop the duplicated entities
+    merged_entities = merged_entities.drop_duplicates(subset=["id"], keep="first")
+
+    # Remove the rows that have empty id, name, label
+    merged_entities = merged_entities[
+        merged_entities["id"].notnull()
+        & merged_entities["name"].notnull()
+        & merged_entities["label"].notnull()
+    ]
+
+    # Remove all unexpected empty characters, such as leading and trailing spaces
+    merged_entities["description"] = merged_entities["description"].fillna("")
+    merged_entities["description"] = merged_entities["description"].apply(
+        lambda x: " ".join(x.strip().split())
+    )
+
+    # Write the merged entities to a tsv file
+    merged_entities.to_csv(
+        os.path.join(output_dir, "%s.tsv" % title_case_to_snake_case(entity_type)),
+        sep="\t",
+        index=False,
+    )
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        "Merged %s entities from %s rows of %s in %.2fs"
+        % (len(merged_entities), num_rows, entity_type, elapsed)
+    )
+    return {
+        "entity_type": entity_type,
+        "num_files": len(matched_resources),
+        "num_rows": num_rows,
+        "num_entities": len(merged_entities),
+        "elapsed": round(elapsed, 2),
+        "cached": False,
+    }
+
+
 @cli.command(help="Merge the entities from all resources")
 @click.option(
     "--input-dir",
@@ -333,82 +675,111 @@ def check_entities(entities: pd.DataFrame) -> List[str]:
     required=True,
     type=click.Path(exists=True, file_okay=False, dir_okay=True),
 )
-def from_databases(input_dir, output_dir):
+@click.option(
+    "--workers",
+    "-w",
+    help="Number of processes which merge the entity types in parallel.",
+    default=1,
+    type=int,
+)
+@click.option(
+    "--read-workers",
+    "-t",
+    help="Number of threads which read the files of an entity type in parallel in each process.",
+    default=4,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--incremental",
+    help="Only merge the entity types whose input files changed since the last run, the others are reused from the output directory. The sha256 of the input files are kept in merge_entities_manifest.json in the output directory.",
+    is_flag=True,
+)
+def from_databases(input_dir, output_dir, workers, read_workers, incremental):
     # Get all files in the input directory recursively
     resources = get_all_files_recursively(input_dir)
 
     logger.info("Resources: %s\n" % resources)
 
-    # Filter the matched resources for the specified entity type
-    def filter_resources(entity_type):
-        return list(
-            filter(
-                lambda x: x.endswith(title_case_to_snake_case(entity_type) + ".tsv"),
-                resources,
+    start = time.perf_counter()
+    manifest_file = os.path.join(output_dir, "merge_entities_manifest.json")
+    manifest = {}
+    changed_entity_types = entity_types
+    stats = []
+    if incremental:
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                manifest = json.load(f)
+
+        changed_entity_types = []
+        for entity_type in entity_types:
+            fingerprint = get_entity_type_fingerprint(entity_type, resources, input_dir)
+            output_file = os.path.join(
+                output_dir, "%s.tsv" % title_case_to_snake_case(entity_type)
             )
-        )
-
-    # Merge the entities from all resources for the specified entity type
-    def merge_entities(entity_type):
-        # Filter the matched resources for the specified entity type
-        matched_resources = filter_resources(entity_type)
-
-        logger.info("Merging %s entities from %s\n" % (entity_type, matched_resources))
-
-        # Order the matched resources by the entity_db_order_map
-        matched_resources = sorted(
-            matched_resources,
-            key=lambda x: str(entity_db_order_map[entity_type])
-            .lower()
-            .index(
-                # NOTICE: The name must keep the same format as the value in the entity_db_order_map
-                os.path.basename(os.path.dirname(x))
-            ),
-        )
-
-        logger.info(
-            "The order of matched resources: %s\n" % entity_db_order_map[entity_type]
-        )
-        logger.info("Ordered matched resources: %s\n" % matched_resources)
-        # Read the entities from all matched resources
-        entities = list(
-            map(
-                lambda x: read_csv(x),
-                matched_resources,
+            last = manifest.get(entity_type, {})
+            if (
+                last.get("inputs") == fingerprint["inputs"]
+                and last.get("resource_order") == fingerprint["resource_order"]
+                and os.path.exists(output_file)
+                and last.get("output_sha256") == get_file_sha256(output_file)
+            ):
+                logger.info(
+                    "The inputs of %s are unchanged, reuse %s"
+                    % (entity_type, output_file)
+                )
+                stats.append(
+                    {
+                        "entity_type": entity_type,
+                        "num_entities": last.get("num_entities"),
+                        "elapsed": 0.0,
+                        "cached": True,
+                    }
+                )
+            else:
+                changed_entity_types.append(entity_type)
+                manifest[entity_type] = fingerprint
+
+    func = partial(
+        merge_entity_type,
+        resources=resources,
+        output_dir=output_dir,
+        read_workers=read_workers,
+    )
+    if workers > 1 and len(changed_entity_types) > 1:
+        with Pool(processes=min(workers, len(changed_entity_types))) as pool:
+            stats.extend(pool.imap_unordered(func, changed_entity_types))
+    else:
+        stats.extend(map(func, changed_entity_types))
+
+    if incremental:
+        for stat in stats:
+            if stat["cached"]:
+                continue
+            entity_type = stat["entity_type"]
+            manifest[entity_type]["num_entities"] = stat["num_entities"]
+            manifest[entity_type]["output_sha256"] = get_file_sha256(
+                os.path.join(
+                    output_dir, "%s.tsv" % title_case_to_snake_case(entity_type)
+                )
             )
-        )
-        # Merge the entities from all matched resources
-        merged_entities = pd.concat(entities, ignore_index=True, axis=0)
-
-        # Drop the duplicated entities
-        merged_entities = merged_entities.drop_duplicates(subset=["id"], keep="first")
-
-        # Return the merged entities
-        return merged_entities
-
-    for entity_type in entity_types:
-        # Merge the entities from all resources for the specified entity type
-        merged_entities = merge_entities(entity_type)
-
-        # Remove the rows that have empty id, name, label
-        merged_entities = merged_entities[
-            merged_entities["id"].notnull()
-            & merged_entities["name"].notnull()
-            & merged_entities["label"].notnull()
-        ]
-
-        # Remove all unexpected empty characters, such as leading and trailing spaces
-        merged_entities["description"] = merged_entities["description"].fillna("")
-        merged_entities["description"] = merged_entities["description"].apply(
-            lambda x: " ".join(x.strip().split())
-        )
-
-        # Write the merged entities to a tsv file
-        merged_entities.to_csv(
-            os.path.join(output_dir, "%s.tsv" % title_case_to_snake_case(entity_type)),
-            sep="\t",
-            index=False,
-        )
+        with open(manifest_file, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    stats = pd.DataFrame(
+        stats,
+        columns=[
+            "entity_type",
+            "num_files",
+            "num_rows",
+            "num_entities",
+            "elapsed",
+            "cached",
+        ],
+    ).sort_values("elapsed", ascending=False)
+    logger.info(
+        "Merged %s entity types in %.2fs:\n%s"
+        % (len(stats), time.perf_counter() - start, stats.to_string(index=False))
+    )
 
 
 @cli.command(help="Merge the entity files to a single file")
@@ -422,7 +793,7 @@ def from_databases(input_dir, output_dir):
 @click.option(
     "--output-file",
     "-o",
-    help="Output file path, such as entities.tsv",
+    help="Output file path, such as entities.tsv or entities.parquet. The extension is changed to match --output-format.",
     required=True,
     type=click.Path(exists=False, file_okay=True, dir_okay=False),
 )
@@ -438,7 +809,33 @@ def from_databases(input_dir, output_dir):
     help="Whether to remove obsolete entities",
     is_flag=True,
 )
-def to_single_file(input_dir, output_file, deep_deduplication, remove_obsolete):
+@click.option(
+    "--incremental",
+    help="Cache the deep deduplication result of each label by the fingerprint of its entities, only the labels whose entities changed are deduplicated again. The cache is kept in the .<output file name>_cache directory next to the output file. It requires --deep-deduplication.",
+    is_flag=True,
+)
+@click.option(
+    "--output-format",
+    "-f",
+    help="The format of the output files (the merged, the full and the obsolete entities), downstream stages load a parquet file much faster and can read only the columns they need",
+    type=click.Choice(table_formats),
+    default="tsv",
+)
+def to_single_file(
+    input_dir,
+    output_file,
+    deep_deduplication,
+    remove_obsolete,
+    incremental,
+    output_format,
+):
+    if incremental and not deep_deduplication:
+        raise click.UsageError(
+            "--incremental caches the deep deduplication, it requires --deep-deduplication."
+        )
+
+    output_file = get_table_file(output_file, output_format)
+
     # Get all files in the input directory recursively
     resources = get_all_files_recursively(input_dir)
 
@@ -486,12 +883,22 @@ def to_single_file(input_dir, output_file, deep_deduplication, remove_obsolete):
     merged_entities = raw_merged_entities.copy()
     obsolete_entities = None
 
-    raw_output_file = output_file.replace(".tsv", "_full.tsv")
-    log_output_file = output_file.replace(".tsv", ".log")
-    obsolete_output_file = output_file.replace(".tsv", "_obsolete.tsv")
+    output_root, output_ext = os.path.splitext(output_file)
+    raw_output_file = output_root + "_full" + output_ext
+    log_output_file = output_root + ".log"
+    obsolete_output_file = output_root + "_obsolete" + output_ext
 
     if deep_deduplication:
-        merged_entities, logs = deep_deduplicate(merged_entities, id_priority)
+        if incremental:
+            cache_dir = os.path.join(
+                os.path.dirname(os.path.abspath(output_file)),
+                ".%s_cache" % os.path.splitext(os.path.basename(output_file))[0],
+            )
+            merged_entities, logs = deep_deduplicate_incremental(
+                merged_entities, id_priority, cache_dir
+            )
+        else:
+            merged_entities, logs = deep_deduplicate(merged_entities, id_priority)
 
         with open(log_output_file, "w") as f:
             f.write("\n".join(logs))
@@ -512,11 +919,11 @@ def to_single_file(input_dir, output_file, deep_deduplication, remove_obsolete):
         ]
         logger.info("Number of merged entities: %s\n" % merged_entities.shape[0])
 
-    raw_merged_entities.to_csv(raw_output_file, sep="\t", index=False)
-    merged_entities.to_csv(output_file, sep="\t", index=False)
+    write_table(raw_merged_entities, raw_output_file, output_format)
+    write_table(merged_entities, output_file, output_format)
 
     if obsolete_entities is not None:
-        obsolete_entities.to_csv(obsolete_output_file, sep="\t", index=False)
+        write_table(obsolete_entities, obsolete_output_file, output_format)
 
 
 @cli.command(help="Merge multiple entity files to a single file")
@@ -531,11 +938,20 @@ def to_single_file(input_dir, output_file, deep_deduplication, remove_obsolete):
 @click.option(
     "--output-file",
     "-o",
-    help="Output file path, such as entities.tsv",
+    help="Output file path, such as entities.tsv or entities.parquet. The extension is changed to match --output-format.",
     required=True,
     type=click.Path(exists=False, file_okay=True, dir_okay=False),
 )
-def merge_multiple_files(input_file, output_file):
+@click.option(
+    "--output-format",
+    "-f",
+    help="The format of the output file",
+    type=click.Choice(table_formats),
+    default="tsv",
+)
+def merge_multiple_files(input_file, output_file, output_format):
+    output_file = get_table_file(output_file, output_format)
+
     # Read the entities from all files
     entities = list(map(lambda x: read_csv(x), input_file))
 
@@ -547,8 +963,8 @@ def merge_multiple_files(input_file, output_file):
         subset=["id", "label"], keep="first"
     )
 
-    # Write the merged entities to a tsv file
-    merged_entities.to_csv(output_file, sep="\t", index=False)
+    # Write the merged entities to a tsv file or a parquet file
+    write_table(merged_entities, output_file, output_format)
 
 
 if __name__ == "__main__":
@@ -1,20 +1,35 @@
 import os
 import re
+import csv
+import sys
 import click
 import logging
+import tempfile
+import numpy as np
 import pandas as pd
 
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(root_dir, "lib"))
+
+from kg_loader import write_table, table_formats, ChunkWriter, get_table_file  # noqa: E402
+
 # #### Merge all formatted relations into one file
 
 # ```bash
 # # Merge formatted relation files into one file
 # python graph_data/scripts/merge_relations.py -i graph_data/formatted_relations -o graph_data/relations.tsv
+#
+# # Write a parquet file instead
+# python graph_data/scripts/merge_relations.py -i graph_data/formatted_relations -o graph_data/relations.parquet -f parquet
 # ```
 
 fmt = "%(asctime)s - %(module)s:%(lineno)d - %(levelname)s - %(message)s"
 logger = logging.getLogger("merge_relations.py")
 logging.basicConfig(level=logging.INFO, format=fmt)
 
+# The descriptions or the pmids can be longer than the default limit (128 KB) of the csv module
+csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+
 
 def get_all_files_recursively(directory):
     all_files = []
@@ -27,29 +42,23 @@ def get_all_files_recursively(directory):
     return all_files
 
 
-@click.command(help="Merge the relation files to a single file")
-@click.option(
-    "--input-dir",
-    "-i",
-    help="Input directory which contains a set of entity files",
-    required=True,
-    type=click.Path(exists=True, file_okay=False, dir_okay=True),
-)
-@click.option(
-    "--output-file",
-    "-o",
-    help="Output file path, such as relations.tsv",
-    required=True,
-    type=click.Path(exists=False, file_okay=True, dir_okay=False),
-)
-def cli(input_dir, output_file):
+key_columns = [
+    "source_id",
+    "source_type",
+    "target_id",
+    "target_type",
+    "relation_type",
+]
+
+
+def get_relation_files(input_dir):
     # Get all files in the input directory recursively
     resources = get_all_files_recursively(input_dir)
 
     logger.info("Resources: %s\n" % resources)
 
     # Filter the matched resources
-    files = sorted(
+    return sorted(
         list(
             filter(
                 lambda x: x.endswith(".tsv")
@@ -59,61 +68,262 @@ def cli(input_dir, output_file):
         )
     )
 
-    logger.info("Merging relations from %s\n" % files)
 
-    def read_csv(filepath: str):
-        logger.info("Reading %s" % filepath)
-        df = pd.read_csv(
-            filepath, sep="\t", quotechar='"', low_memory=False, on_bad_lines="warn"
-        )
-        # Filter invalid rows and save them to a file
-        # Such as having different number of columns
-        # Get the number of columns in the DataFrame
-        num_columns = len(df.columns)
-
-        # Filter rows with a different number of columns using a mask
-        mask = df.apply(lambda row: len(row) == num_columns, axis=1)
-        invalid = df[~mask]
-        if len(invalid) > 0:
-            invalid.to_csv(
-                os.path.join(
-                    os.path.dirname(filepath),
-                    "invalid_" + os.path.basename(filepath),
-                ),
-                sep="\t",
-                index=False,
-            )
+def get_union_header(files):
+    """Get the union of the columns of all files in the order of their first appearance, the same as pd.concat."""
+    header = []
+    for filepath in files:
+        for column in pd.read_csv(filepath, sep="\t", quotechar='"', nrows=0).columns:
+            if column not in header:
+                header.append(column)
+    return header
 
-        # Create a new DataFrame with only valid rows
-        valid_rows_df = df[mask]
-        return valid_rows_df
 
-    # Read the relations from all files
-    relations = list(
-        map(
-            lambda x: read_csv(x),
-            files,
+def find_invalid_rows(filepath: str) -> set:
+    """Find the rows whose number of fields is different from the header with one scan of the tokenizer, and save them to the invalid_* file next to the input file.
+
+    pandas pads the rows with fewer fields and drops the rows with more fields (on_bad_lines), so they can't be found after parsing.
+
+    Returns:
+        set: the row numbers of the invalid rows (the header is 0, blank lines are counted), they can be used as the skiprows of pd.read_csv.
+    """
+    invalid_rows = set()
+    invalid_file = os.path.join(
+        os.path.dirname(filepath), "invalid_" + os.path.basename(filepath)
+    )
+
+    writer = None
+    with open(filepath, newline="") as f:
+        reader = csv.reader(f, delimiter="\t", quotechar='"')
+        header = next(reader, [])
+        line_num = reader.line_num
+        for row, fields in enumerate(reader, start=1):
+            # The first line of the row, a quoted field can span multiple lines
+            start_line = line_num + 1
+            line_num = reader.line_num
+            # pandas skips the blank lines
+            if not fields or len(fields) == len(header):
+                continue
+
+            if writer is None:
+                out = open(invalid_file, "w", newline="")
+                writer = csv.writer(out, delimiter="\t", quotechar='"')
+                writer.writerow(["line", "num_fields"] + header)
+            writer.writerow([start_line, len(fields)] + fields)
+            invalid_rows.add(row)
+
+    if writer is not None:
+        out.close()
+        logger.warning(
+            "Found %s rows with a wrong number of fields in %s, they are saved to %s"
+            % (len(invalid_rows), filepath, invalid_file)
         )
+
+    return invalid_rows
+
+
+def read_chunks(filepath: str, header, chunk_size: int, skiprows=None):
+    """Read a relation file chunk by chunk, all values are kept as strings and the columns are aligned to the header."""
+    logger.info("Reading %s" % filepath)
+    reader = pd.read_csv(
+        filepath,
+        sep="\t",
+        quotechar='"',
+        dtype=str,
+        skiprows=skiprows or None,
+        on_bad_lines="warn",
+        chunksize=chunk_size,
     )
-    # Merge the relations from all files
+    for chunk in reader:
+        yield chunk.reindex(columns=header)
+
+
+def merge_relations_in_memory(
+    files,
+    header,
+    output_file,
+    chunk_size=1000000,
+    invalid_rows=None,
+    output_format="tsv",
+):
+    """Read all files into memory and drop the duplicated relations at once."""
+    invalid_rows = invalid_rows or {}
+    relations = [
+        chunk
+        for filepath in files
+        for chunk in read_chunks(
+            filepath, header, chunk_size, skiprows=invalid_rows.get(filepath)
+        )
+    ]
     merged_relations = pd.concat(relations, ignore_index=True)
 
     # Drop the duplicated relations
     logger.info("Before dropping the duplicated relations: %d" % len(merged_relations))
-    merged_relations = merged_relations.drop_duplicates(
-        subset=[
-            "source_id",
-            "source_type",
-            "target_id",
-            "target_type",
-            "relation_type",
-        ],
-        keep="first",
-    )
+    merged_relations = merged_relations.drop_duplicates(subset=key_columns, keep="first")
     logger.info("After dropping the duplicated relations: %d" % len(merged_relations))
 
-    # Write the merged relations to a tsv file
-    merged_relations.to_csv(output_file, sep="\t", index=False)
+    # Write the merged relations to a tsv file or a parquet file
+    write_table(merged_relations, output_file, output_format)
+
+
+def merge_relations_streaming(
+    files,
+    header,
+    output_file,
+    num_partitions: int,
+    chunk_size=1000000,
+    invalid_rows=None,
+    output_format="tsv",
+):
+    """Drop the duplicated relations with bounded memory.
+
+    1. Stream all files and spill the key columns and the global row number of each row to disk, partitioned by the hash of the key columns.
+    2. Drop the duplicated keys of each partition, the first occurrence (the smallest row number in the sorted file order) is kept.
+    3. Stream all files again and write the kept rows to the output file.
+
+    Args:
+        files (list): the relation files in the sorted order.
+        header (list): the columns of the output file.
+        output_file (str): the output file.
+        num_partitions (int): the number of hash partitions, a partition must fit in memory.
+        chunk_size (int, optional): the number of rows per chunk. Defaults to 1000000.
+        invalid_rows (dict, optional): the invalid rows of each file which are skipped. Defaults to None.
+        output_format (str, optional): tsv or parquet, each chunk is a row group of the parquet file. Defaults to "tsv".
+    """
+    invalid_rows = invalid_rows or {}
+    with tempfile.TemporaryDirectory(
+        prefix=".merge_relations_",
+        dir=os.path.dirname(os.path.abspath(output_file)),
+    ) as tmp_dir:
+        num_rows = 0
+        num_spills = 0
+        for filepath in files:
+            for chunk in read_chunks(
+                filepath, header, chunk_size, skiprows=invalid_rows.get(filepath)
+            ):
+                keys = chunk[key_columns].reset_index(drop=True)
+                keys["row"] = np.arange(num_rows, num_rows + len(chunk), dtype=np.int64)
+                num_rows += len(chunk)
+
+                partitions = (
+                    pd.util.hash_pandas_object(keys[key_columns], index=False).to_numpy()
+                    % num_partitions
+                )
+                for partition, part in keys.groupby(partitions):
+                    part.to_pickle(
+                        os.path.join(
+                            tmp_dir, "part-%05d.%08d.pkl" % (partition, num_spills)
+                        )
+                    )
+                num_spills += 1
+
+        logger.info("Before dropping the duplicated relations: %d" % num_rows)
+
+        # The spill files of a partition are sorted by their spill number, so the rows are in the input order
+        spill_files = sorted(os.listdir(tmp_dir))
+        is_kept = np.zeros(num_rows, dtype=bool)
+        for partition in range(num_partitions):
+            prefix = "part-%05d." % partition
+            parts = [
+                pd.read_pickle(os.path.join(tmp_dir, spill_file))
+                for spill_file in spill_files
+                if spill_file.startswith(prefix)
+            ]
+            if not parts:
+                continue
+
+            keys = pd.concat(parts, ignore_index=True)
+            kept_rows = keys.drop_duplicates(subset=key_columns, keep="first")["row"]
+            is_kept[kept_rows.to_numpy()] = True
+
+        logger.info("After dropping the duplicated relations: %d" % is_kept.sum())
+
+    # Write the kept rows in the input order
+    row = 0
+    with ChunkWriter(output_file, header, output_format) as writer:
+        for filepath in files:
+            for chunk in read_chunks(
+                filepath, header, chunk_size, skiprows=invalid_rows.get(filepath)
+            ):
+                mask = is_kept[row : row + len(chunk)]
+                row += len(chunk)
+                writer.write(chunk[mask])
+
+
+@click.command(help="Merge the relation files to a single file")
+@click.option(
+    "--input-dir",
+    "-i",
+    help="Input directory which contains a set of entity files",
+    required=True,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+)
+@click.option(
+    "--output-file",
+    "-o",
+    help="Output file path, such as relations.tsv or relations.parquet. The extension is changed to match --output-format.",
+    required=True,
+    type=click.Path(exists=False, file_okay=True, dir_okay=False),
+)
+@click.option(
+    "--memory-budget",
+    "-m",
+    help="Memory budget in MB. If the input files are larger than the budget, the duplicated relations are dropped in hash partitions which are spilled to disk, otherwise all relations are merged in memory.",
+    default=4096,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--chunk-size",
+    "-c",
+    help="Number of rows per chunk when the input files are streamed",
+    default=1000000,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--output-format",
+    "-f",
+    help="The format of the output file, downstream stages load a parquet file much faster and can read only the columns they need",
+    type=click.Choice(table_formats),
+    default="tsv",
+)
+def cli(input_dir, output_file, memory_budget, chunk_size, output_format):
+    output_file = get_table_file(output_file, output_format)
+
+    files = get_relation_files(input_dir)
+    logger.info("Merging relations from %s\n" % files)
+
+    header = get_union_header(files)
+    invalid_rows = {filepath: find_invalid_rows(filepath) for filepath in files}
+
+    # A dataframe of strings takes several times the size of the file
+    input_size = sum(os.path.getsize(x) for x in files)
+    estimated_memory = input_size * 5
+    budget = memory_budget * 1024 * 1024
+    if estimated_memory <= budget:
+        merge_relations_in_memory(
+            files,
+            header,
+            output_file,
+            chunk_size=chunk_size,
+            invalid_rows=invalid_rows,
+            output_format=output_format,
+        )
+    else:
+        # The keys are a part of the columns, but leave room for the dedup of a partition
+        num_partitions = int(np.ceil(estimated_memory / budget)) * 2
+        logger.info(
+            "The input files (%.1f MB) exceed the memory budget, drop the duplicated relations in %s partitions"
+            % (input_size / 1024 / 1024, num_partitions)
+        )
+        merge_relations_streaming(
+            files,
+            header,
+            output_file,
+            num_partitions,
+            chunk_size=chunk_size,
+            invalid_rows=invalid_rows,
+            output_format=output_format,
+        )
 
 
 if __name__ == "__main__":
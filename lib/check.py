@@ -1,4 +1,6 @@
 import os
+import pandas as pd
+
 
 def check_file_exists(file_path):
     if not os.path.exists(file_path):
@@ -8,4 +10,107 @@ def check_file_exists(file_path):
 def check_columns(df, columns):
     for column in columns:
         if column not in df.columns:
-            raise Exception("Column not found: %s" % column)
\ No newline at end of file
+            raise Exception("Column not found: %s" % column)
+
+
+def make_node_keys(types: pd.Series, ids: pd.Series) -> pd.Series:
+    """Make the node keys, such as Gene::ENTREZ:1234, with a vectorized string concatenation.
+
+    Args:
+        types (pd.Series): the entity types.
+        ids (pd.Series): the entity ids.
+
+    Returns:
+        pd.Series: the node keys, it has the same index as the ids.
+    """
+    return types.astype(str) + "::" + ids.astype(str)
+
+
+def get_relation_node_keys(relations: pd.DataFrame) -> pd.Index:
+    """Get the unique node keys of the sources and targets in a relation table."""
+    check_columns(relations, ["source_id", "source_type", "target_id", "target_type"])
+    source_keys = make_node_keys(relations["source_type"], relations["source_id"])
+    target_keys = make_node_keys(relations["target_type"], relations["target_id"])
+    return pd.Index(pd.concat([source_keys, target_keys], ignore_index=True).unique())
+
+
+def find_missing_nodes(entity_df: pd.DataFrame, unchecked: pd.DataFrame) -> pd.DataFrame:
+    """Find the nodes of a relation file or an entity embedding file which are not in the entity file with an anti-join on the node keys.
+
+    Args:
+        entity_df (pd.DataFrame): the entity file.
+        unchecked (pd.DataFrame): the relation file or the entity embedding file.
+
+    Returns:
+        pd.DataFrame: one row per missing node and role (source, target or entity) with the entity type, the resource (empty if the file has no resource column) and the number of rows which refer to it, sorted by the entity type, the resource and the node id.
+    """
+    node_ids = pd.Index(make_node_keys(entity_df["label"], entity_df["id"]).unique())
+
+    columns = []
+    # It's a relation file
+    if "source_id" in unchecked.columns and "target_id" in unchecked.columns:
+        columns += [
+            ("source", "source_type", "source_id"),
+            ("target", "target_type", "target_id"),
+        ]
+    # It's a entity embedding file
+    if "entity_id" in unchecked.columns and "entity_type" in unchecked.columns:
+        columns.append(("entity", "entity_type", "entity_id"))
+
+    if "resource" in unchecked.columns:
+        # The relation file may be read with categorical columns
+        resources = unchecked["resource"].astype(object).fillna("")
+    else:
+        resources = pd.Series("", index=unchecked.index)
+
+    missing = []
+    for role, type_column, id_column in columns:
+        keys = make_node_keys(unchecked[type_column], unchecked[id_column])
+        is_missing = ~keys.isin(node_ids)
+        missing.append(
+            pd.DataFrame(
+                {
+                    "node_id": keys[is_missing],
+                    "entity_type": unchecked.loc[is_missing, type_column].astype(object),
+                    "resource": resources[is_missing],
+                    "role": role,
+                }
+            )
+        )
+
+    missing_columns = ["entity_type", "resource", "role", "node_id", "num_rows"]
+    if not missing:
+        return pd.DataFrame(columns=missing_columns)
+
+    return (
+        pd.concat(missing, ignore_index=True)
+        .groupby(["entity_type", "resource", "role", "node_id"], dropna=False)
+        .size()
+        .rename("num_rows")
+        .reset_index()
+        .sort_values(["entity_type", "resource", "node_id", "role"], ignore_index=True)
+    )[missing_columns]
+
+
+def audit_missing_entities(
+    entities: pd.DataFrame, relations: pd.DataFrame, sample_size: int = 10
+) -> dict:
+    """Count the nodes which are in the relations but not in the entities, see find_missing_nodes.
+
+    Args:
+        entities (pd.DataFrame): the entity table, it must have the id and label columns.
+        relations (pd.DataFrame): the relation table, it must have the source_id, source_type, target_id and target_type columns.
+        sample_size (int, optional): the number of the missing nodes in the sample. Defaults to 10.
+
+    Returns:
+        dict: num_entities, num_relation_entities, num_missing and a sample of the missing node keys.
+    """
+    check_columns(entities, ["id", "label"])
+    missing = find_missing_nodes(entities, relations)["node_id"].unique()
+
+    return {
+        "num_entities": make_node_keys(entities["label"], entities["id"]).nunique(),
+        "num_relation_entities": len(get_relation_node_keys(relations)),
+        "num_missing": len(missing),
+        "sample": missing[:sample_size].tolist(),
+    }
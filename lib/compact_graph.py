@@ -0,0 +1,378 @@
+import os
+import numpy as np
+import pandas as pd
+from typing import List, Tuple, Union
+
+try:
+    from .check import check_file_exists, check_columns
+    from .kg_loader import read_relation_table, read_entity_table
+except ImportError:
+    from check import check_file_exists, check_columns
+    from kg_loader import read_relation_table, read_entity_table
+
+# A node can be referred by its integer code or by its (id, type) tuple, such as ('DrugBank::DB00394', 'Compound')
+Node = Union[int, np.integer, Tuple[str, str]]
+
+
+def expand_ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Expand a set of [start, start + count) ranges into one flat array of positions.
+
+    Args:
+        starts (np.ndarray): the start position of each range.
+        counts (np.ndarray): the length of each range.
+
+    Returns:
+        np.ndarray: the concatenated positions of all ranges, such as [3, 4, 8] for starts=[3, 8] and counts=[2, 1].
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(np.asarray(starts, dtype=np.int64), counts) + (
+        np.arange(total, dtype=np.int64) - offsets
+    )
+
+
+def build_csr(
+    rows: np.ndarray, cols: np.ndarray, relations: np.ndarray, num_nodes: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Build the CSR arrays for the edges (rows[i] -> cols[i]).
+
+    The edges of a node keep the order in which they appear in the input arrays.
+
+    Args:
+        rows (np.ndarray): the row (source) code of each edge.
+        cols (np.ndarray): the column (target) code of each edge.
+        relations (np.ndarray): the relation type code of each edge.
+        num_nodes (int): the number of nodes.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: indptr (int64), indices (int32), relations (int32).
+    """
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_nodes), out=indptr[1:])
+    return indptr, cols[order].astype(np.int32), relations[order].astype(np.int32)
+
+
+class CompactKG:
+    """A compact knowledge graph which keeps the edges in integer-indexed CSR/CSC arrays.
+
+    The entity ids, entity types and relation types are interned to int32 codes, so a node costs one string and a few integers, and an edge costs a few integers instead of several python objects in a NetworkX graph. The edges are always stored with their direction, the directed flag only changes how neighbors and subgraphs are computed, just like nx.DiGraph vs nx.Graph.
+
+    Attributes:
+        node_ids (np.ndarray): the entity id of each node, such as ENTREZ:1234.
+        node_types (np.ndarray): the entity type code of each node, see type_names.
+        type_names (List[str]): the entity types, such as Gene, Compound.
+        relation_names (List[str]): the relation types, such as DRUGBANK::treats::Compound:Disease.
+        sources, targets, relations (np.ndarray): the edges in the input order.
+        out_indptr, out_indices, out_relations (np.ndarray): the CSR arrays of the outgoing edges.
+        in_indptr, in_indices, in_relations (np.ndarray): the CSC arrays of the incoming edges.
+    """
+
+    def __init__(
+        self,
+        node_ids: np.ndarray,
+        node_types: np.ndarray,
+        type_names: List[str],
+        relation_names: List[str],
+        sources: np.ndarray,
+        targets: np.ndarray,
+        relations: np.ndarray,
+        directed: bool = True,
+    ):
+        self.node_ids = np.asarray(node_ids, dtype=object)
+        self.node_types = np.asarray(node_types, dtype=np.int32)
+        self.type_names = list(type_names)
+        self.relation_names = list(relation_names)
+        self.directed = directed
+
+        self.sources = np.asarray(sources, dtype=np.int32)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.relations = np.asarray(relations, dtype=np.int32)
+
+        num_nodes = len(self.node_ids)
+        self.out_indptr, self.out_indices, self.out_relations = build_csr(
+            self.sources, self.targets, self.relations, num_nodes
+        )
+        self.in_indptr, self.in_indices, self.in_relations = build_csr(
+            self.targets, self.sources, self.relations, num_nodes
+        )
+
+        # It will be built on the first lookup by (id, type)
+        self._node_index = None
+
+    @classmethod
+    def from_dataframe(
+        cls,
+        relations: pd.DataFrame,
+        entities: Union[pd.DataFrame, None] = None,
+        directed: bool = True,
+    ) -> "CompactKG":
+        """Build a compact graph from a relation table.
+
+        Args:
+            relations (pd.DataFrame): it must contain source_id, source_type, target_id, target_type and relation_type columns.
+            entities (pd.DataFrame, optional): it must contain id and label columns. The entities are added as nodes before the nodes in the relations, so isolated entities are kept. Defaults to None.
+            directed (bool, optional): whether the graph is directed. Defaults to True.
+
+        Returns:
+            CompactKG: the compact graph.
+        """
+        check_columns(
+            relations,
+            ["source_id", "source_type", "target_id", "target_type", "relation_type"],
+        )
+
+        num_edges = len(relations)
+        ids = [relations["source_id"].to_numpy(), relations["target_id"].to_numpy()]
+        types = [
+            relations["source_type"].to_numpy(),
+            relations["target_type"].to_numpy(),
+        ]
+        if entities is not None:
+            check_columns(entities, ["id", "label"])
+            ids.insert(0, entities["id"].to_numpy())
+            types.insert(0, entities["label"].to_numpy())
+
+        keys = pd.MultiIndex.from_arrays(
+            [np.concatenate(ids), np.concatenate(types)]
+        )
+        codes, uniques = pd.factorize(keys)
+        codes = codes[len(codes) - 2 * num_edges :]
+
+        type_codes, type_names = pd.factorize(
+            uniques.get_level_values(1), use_na_sentinel=False
+        )
+        relation_codes, relation_names = pd.factorize(
+            relations["relation_type"], use_na_sentinel=False
+        )
+
+        return cls(
+            node_ids=uniques.get_level_values(0).to_numpy(dtype=object),
+            node_types=type_codes,
+            type_names=type_names.to_list(),
+            relation_names=relation_names.to_list(),
+            sources=codes[:num_edges],
+            targets=codes[num_edges:],
+            relations=relation_codes,
+            directed=directed,
+        )
+
+    @classmethod
+    def from_relation_file(
+        cls,
+        relation_file: str,
+        entity_file: Union[str, None] = None,
+        allowed_types: List[str] = [],
+        directed: bool = True,
+    ) -> "CompactKG":
+        """Build a compact graph from the relations file, it's the counterpart of lib/graph.py:create_graph.
+
+        Args:
+            relation_file (str): path to the relations file.
+            entity_file (str, optional): path to the entities file. If it's provided, all entities will be added as nodes. Defaults to None.
+            allowed_types (list, optional): list of node types to include in the graph. If not provided, all node types will be included.
+            directed (bool, optional): whether the graph is directed. Defaults to True.
+
+        Returns:
+            CompactKG: the compact graph.
+        """
+        check_file_exists(relation_file)
+        columns = ["source_id", "source_type", "target_id", "target_type", "relation_type"]
+        # The filters are pushed down to the row groups if the files are parquet files
+        filters = None
+        if allowed_types:
+            filters = [
+                ("source_type", "in", list(allowed_types)),
+                ("target_type", "in", list(allowed_types)),
+            ]
+        relations = read_relation_table(relation_file, usecols=columns, filters=filters)
+
+        entities = None
+        if entity_file and os.path.exists(entity_file):
+            entities = read_entity_table(
+                entity_file,
+                usecols=["id", "label"],
+                filters=[("label", "in", list(allowed_types))] if allowed_types else None,
+            )
+
+        return cls.from_dataframe(relations, entities=entities, directed=directed)
+
+    def number_of_nodes(self) -> int:
+        return len(self.node_ids)
+
+    def number_of_edges(self) -> int:
+        return len(self.sources)
+
+    def is_directed(self) -> bool:
+        return self.directed
+
+    def node_index(self, node: Node) -> int:
+        """Get the integer code of a node.
+
+        Args:
+            node (Node): an integer code or an (id, type) tuple, such as ('DrugBank::DB00394', 'Compound').
+
+        Returns:
+            int: the integer code of the node.
+        """
+        if isinstance(node, (int, np.integer)):
+            if node < 0 or node >= len(self.node_ids):
+                raise KeyError("Node not found: %s" % node)
+            return int(node)
+
+        if self._node_index is None:
+            type_names = np.asarray(self.type_names, dtype=object)
+            self._node_index = {
+                key: idx
+                for idx, key in enumerate(
+                    zip(self.node_ids, type_names[self.node_types])
+                )
+            }
+
+        if tuple(node) not in self._node_index:
+            raise KeyError("Node not found: %s" % str(node))
+        return self._node_index[tuple(node)]
+
+    def node(self, idx: int) -> Tuple[str, str]:
+        """Get the (id, type) tuple of a node by its integer code."""
+        return self.node_ids[idx], self.type_names[self.node_types[idx]]
+
+    def node_type_names(self, indices: Union[np.ndarray, None] = None) -> pd.Categorical:
+        """Get the entity types of a set of nodes (all nodes by default) as a categorical array."""
+        codes = self.node_types if indices is None else self.node_types[indices]
+        return pd.Categorical.from_codes(codes, categories=self.type_names)
+
+    def relation_type_names(self, codes: np.ndarray) -> pd.Categorical:
+        """Get the relation types of a set of relation codes as a categorical array."""
+        return pd.Categorical.from_codes(codes, categories=self.relation_names)
+
+    def out_edges(self, node: Node) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the targets and the relation codes of the outgoing edges of a node."""
+        idx = self.node_index(node)
+        start, end = self.out_indptr[idx], self.out_indptr[idx + 1]
+        return self.out_indices[start:end], self.out_relations[start:end]
+
+    def in_edges(self, node: Node) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the sources and the relation codes of the incoming edges of a node."""
+        idx = self.node_index(node)
+        start, end = self.in_indptr[idx], self.in_indptr[idx + 1]
+        return self.in_indices[start:end], self.in_relations[start:end]
+
+    def successors(self, node: Node) -> np.ndarray:
+        """Get the unique successors of a node, in the order of the first edge to each of them."""
+        return pd.unique(self.out_edges(node)[0])
+
+    def predecessors(self, node: Node) -> np.ndarray:
+        """Get the unique predecessors of a node, in the order of the first edge from each of them."""
+        return pd.unique(self.in_edges(node)[0])
+
+    def neighbors(self, node: Node) -> np.ndarray:
+        """Get the unique neighbors of a node, they are the successors for a directed graph, just like NetworkX."""
+        if self.directed:
+            return self.successors(node)
+        return pd.unique(np.concatenate([self.out_edges(node)[0], self.in_edges(node)[0]]))
+
+    def out_degree(self, node: Union[Node, None] = None) -> Union[int, np.ndarray]:
+        """Get the number of outgoing edges of a node, or of all nodes if node is None."""
+        degrees = np.diff(self.out_indptr)
+        return degrees if node is None else int(degrees[self.node_index(node)])
+
+    def in_degree(self, node: Union[Node, None] = None) -> Union[int, np.ndarray]:
+        """Get the number of incoming edges of a node, or of all nodes if node is None."""
+        degrees = np.diff(self.in_indptr)
+        return degrees if node is None else int(degrees[self.node_index(node)])
+
+    def degree(self, node: Union[Node, None] = None) -> Union[int, np.ndarray]:
+        """Get the number of edges of a node, or of all nodes if node is None. Multiple edges are counted one by one, just like a NetworkX multigraph."""
+        degrees = np.diff(self.out_indptr) + np.diff(self.in_indptr)
+        return degrees if node is None else int(degrees[self.node_index(node)])
+
+    def to_scipy(self):
+        """Get the adjacency matrix (source x target) as a scipy.sparse.csr_matrix, the value is the number of edges."""
+        from scipy.sparse import csr_matrix
+
+        num_nodes = self.number_of_nodes()
+        matrix = csr_matrix(
+            (
+                np.ones(len(self.out_indices), dtype=np.int32),
+                self.out_indices,
+                self.out_indptr,
+            ),
+            shape=(num_nodes, num_nodes),
+        )
+        matrix.sum_duplicates()
+        return matrix
+
+    def connected_components(self) -> Tuple[int, np.ndarray]:
+        """Get the (weakly) connected components of the graph.
+
+        Returns:
+            Tuple[int, np.ndarray]: the number of components and the component label of each node.
+        """
+        from scipy.sparse.csgraph import connected_components
+
+        return connected_components(self.to_scipy(), directed=True, connection="weak")
+
+    def descendants(self, node: Node) -> np.ndarray:
+        """Get all nodes reachable from a node (the node itself is excluded), just like nx.descendants."""
+        from scipy.sparse.csgraph import breadth_first_order
+
+        idx = self.node_index(node)
+        order = breadth_first_order(
+            self.to_scipy(), idx, directed=True, return_predecessors=False
+        )
+        return order[order != idx]
+
+    def subgraph(self, nodes: np.ndarray) -> "CompactKG":
+        """Get the subgraph induced by a set of nodes, the nodes keep their relative order.
+
+        Args:
+            nodes (np.ndarray): the integer codes of the nodes.
+
+        Returns:
+            CompactKG: a new compact graph with the nodes and all edges between them.
+        """
+        keep = np.zeros(self.number_of_nodes(), dtype=bool)
+        keep[np.asarray(nodes, dtype=np.int64)] = True
+        new_codes = np.cumsum(keep, dtype=np.int64) - 1
+
+        edge_mask = keep[self.sources] & keep[self.targets]
+        return CompactKG(
+            node_ids=self.node_ids[keep],
+            node_types=self.node_types[keep],
+            type_names=self.type_names,
+            relation_names=self.relation_names,
+            sources=new_codes[self.sources[edge_mask]],
+            targets=new_codes[self.targets[edge_mask]],
+            relations=self.relations[edge_mask],
+            directed=self.directed,
+        )
+
+    def filter_edges(self, mask: np.ndarray) -> "CompactKG":
+        """Keep all nodes but only the edges selected by a boolean mask over the edges in the input order."""
+        return CompactKG(
+            node_ids=self.node_ids,
+            node_types=self.node_types,
+            type_names=self.type_names,
+            relation_names=self.relation_names,
+            sources=self.sources[mask],
+            targets=self.targets[mask],
+            relations=self.relations[mask],
+            directed=self.directed,
+        )
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Convert the edges back to a relation table."""
+        return pd.DataFrame(
+            {
+                "source_id": self.node_ids[self.sources],
+                "source_type": self.node_type_names(self.sources),
+                "target_id": self.node_ids[self.targets],
+                "target_type": self.node_type_names(self.targets),
+                "relation_type": self.relation_type_names(self.relations),
+            }
+        )
@@ -7,6 +7,16 @@ from typing import Tuple, List
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+try:
+    from .check import get_relation_node_keys
+except ImportError:
+    from check import get_relation_node_keys
+
+try:
+    from .kg_loader import read_relation_table
+except ImportError:
+    from kg_loader import read_relation_table
+
 def intall_cache(cache_fpath: str, enable_threading: bool = False):
     """Install a cache for the requests library.
 
@@ -360,21 +370,13 @@ def check_ids(input: list, output: str, relation_type_column: str) -> None:
                 raise ValueError("Separator not found in file: " + file)
 
     # 读取数据并检查格式
-    dfs = {file: pd.read_csv(file, sep=detect_separator(file)) for file in input}
+    dfs = {file: read_relation_table(file, sep=detect_separator(file)) for file in input}
     for file, df in dfs.items():
         if not check_format(df):
             raise ValueError(f"File {file} does not have the expected format, the columns should be: source_id, source_type, relation_type, target_id, target_type, resource.")
 
     # 获取实体ID
-    ids = {}
-    for file, df in dfs.items():
-        source_ids = (
-            df[["source_type", "source_id"]].astype(str).agg("::".join, axis=1).unique()
-        )
-        target_ids = (
-            df[["target_type", "target_id"]].astype(str).agg("::".join, axis=1).unique()
-        )
-        ids[file] = set(source_ids).union(set(target_ids))
+    ids = {file: get_relation_node_keys(df) for file, df in dfs.items()}
 
     # 获取关系类型
     assert relation_type_column in df.columns, f"Column {relation_type_column} not found in {file}"
@@ -1,9 +1,17 @@
 import os
 import pandas as pd
 import networkx as nx
-from check import check_file_exists, check_columns
 from typing import Tuple
 
+try:
+    from .check import check_file_exists, check_columns
+    from .compact_graph import CompactKG
+    from .kg_loader import read_relation_table, read_entity_table, find_table_file
+except ImportError:
+    from check import check_file_exists, check_columns
+    from compact_graph import CompactKG
+    from kg_loader import read_relation_table, read_entity_table, find_table_file
+
 allowed_types = [
     "Gene",
     "Compound",
@@ -162,12 +170,109 @@ def gen_cytoscape(
         f.write(xgmml_content)
 
 
+def _add_relations_by_row(G: Graph, df: pd.DataFrame, allowed_types=[]) -> Graph:
+    """Add the relations to the graph row by row, it's slow but easy to follow. Keep it as a reference for the bulk version."""
+    for _, row in df.iterrows():
+        source_id = row["source_id"]
+        source_type = row["source_type"]
+        source_name = row["source_name"]
+        target_id = row["target_id"]
+        target_type = row["target_type"]
+        target_name = row["target_name"]
+        relation_type = row["relation_type"]
+        formatted_relation_type = (
+            row["formatted_relation_type"]
+            if "formatted_relation_type" in row
+            else row["relation_type"]
+        )
+
+        if allowed_types:
+            if source_type not in allowed_types or target_type not in allowed_types:
+                continue
+
+        # Add nodes for source and target with node type as an attribute
+        G.add_node((source_id, source_type), name=source_name, node_type=source_type)
+        G.add_node((target_id, target_type), name=target_name, node_type=target_type)
+
+        # Add directed edge from source to target
+        G.add_edge(
+            (source_id, source_type),
+            (target_id, target_type),
+            relation=relation_type,
+            formatted_relation=formatted_relation_type,
+            source_name=source_name,
+            target_name=target_name,
+        )
+
+    return G
+
+
+def _add_relations_in_bulk(G: Graph, df: pd.DataFrame, allowed_types=[]) -> Graph:
+    """Add the relations to the graph with add_nodes_from/add_edges_from.
+
+    The nodes are fed in the same order as _add_relations_by_row (source, target, source, target, ...), so the node order, the node attributes (the last one wins) and the edge keys of the multigraphs are the same.
+    """
+    if allowed_types:
+        mask = df["source_type"].isin(allowed_types) & df["target_type"].isin(
+            allowed_types
+        )
+        df = df[mask]
+
+    source_ids = df["source_id"].to_list()
+    source_types = df["source_type"].to_list()
+    source_names = df["source_name"].to_list()
+    target_ids = df["target_id"].to_list()
+    target_types = df["target_type"].to_list()
+    target_names = df["target_name"].to_list()
+    relation_types = df["relation_type"].to_list()
+    formatted_relation_types = (
+        df["formatted_relation_type"].to_list()
+        if "formatted_relation_type" in df.columns
+        else relation_types
+    )
+
+    sources = list(zip(source_ids, source_types))
+    targets = list(zip(target_ids, target_types))
+
+    def iter_nodes():
+        for source, source_name, target, target_name in zip(
+            sources, source_names, targets, target_names
+        ):
+            yield source, {"name": source_name, "node_type": source[1]}
+            yield target, {"name": target_name, "node_type": target[1]}
+
+    G.add_nodes_from(iter_nodes())
+    G.add_edges_from(
+        (
+            source,
+            target,
+            {
+                "relation": relation_type,
+                "formatted_relation": formatted_relation_type,
+                "source_name": source_name,
+                "target_name": target_name,
+            },
+        )
+        for source, target, relation_type, formatted_relation_type, source_name, target_name in zip(
+            sources,
+            targets,
+            relation_types,
+            formatted_relation_types,
+            source_names,
+            target_names,
+        )
+    )
+
+    return G
+
+
 def create_graph(
     relation_file,
     entity_file=None,
     allowed_types=[],
     directed=False,
     allow_multiple_edges=False,
+    bulk=True,
 ) -> Graph:
     """Create a graph from the relations file and annotate the nodes with the entity file.
 
@@ -175,6 +280,7 @@ def create_graph(
         relation_file (str): path to the relations file
         entity_file (str, optional): path to the entities file. Defaults to None. If the entity file is not provided, the nodes will not be annotated.
         allowed_types (list, optional): list of node types to include in the graph. If not provided, all node types will be included. Such as [ "Gene", "Compound", "Disease", "Symptom", "Pathway", "Anatomy", "Metabolite", "MolecularFunction", "BiologicalProcess", "CellularComponent"].
+        bulk (bool, optional): build the graph with vectorized filtering and add_nodes_from/add_edges_from instead of adding one row at a time. Both ways produce the same graph. Defaults to True.
 
     Returns:
         Graph: graph with nodes and edges, if directed is True, the graph will be directed, otherwise it will be undirected. if allow_multiple_edges is True, the graph will allow multiple edges between the same nodes, otherwise it will not.
@@ -183,10 +289,10 @@ def create_graph(
     # > Prompt:
     # > If I have a file which contains the following columns: source_id, source_type, target_id, target_type, relation_type. and any node will be treated as a uniq node, if its id:type is different from others. I would like to use one specified node as a start point and get a subgraph which all nodes linked with it and the length of paths <= 3, how to do it? In the meanwhile, please save the paths as a file which contains five columns: source_id, source_type, relation_type, target_id, target_type.
     # Read the data from the file into a DataFrame
-    df = pd.read_csv(relation_file, sep="\t", dtype=str)
+    df = read_relation_table(relation_file)
 
     if entity_file and os.path.exists(entity_file):
-        entities = pd.read_csv(entity_file, sep="\t", dtype=str)
+        entities = read_entity_table(entity_file, usecols=["id", "name", "label"])
 
         # Join the df and the entites to get the label of each node and add name field from the entites to the df
         df = df.merge(
@@ -223,38 +329,10 @@ def create_graph(
         else:
             G = nx.Graph()
 
-    # Add nodes and edges to the graph
-    for _, row in df.iterrows():
-        source_id = row["source_id"]
-        source_type = row["source_type"]
-        source_name = row["source_name"]
-        target_id = row["target_id"]
-        target_type = row["target_type"]
-        target_name = row["target_name"]
-        relation_type = row["relation_type"]
-        formatted_relation_type = (
-            row["formatted_relation_type"]
-            if "formatted_relation_type" in row
-            else row["relation_type"]
-        )
-
-        if allowed_types:
-            if source_type not in allowed_types or target_type not in allowed_types:
-                continue
-
-        # Add nodes for source and target with node type as an attribute
-        G.add_node((source_id, source_type), name=source_name, node_type=source_type)
-        G.add_node((target_id, target_type), name=target_name, node_type=target_type)
-
-        # Add directed edge from source to target
-        G.add_edge(
-            (source_id, source_type),
-            (target_id, target_type),
-            relation=relation_type,
-            formatted_relation=formatted_relation_type,
-            source_name=source_name,
-            target_name=target_name,
-        )
+    if bulk:
+        _add_relations_in_bulk(G, df, allowed_types)
+    else:
+        _add_relations_by_row(G, df, allowed_types)
 
     return G
 
@@ -394,13 +472,13 @@ def get_relation_file(dataset_name):
 
 def load_relations(dataset_name):
     relation_file = get_relation_file(dataset_name)
-    relations = pd.read_csv(relation_file, sep="\t", dtype=str)
+    relations = read_relation_table(relation_file)
 
     return relations
 
 
 def load_entities(data_dir):
-    """Load entities from the entities.tsv file
+    """Load entities from the entities.parquet file or the entities.tsv file
 
     Args:
         data_dir (str): default is graph_data directory in the current working directory
@@ -408,9 +486,8 @@ def load_entities(data_dir):
     Returns:
         DataFrame: entities
     """
-    entity_file = os.path.join(data_dir, "entities.tsv")
-    check_file_exists(entity_file)
-    entities = pd.read_csv(entity_file, sep="\t", dtype=str)
+    entity_file = find_table_file(data_dir, "entities")
+    entities = read_entity_table(entity_file)
     return entities
 
 
@@ -468,56 +545,71 @@ def group_relations(relations):
     return grouped_df
 
 
-def get_num_nodes(G: Graph) -> int:
+def get_num_nodes(G: Graph | CompactKG) -> int:
     """Get the number of nodes in a graph
 
     Args:
-        G (Graph): graph
+        G (Graph | CompactKG): graph
 
     Returns:
         int: number of nodes
     """
+    if isinstance(G, CompactKG):
+        return G.number_of_nodes()
     return len(G.nodes())
 
 
-def get_num_edges(G: Graph) -> int:
+def get_num_edges(G: Graph | CompactKG) -> int:
     """Get the number of edges in a graph
 
     Args:
-        G (Graph): graph
+        G (Graph | CompactKG): graph
 
     Returns:
         int: number of edges
     """
+    if isinstance(G, CompactKG):
+        return G.number_of_edges()
     return len(G.edges())
 
 
-def get_num_subgraphs(G: Graph) -> int:
+def get_num_subgraphs(G: Graph | CompactKG) -> int:
     """Get the number of subgraphs in a graph
 
     Args:
-        G (Graph): graph
+        G (Graph | CompactKG): graph, the subgraphs of a directed graph are the weakly connected components.
 
     Returns:
         int: number of subgraphs
     """
-    if type(G) == nx.MultiGraph or type(G) == nx.Graph:
+    if isinstance(G, CompactKG):
+        num_subgraphs, _ = G.connected_components()
+        return num_subgraphs
+    elif type(G) == nx.MultiGraph or type(G) == nx.Graph:
         return len(list(nx.connected_components(G)))
     elif type(G) == nx.MultiDiGraph or type(G) == nx.DiGraph:
         return len(list(nx.weakly_connected_components(G)))
 
 
-def get_subgraph(G: Graph, start_node: Tuple[str, str]) -> Graph:
+def get_subgraph(
+    G: Graph | CompactKG, start_node: Tuple[str, str]
+) -> Graph | CompactKG:
     """Get the subgraph containing the start node
 
     Args:
-        G (Graph): graph
+        G (Graph | CompactKG): graph
         start_node (Tuple[str, str]): node to start from, such as ('DrugBank::DB00394', 'Compound')
 
     Returns:
-        Graph: subgraph
+        Graph | CompactKG: subgraph, it's a CompactKG if G is a CompactKG.
     """
-    if type(G) == nx.MultiGraph or type(G) == nx.Graph:
+    if isinstance(G, CompactKG):
+        if G.is_directed():
+            return G.subgraph(G.descendants(start_node))
+        else:
+            _, labels = G.connected_components()
+            return G.subgraph((labels == labels[G.node_index(start_node)]).nonzero()[0])
+    elif type(G) == nx.MultiGraph or type(G) == nx.Graph:
         return G.subgraph(list(nx.node_connected_component(G, start_node)))
     elif type(G) == nx.MultiDiGraph or type(G) == nx.DiGraph:
         return G.subgraph(list(nx.descendants(G, start_node)))
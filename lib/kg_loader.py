@@ -0,0 +1,353 @@
+import os
+import sys
+import logging
+import numpy as np
+import pandas as pd
+
+try:
+    from .check import check_file_exists, check_columns
+except ImportError:
+    from check import check_file_exists, check_columns
+
+logger = logging.getLogger("kg_loader")
+
+relation_columns = [
+    "source_id",
+    "source_type",
+    "target_id",
+    "target_type",
+    "relation_type",
+    "resource",
+]
+
+# These columns only have hundreds of distinct values in millions of relations
+categorical_columns = ["source_type", "target_type", "relation_type", "resource"]
+
+table_formats = ["tsv", "parquet"]
+
+filter_operators = {
+    "=": lambda values, value: values == value,
+    "==": lambda values, value: values == value,
+    "!=": lambda values, value: values != value,
+    "<": lambda values, value: values < value,
+    "<=": lambda values, value: values <= value,
+    ">": lambda values, value: values > value,
+    ">=": lambda values, value: values >= value,
+    "in": lambda values, value: values.isin(value),
+    "not in": lambda values, value: ~values.isin(value),
+}
+
+
+def detect_table_format(filepath: str) -> str:
+    """Detect the format of a table by its magic bytes, so a parquet file is detected whatever its extension is.
+
+    Returns:
+        str: parquet or tsv.
+    """
+    with open(filepath, "rb") as f:
+        return "parquet" if f.read(4) == b"PAR1" else "tsv"
+
+
+def get_table_file(path: str, output_format: str) -> str:
+    """Make the extension of an output file match the output format, such as knowledge_graph.tsv -> knowledge_graph.parquet for the parquet format and knowledge_graph.parquet -> knowledge_graph.tsv for the tsv format. The other extensions of a tsv file (such as .txt) are kept."""
+    root, ext = os.path.splitext(path)
+    if output_format == "parquet" and ext != ".parquet":
+        table_file = root + ".parquet"
+    elif output_format == "tsv" and ext == ".parquet":
+        table_file = root + ".tsv"
+    else:
+        return path
+
+    logger.warning(
+        "The extension of %s doesn't match the %s format, write to %s"
+        % (path, output_format, table_file)
+    )
+    return table_file
+
+
+def find_table_file(data_dir: str, name: str) -> str:
+    """Find the table in a directory, the parquet file is preferred if both formats exist.
+
+    Args:
+        data_dir (str): the directory.
+        name (str): the name of the table without the extension, such as knowledge_graph.
+
+    Returns:
+        str: path to the parquet file or the tsv file.
+    """
+    parquet_file = os.path.join(data_dir, name + ".parquet")
+    if os.path.exists(parquet_file):
+        return parquet_file
+    return os.path.join(data_dir, name + ".tsv")
+
+
+def read_table_header(filepath: str, sep="\t") -> list:
+    """Read the column names of a table (a tsv file or a parquet file) without reading the rows."""
+    check_file_exists(filepath)
+
+    if detect_table_format(filepath) == "parquet":
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(filepath).names
+    return pd.read_csv(filepath, sep=sep, nrows=0).columns.tolist()
+
+
+def write_table(df: pd.DataFrame, output_file: str, output_format="tsv"):
+    """Write a table as a tsv file or a parquet file.
+
+    Args:
+        df (pd.DataFrame): the table.
+        output_file (str): path to the output file.
+        output_format (str, optional): tsv or parquet. Defaults to "tsv".
+    """
+    if output_format == "tsv":
+        df.to_csv(output_file, sep="\t", index=False)
+    elif output_format == "parquet":
+        df.to_parquet(output_file, index=False)
+    else:
+        raise ValueError("Unknown output format: %s" % output_format)
+
+
+class ChunkWriter:
+    """Write the chunks of a table to a tsv file or to the row groups of a parquet file, all columns are written as strings.
+
+    Examples:
+        >>> with ChunkWriter("relations.parquet", header, "parquet") as writer:
+        ...     for chunk in chunks:
+        ...         writer.write(chunk)
+    """
+
+    def __init__(self, output_file, header, output_format="tsv"):
+        if output_format not in table_formats:
+            raise ValueError("Unknown output format: %s" % output_format)
+        self.output_file = output_file
+        self.header = list(header)
+        self.output_format = output_format
+
+    def __enter__(self):
+        if self.output_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            self._schema = pa.schema([(col, pa.string()) for col in self.header])
+            self._writer = pq.ParquetWriter(self.output_file, self._schema)
+        else:
+            self._writer = open(self.output_file, "w")
+            self._writer.write("\t".join(self.header) + "\n")
+        return self
+
+    def write(self, chunk: pd.DataFrame):
+        chunk = chunk[self.header]
+        if self.output_format == "parquet":
+            import pyarrow as pa
+
+            # The categorical columns are converted from dictionaries to strings
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            self._writer.write_table(table.cast(self._schema))
+        else:
+            chunk.to_csv(self._writer, sep="\t", index=False, header=False)
+
+    def __exit__(self, *exc):
+        self._writer.close()
+
+
+def iter_table_chunks(filepath: str, chunk_size: int, usecols=None, sep="\t"):
+    """Read a table (a tsv file or a parquet file) chunk by chunk, all values are kept as strings.
+
+    Args:
+        filepath (str): path to the table.
+        chunk_size (int): the number of rows per chunk.
+        usecols (list, optional): the columns to read. Defaults to None, i.e. all columns.
+        sep (str, optional): the separator of a tsv file. Defaults to "\t".
+
+    Yields:
+        pd.DataFrame: a chunk of the table.
+    """
+    check_file_exists(filepath)
+
+    if detect_table_format(filepath) == "parquet":
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(filepath)
+        columns = [
+            col for col in parquet_file.schema_arrow.names if usecols is None or col in usecols
+        ]
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(
+            filepath, sep=sep, usecols=usecols, dtype=str, chunksize=chunk_size
+        )
+
+
+def filter_table(df: pd.DataFrame, filters=None) -> pd.DataFrame:
+    """Keep the rows which match all filters, it's the in-memory counterpart of the filters of pd.read_parquet.
+
+    Args:
+        df (pd.DataFrame): the table.
+        filters (list, optional): a list of (column, operator, value) tuples, such as [("source_type", "in", ["Gene"])]. The operator is one of =, ==, !=, <, <=, >, >=, in and not in. Defaults to None.
+
+    Returns:
+        pd.DataFrame: the matched rows.
+    """
+    if not filters:
+        return df
+
+    mask = pd.Series(True, index=df.index)
+    for column, operator, value in filters:
+        if operator not in filter_operators:
+            raise ValueError("Unknown filter operator: %s" % operator)
+        mask &= filter_operators[operator](df[column], value)
+    return df[mask]
+
+
+def _read_parquet(filepath: str, usecols=None, filters=None) -> pd.DataFrame:
+    """Read the columns of a parquet file in the order of the file, the same as the usecols of pd.read_csv."""
+    header = read_table_header(filepath)
+    columns = [col for col in header if usecols is None or col in usecols]
+    if usecols is not None:
+        check_columns(pd.DataFrame(columns=columns), usecols)
+
+    return pd.read_parquet(filepath, columns=columns, filters=filters or None)
+
+
+def read_entity_table(
+    entity_file: str, usecols=None, filters=None, sep="\t", **kwargs
+) -> pd.DataFrame:
+    """Read an entity table, a tsv file or a parquet file, all values are kept as strings.
+
+    Args:
+        entity_file (str): path to the entity file.
+        usecols (list, optional): the columns to read. Defaults to None, i.e. all columns.
+        filters (list, optional): the filters of the rows, see filter_table. They are pushed down to the row groups of a parquet file. Defaults to None.
+        sep (str, optional): the separator of a tsv file. Defaults to "\t".
+        **kwargs: other arguments of pd.read_csv.
+
+    Returns:
+        pd.DataFrame: the entities.
+    """
+    check_file_exists(entity_file)
+
+    if detect_table_format(entity_file) == "parquet":
+        entities = _read_parquet(entity_file, usecols=usecols, filters=filters)
+    else:
+        entities = pd.read_csv(
+            entity_file, sep=sep, usecols=usecols, dtype=str, **kwargs
+        )
+
+    return filter_table(entities, filters)
+
+
+def estimate_object_memory(df: pd.DataFrame) -> int:
+    """Estimate the memory of a dataframe as if all categorical columns were object columns, i.e. the default dtypes of pd.read_csv.
+
+    Args:
+        df (pd.DataFrame): the dataframe.
+
+    Returns:
+        int: the estimated memory in bytes.
+    """
+    total = df.index.memory_usage()
+    for col in df.columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes = values.cat.codes.to_numpy()
+            sizes = np.array(
+                [sys.getsizeof(category) for category in values.cat.categories],
+                dtype=np.int64,
+            )
+            counts = np.bincount(codes[codes >= 0], minlength=len(sizes))
+            # An object column keeps a pointer and a string object per row
+            total += 8 * len(values) + int(counts @ sizes)
+        else:
+            total += values.memory_usage(deep=True, index=False)
+    return total
+
+
+def read_relation_table(
+    relation_file: str,
+    usecols=None,
+    categorical=True,
+    engine="pyarrow",
+    sep="\t",
+    report_memory=True,
+    filters=None,
+    **kwargs,
+) -> pd.DataFrame:
+    """Read a relation table (a tsv file or a parquet file) with low memory, the low-cardinality columns are categorical and the others are strings.
+
+    Args:
+        relation_file (str): path to the relation file.
+        usecols (list, optional): the columns to read. Defaults to None, i.e. all columns.
+        categorical (bool, optional): read the source_type, target_type, relation_type and resource columns as categorical columns. Set it to False if the values of these columns will be modified. Defaults to True.
+        engine (str, optional): the engine of pd.read_csv. The pyarrow engine parses the file with multiple threads, it falls back to the c engine if pyarrow isn't installed or doesn't support the arguments. Defaults to "pyarrow".
+        sep (str, optional): the separator of a tsv file. Defaults to "\t".
+        report_memory (bool, optional): log the memory of the dataframe and the estimated memory with the default dtypes. Defaults to True.
+        filters (list, optional): the filters of the rows, see filter_table. They are pushed down to the row groups of a parquet file. Defaults to None.
+        **kwargs: other arguments of pd.read_csv, they are ignored for a parquet file.
+
+    Returns:
+        pd.DataFrame: the relations.
+    """
+    check_file_exists(relation_file)
+
+    if detect_table_format(relation_file) == "parquet":
+        relations = _read_parquet(relation_file, usecols=usecols, filters=filters)
+        for col in relations.columns:
+            is_categorical = isinstance(relations[col].dtype, pd.CategoricalDtype)
+            if categorical and col in categorical_columns and not is_categorical:
+                relations[col] = relations[col].astype("category")
+            elif not categorical and is_categorical:
+                relations[col] = relations[col].astype(object)
+        _report_memory(relations, relation_file, report_memory)
+        return relations
+
+    header = read_table_header(relation_file, sep=sep)
+    columns = [col for col in header if usecols is None or col in usecols]
+    if usecols is not None:
+        check_columns(pd.DataFrame(columns=columns), usecols)
+
+    dtype = {
+        col: "category" if categorical and col in categorical_columns else str
+        for col in columns
+    }
+
+    try:
+        relations = pd.read_csv(
+            relation_file,
+            sep=sep,
+            usecols=usecols,
+            dtype=dtype,
+            engine=engine,
+            **kwargs,
+        )
+    except (ImportError, ValueError) as e:
+        if engine == "c":
+            raise
+        logger.info(
+            "Cannot read %s with the %s engine (%s), fall back to the c engine"
+            % (relation_file, engine, e)
+        )
+        relations = pd.read_csv(
+            relation_file, sep=sep, usecols=usecols, dtype=dtype, engine="c", **kwargs
+        )
+
+    # The pyarrow engine returns the columns in the order of usecols instead of the file
+    relations = filter_table(relations[columns], filters)
+    _report_memory(relations, relation_file, report_memory)
+    return relations
+
+
+def _report_memory(relations: pd.DataFrame, relation_file: str, report_memory=True):
+    if report_memory:
+        memory = relations.memory_usage(deep=True).sum()
+        object_memory = estimate_object_memory(relations)
+        logger.info(
+            "Loaded %s relations from %s: %.1f MB in memory, about %.1f MB with the default dtypes"
+            % (
+                len(relations),
+                relation_file,
+                memory / 1024 / 1024,
+                object_memory / 1024 / 1024,
+            )
+        )
@@ -1,10 +1,21 @@
+import re
+import numpy as np
 import pandas as pd
 from typing import List, Dict, Union
 
+try:
+    from .check import check_columns, make_node_keys
+    from .kg_loader import read_entity_table, write_table
+except ImportError:
+    from check import check_columns, make_node_keys
+    from kg_loader import read_entity_table, write_table
+
 # Return matched line if a id matches with the id or xrefs in the entities.tsv
 def get_matched_id(id: str, etype: str, entities: pd.DataFrame) -> Union[None, str]:
     """Get matched id if a id matches with the id or xrefs in the entities.tsv
 
+    It scans all entities on every call, use XrefIndex to look up many ids.
+
     Args:
         id (str): entity id
         etype (str): entity type
@@ -13,10 +24,7 @@ def get_matched_id(id: str, etype: str, entities: pd.DataFrame) -> Union[None, s
     Returns:
         str: matched id
     """
-    rows = entities[
-        ((entities["id"] == id) | entities["xrefs"].str.contains(id))
-        & (entities["label"] == etype)
-    ]
+    rows = entities[_match_id_or_xrefs(id, entities) & (entities["label"] == etype)]
     if len(rows) == 0:
         return None
     else:
@@ -26,6 +34,8 @@ def get_matched_id(id: str, etype: str, entities: pd.DataFrame) -> Union[None, s
 def get_matched_name(id: str, etype: str, entities: pd.DataFrame) -> Union[None, str]:
     """Get matched name if a id matches with the id or xrefs in the entities.tsv
 
+    It scans all entities on every call, use XrefIndex to look up many ids.
+
     Args:
         id (str): entity id
         etype (str): entity type
@@ -34,15 +44,134 @@ def get_matched_name(id: str, etype: str, entities: pd.DataFrame) -> Union[None,
     Returns:
         str: matched name
     """
-    rows = entities[
-        ((entities["id"] == id) | entities["xrefs"].str.contains(id))
-        & (entities["label"] == etype)
-    ]
+    rows = entities[_match_id_or_xrefs(id, entities) & (entities["label"] == etype)]
     if len(rows) == 0:
         return None
     else:
         return rows.iloc[0]["name"]
 
+
+def _match_id_or_xrefs(id: str, entities: pd.DataFrame, sep="|") -> pd.Series:
+    """Match the id with the id or one of the xrefs of each entity exactly, the id isn't a regex and doesn't match a part of a xref."""
+    if not id:
+        # An empty id would match the entities without xrefs
+        return pd.Series(False, index=entities.index)
+    xrefs = sep + _normalize_xrefs(entities["xrefs"], sep) + sep
+    return (entities["id"] == id) | xrefs.str.contains(sep + id + sep, regex=False)
+
+
+def _normalize_xrefs(xrefs: pd.Series, sep="|") -> pd.Series:
+    """Remove the whitespace around the separators and at both ends of the xrefs, such as "A:1 | B:2 " -> "A:1|B:2"."""
+    pattern = r"\s*" + re.escape(sep) + r"\s*"
+    return xrefs.fillna("").astype(str).str.replace(pattern, sep, regex=True).str.strip()
+
+
+class XrefIndex:
+    """A hash index of (xref, label) -> the canonical id and name of the entity.
+
+    The ids and the xrefs of the entities are exploded once, so a lookup doesn't scan the entities like get_matched_id and get_matched_name. A xref matches exactly, i.e. MESH:D0001 doesn't match MESH:D00012. If several entities have the same xref and label, the first entity wins, the same as get_matched_id.
+
+    Examples:
+        >>> index = XrefIndex(entities)
+        >>> index.get_id("MESH:D000086382", "Disease")
+        'MONDO:0100096'
+        >>> relations["source_id"] = index.get_ids(relations["source_id"], relations["source_type"])
+        >>> index.save("xref_index.parquet")
+        >>> index = XrefIndex.load("xref_index.parquet")
+    """
+
+    columns = ["xref", "label", "id", "name"]
+
+    def __init__(self, entities: pd.DataFrame, sep="|"):
+        """Build the index from the entities.
+
+        Args:
+            entities (pd.DataFrame): the entities with the id, label, name and xrefs columns.
+            sep (str, optional): the separator of the xrefs. Defaults to "|".
+        """
+        check_columns(entities, ["id", "label", "name", "xrefs"])
+        entities = entities.reset_index(drop=True)
+        xrefs = _normalize_xrefs(entities["xrefs"], sep).str.split(sep).explode()
+
+        # The id of an entity comes before its xrefs, the row order of the entities is kept
+        table = pd.concat(
+            [
+                pd.DataFrame({"row": entities.index, "xref": entities["id"]}),
+                pd.DataFrame({"row": xrefs.index, "xref": xrefs.to_numpy()}),
+            ],
+            ignore_index=True,
+        )
+        table = table[table["xref"].notna() & (table["xref"] != "")]
+        table = table.sort_values("row", kind="stable")
+        table = table.assign(
+            label=entities["label"].to_numpy()[table["row"]],
+            id=entities["id"].to_numpy()[table["row"]],
+            name=entities["name"].to_numpy()[table["row"]],
+        )
+        self._set_table(table.drop_duplicates(subset=["xref", "label"]))
+
+    def _set_table(self, table: pd.DataFrame):
+        self.table = table[self.columns].reset_index(drop=True)
+        self._index = pd.Index(make_node_keys(self.table["label"], self.table["xref"]))
+        # The position -1 of a missing key picks the None at the end
+        self._ids = np.append(self.table["id"].to_numpy(dtype=object), None)
+        self._names = np.append(self.table["name"].to_numpy(dtype=object), None)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def _get_positions(self, ids, etypes) -> np.ndarray:
+        ids = pd.Series(ids)
+        if isinstance(etypes, str):
+            etypes = pd.Series(etypes, index=ids.index)
+        else:
+            # Align by position, the etypes may have a different index
+            etypes = pd.Series(np.asarray(etypes, dtype=object), index=ids.index)
+        return self._index.get_indexer(make_node_keys(etypes, ids))
+
+    def get_ids(self, ids: pd.Series, etypes: Union[str, pd.Series]) -> pd.Series:
+        """Get the canonical ids of a batch of ids.
+
+        Args:
+            ids (pd.Series): the ids or the xrefs.
+            etypes (Union[str, pd.Series]): the entity type of all ids or the entity type of each id.
+
+        Returns:
+            pd.Series: the canonical ids with the index of the ids, None if an id isn't matched.
+        """
+        ids = pd.Series(ids)
+        return pd.Series(
+            self._ids[self._get_positions(ids, etypes)], index=ids.index, dtype=object
+        )
+
+    def get_names(self, ids: pd.Series, etypes: Union[str, pd.Series]) -> pd.Series:
+        """Get the names of a batch of ids, see get_ids."""
+        ids = pd.Series(ids)
+        return pd.Series(
+            self._names[self._get_positions(ids, etypes)], index=ids.index, dtype=object
+        )
+
+    def get_id(self, id: str, etype: str) -> Union[None, str]:
+        """Get the canonical id of an id or a xref, the same as get_matched_id."""
+        return self.get_ids([id], etype).iloc[0]
+
+    def get_name(self, id: str, etype: str) -> Union[None, str]:
+        """Get the name of an id or a xref, the same as get_matched_name."""
+        return self.get_names([id], etype).iloc[0]
+
+    def save(self, filepath: str):
+        """Save the index to a parquet file if the file name ends with .parquet, otherwise to a tsv file."""
+        output_format = "parquet" if filepath.endswith(".parquet") else "tsv"
+        write_table(self.table, filepath, output_format)
+
+    @classmethod
+    def load(cls, filepath: str) -> "XrefIndex":
+        """Load the index which is saved by XrefIndex.save."""
+        index = cls.__new__(cls)
+        index._set_table(read_entity_table(filepath, usecols=cls.columns))
+        return index
+
+
 def remove_whitespace(text: str) -> str:
     """Remove whitespace from text
 